@@ -0,0 +1,87 @@
+import multiprocessing
+import shutil
+import tempfile
+
+import battle_log
+import battle_shared
+import battle_snapshot
+
+# (model or snapshot directory, model class, mutate_fn, max_steps, summary) of
+# the branches run by the current worker process
+_job = None
+
+
+def battle_summary(model):
+    """ Default outcome of a branch: steps taken and living agents per side. """
+    red = model.alive_count('red')
+    blue = model.alive_count('blue')
+    winner = None
+    if not red or not blue:
+        winner = 'red' if red else 'blue' if blue else None
+    return {'steps': model.schedule.steps, 'red': red, 'blue': blue, 'winner': winner}
+
+
+def branch(model, n, mutate_fn=None, max_steps=1000, nr_processes=None, summary=battle_summary):
+    """ Continue a battle in n variants, in parallel worker processes.
+
+    Where processes can be forked, every branch runs in a fresh fork of this
+    process, which starts from a copy-on-write copy of the model as it is now.
+    Elsewhere the model is snapshotted once and every branch restores it (then
+    mutate_fn and summary have to be picklable).
+
+    Args:
+        model: The BattleModel to branch from, between steps.
+        n: Number of branches.
+        mutate_fn: Optional function (model, branch number) making the changes
+                   of a branch (parameters, agents, model.reset_randomizer...)
+                   before it continues.
+        max_steps: Step number at which branches stop if still running.
+        nr_processes: Number of worker processes; by default one per CPU.
+        summary: Function turning the model at the end of a branch into the
+                 result of that branch.
+
+    Returns:
+        The list of the n branch results, in branch order.
+    """
+    fork = 'fork' in multiprocessing.get_all_start_methods()
+    directory = None
+    if fork:
+        context = multiprocessing.get_context('fork')
+        source = model
+    else:
+        context = multiprocessing.get_context()
+        directory = tempfile.mkdtemp()
+        model.snapshot(directory)
+        source = directory
+    job = (source, type(model), mutate_fn, max_steps, summary)
+    try:
+        with context.Pool(nr_processes, initializer=_init_branch, initargs=(job,),
+                          maxtasksperchild=1 if fork else None) as pool:
+            return pool.map(_run_branch, range(n), chunksize=1)
+    finally:
+        if directory is not None:
+            shutil.rmtree(directory)
+
+
+def _init_branch(job):
+    global _job
+    _job = job
+
+
+def _run_branch(i):
+    source, model_class, mutate_fn, max_steps, summary = _job
+    if isinstance(source, str):
+        model = battle_snapshot.load(model_class, source, mmap_mode='c')
+    else:
+        # the fork's own copy; the log of the parent has no writer thread here
+        model = source
+        model.verbosity = battle_log.OFF
+        model.log = battle_log.NullLog()
+        if model.shared is not None:
+            # the fork maps the parent's shared battle state: take a private copy, leaving the blocks to the parent
+            battle_shared.unshare(model, unlink=False)
+    if mutate_fn is not None:
+        mutate_fn(model, i)
+    while model.running and model.schedule.steps < max_steps:
+        model.step()
+    return summary(model)
@@ -0,0 +1,237 @@
+import random
+
+import numpy as np
+
+from mesa.time import SimultaneousActivation
+
+import battle_log
+import csr
+
+
+class SimultaneousCombatActivation(SimultaneousActivation):
+    """ Activation of the simultaneous combat mode of BattleModel.
+
+    All agents step, choosing what to do from the state the step started
+    with: their attacks, heals and protections are recorded by the model's
+    Combat and their moves are staged. Then the Combat resolves everything at
+    once, and the agents still alive advance, making their moves.
+
+    """
+
+    def step(self):
+        """ Step all agents, resolve their combat, then advance the living ones. """
+        agent_keys = list(self._agents.keys())
+        self.model.combat.draw_seeds()
+        for agent_key in agent_keys:
+            self._agents[agent_key].step()
+        self.model.combat.resolve()
+        for agent_key in agent_keys:
+            agent = self._agents.get(agent_key)
+            if agent is not None:
+                agent.advance()
+        self.steps += 1
+        self.time += 1
+
+
+class Combat:
+    """ Combat of one step of the simultaneous combat mode of BattleModel.
+
+    While the agents step, their attacks, heals and guard protections are
+    only recorded here, so that all of them choose their targets from the
+    same state. resolve() then applies them all at once:
+
+    - the protections of the last step end; of guards claiming the same ally
+      the one with the lowest unique_id protects it, the others nobody,
+    - heals are summed per ally, up to its initial hp,
+    - flaggers encourage their allies,
+    - damage is scatter-added per receiver: the target, or for a normal (not
+      precise) attack on a protected target, its guard. The attack bringing
+      a receiver down to 0 hp is the killing one,
+    - everyone brought down to 0 hp dies, in one pass.
+
+    Records are resolved in the order of the unique_ids of the agents that
+    made them and agents draw their random numbers from a generator of their
+    own for the step (random_for), seeded by one batched draw of the model's
+    rng per step, so the outcome of a step does not depend on the order in
+    which the agents stepped.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        # guard -> ally it has protected since the last resolve
+        self.protecting = {}
+        # agents whose deaths resolve applies; None for all (a battle_domains worker only applies those of its own)
+        self.owned = None
+        # seeds of the agents' generators in the current step, by unique_id
+        self.seeds = []
+        self._random_key = None
+        self._random = None
+        self.clear()
+
+    def draw_seeds(self):
+        """ Draw the seeds of the agents' generators for the step, for every unique_id at once, from the model's rng.
+
+        Called once at the start of every step, whoever steps the agents, so the rng is in the same state in the model
+        and in every battle_domains worker.
+        """
+        self.seeds = self.model.rng.integers(2 ** 63, size=self.model.next_agent_id, dtype=np.int64).tolist()
+        self._random_key = None
+        self._random = None
+
+    def clear(self):
+        """ Drop everything recorded in the current step. """
+        self.attacks = []  # (attacker, target, damage, precise)
+        self.heals = []  # (healer, ally, amount)
+        self.claims = []  # (guard, ally)
+        self.courage = []  # (flagger, allies)
+
+    def random_for(self, agent):
+        """ Random number generator of the agent in the current step, determined by its seed drawn for the step. """
+        if agent.unique_id != self._random_key:
+            self._random_key = agent.unique_id
+            self._random = random.Random(self.seeds[agent.unique_id])
+        return self._random
+
+    def attack(self, attacker, target, damage, precise=False):
+        self.attacks.append((attacker, target, damage, precise))
+
+    def heal(self, healer, ally, amount):
+        self.heals.append((healer, ally, amount))
+
+    def protect(self, guard, ally):
+        self.claims.append((guard, ally))
+
+    def encourage(self, flagger, allies):
+        self.courage.append((flagger, allies))
+
+    def resolve(self):
+        """ Apply everything recorded in the current step at once. """
+        logging = not isinstance(self.model.log, battle_log.NullLog)
+        self._resolve_protections()
+        self._resolve_heals(logging)
+        self._resolve_courage()
+        for agent in self._resolve_attacks(logging):
+            agent.staged_move = None
+            agent.die()
+        self.clear()
+
+    def _resolve_protections(self):
+        for guard, ally in self.protecting.items():
+            guard.guarded_ally = guard
+            guard.guarding = False
+            if ally.guarder is guard:
+                ally.protected = False
+        self.protecting = {}
+        protected = set()
+        for guard, ally in sorted(self.claims, key=lambda claim: claim[0].unique_id):
+            if ally in protected:
+                guard.log(battle_log.NOBODY_TO_GUARD)
+                continue
+            protected.add(ally)
+            self.protecting[guard] = ally
+            guard.guarding = True
+            guard.guarded_ally = ally
+            ally.guarder = guard
+            ally.protected = True
+            guard.log(battle_log.PROTECT, ally)
+
+    def _resolve_heals(self, logging):
+        if not self.heals:
+            return
+        healers, allies, amounts = zip(*sorted(self.heals, key=lambda heal: heal[0].unique_id))
+        healed, order, indptr = _group(allies)
+        rows = csr.row_numbers(indptr)
+        hp = np.array([ally.hp for ally in healed])
+        initial_hp = np.array([ally.initial_hp for ally in healed])
+        after = hp[rows] + csr.row_cumsums(indptr, np.array(amounts)[order])
+        for ally, value in zip(healed, np.minimum(after[indptr[1:] - 1], initial_hp).tolist()):
+            ally.hp = value
+
+        if logging:
+            # hp of the ally after each heal, in the order of the records
+            values = np.empty(len(amounts))
+            values[order] = np.minimum(after, initial_hp[rows])
+            full = np.empty(len(amounts), dtype=bool)
+            full[order] = after >= initial_hp[rows]
+            for healer, ally, amount, value, is_full in zip(healers, allies, amounts, values.tolist(), full.tolist()):
+                if is_full:
+                    healer.log(battle_log.HEAL_FULL, ally, value=value)
+                    ally.log(battle_log.HEALED_FULL, healer, value=value)
+                else:
+                    healer.log(battle_log.HEAL, ally, amount=amount, value=value)
+                    ally.log(battle_log.HEALED, healer, value=value)
+
+    def _resolve_courage(self):
+        for flagger, allies in sorted(self.courage, key=lambda courage: courage[0].unique_id):
+            flagger.log(battle_log.COURAGE)
+            for soldier in allies:
+                soldier.morale += 0.5
+                flagger.log(battle_log.COURAGE_ALLY, soldier)
+                soldier.log(battle_log.ENCOURAGED, flagger)
+            flagger.log(battle_log.COURAGE_END)
+
+    def _resolve_attacks(self, logging):
+        """ Apply the damage of all attacks; returns the (owned) agents it kills, by unique_id. """
+        if not self.attacks:
+            return []
+        attackers, targets, damages, precise = zip(*sorted(self.attacks, key=lambda attack: attack[0].unique_id))
+        receivers = [target.guarder if target.protected and not is_precise else target
+                     for target, is_precise in zip(targets, precise)]
+        hit, order, indptr = _group(receivers)
+        rows = csr.row_numbers(indptr)
+        hp = np.array([agent.hp for agent in hit])
+        damages = np.array(damages)
+        direct = np.array([receiver is target for receiver, target in zip(receivers, targets)])
+
+        # hp of the receiver after each attack, in the order of the receivers
+        after = hp[rows] - csr.row_cumsums(indptr, damages[order])
+        before = np.empty(len(after))
+        before[1:] = after[:-1]
+        before[indptr[:-1]] = hp
+        killing = np.empty(len(after), dtype=bool)
+        killing[order] = (after <= 0) & (before > 0)
+        received = csr.row_sums(indptr, np.where(direct, damages, 0.0)[order])
+        final = after[indptr[1:] - 1].tolist()
+        for agent, value, damage in zip(hit, final, received.tolist()):
+            agent.hp = value
+            agent.damage_received_recently += damage
+        for attacker, target, is_precise, is_killing in zip(attackers, targets, precise, killing.tolist()):
+            if is_precise:
+                target.morale -= 0.05
+            if is_killing:
+                attacker.has_killed_recently = True
+
+        if logging:
+            values = np.empty(len(after))
+            values[order] = after
+            for attacker, target, receiver, damage, is_precise, value, is_killing in zip(
+                    attackers, targets, receivers, damages.tolist(), precise, values.tolist(), killing.tolist()):
+                if is_precise:
+                    target.log(battle_log.PRECISE_DAMAGED, attacker, amount=damage, value=value)
+                    if is_killing:
+                        attacker.log(battle_log.HIT_KILL, target)
+                    continue
+                if receiver is target:
+                    target.log(battle_log.DAMAGED, attacker, amount=damage, value=value)
+                    attacker.log(battle_log.ATTACK, target, amount=damage)
+                else:
+                    receiver.log(battle_log.GUARD_DAMAGED, attacker, target, amount=damage, value=value)
+                    attacker.log(battle_log.ATTACK_GUARDED, target, receiver, amount=damage)
+                if is_killing:
+                    attacker.log(battle_log.KILL)
+
+        return sorted((agent for agent, value in zip(hit, final)
+                       if value <= 0 and (self.owned is None or agent in self.owned)), key=lambda agent: agent.unique_id)
+
+
+def _group(agents):
+    """ Distinct agents of a list, in order of first appearance, with the
+    order of the list sorted by agent and the CSR row pointers of that order.
+
+    """
+    index = {}
+    rows = np.array([index.setdefault(agent, len(index)) for agent in agents], dtype=int)
+    order = np.argsort(rows, kind='stable')
+    indptr = np.zeros(len(index) + 1, dtype=int)
+    np.cumsum(np.bincount(rows, minlength=len(index)), out=indptr[1:])
+    return list(index), order, indptr
@@ -0,0 +1,512 @@
+import io
+import multiprocessing
+import pickle
+import shutil
+import tempfile
+from collections import Counter
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import mesa
+from mesa.space import ContinuousSpace
+
+import battle_combat
+import battle_log
+import battle_snapshot
+import simulation_parameters
+import warrior_agent
+
+# Farthest any agent looks at others (when scanning for enemies to move
+# towards); a domain needs the agents this close to its strip.
+HALO_RADIUS = max(simulation_parameters.VISION_RANGE, simulation_parameters.INTERACTION_RADIUS)
+
+# One row of the state other domains read of an agent near the edge of a strip.
+HALO_DTYPE = np.dtype([('unique_id', '<i8'), ('x', '<f8'), ('y', '<f8'), ('vx', '<f8'), ('vy', '<f8'),
+                       ('hp', '<f8'), ('morale', '<f8'), ('protected', 'u1'), ('guarder', '<i8')])
+
+
+class DomainRunner:
+    """ Steps a battle in simultaneous_combat mode in several processes, one
+    per vertical strip of its space.
+
+    Every worker process owns the agents in its strip: it steps them,
+    resolves their combat and morale and moves them. Each step, the state of
+    the agents within halo of the edges of a strip is written to a shared
+    memory block of its worker, from which the workers of the strips around
+    read it into ghost copies of those agents, so that the agents they own
+    see everyone they would see in one model. Combat records go to the
+    workers within halo, commander and guard deaths to everyone, and agents
+    leaving a strip migrate to the worker of the strip they moved into.
+
+    The battle goes exactly as BattleModel.step would take it, step after
+    step. The model itself is only brought up to date by close(); until
+    then only its step number, its counts of living agents and running are.
+
+    Logging is off in the workers; end conditions may use only alive_count
+    and the step number of the model.
+    """
+
+    def __init__(self, model, nr_domains=None, halo=HALO_RADIUS):
+        """ Split the battle of the model and start the worker processes.
+
+        Args:
+            model: BattleModel in simultaneous_combat mode, between steps,
+                   without vectorized_movement or use_battle_state.
+            nr_domains: Number of strips (and worker processes); by default
+                        one per CPU.
+            halo: Width of the halo of a strip; at least the farthest any
+                  agent looks at others.
+        """
+        if model.combat is None:
+            raise ValueError("Domain decomposition needs a model in simultaneous_combat mode")
+        if model.vectorized_movement or model.state is not None:
+            raise ValueError("Domain decomposition does not support vectorized_movement or use_battle_state")
+        self.model = model
+        self.nr_domains = nr_domains or multiprocessing.cpu_count()
+        space = model.space
+        self.edges = np.linspace(space.x_min, space.x_max, self.nr_domains + 1)
+
+        capacity = max(len(space._agent_to_index), 1)
+        self.blocks = [_Block(shared_memory.SharedMemory(create=True, size=8 + capacity * HALO_DTYPE.itemsize),
+                              capacity) for _ in range(self.nr_domains)]
+        fork = 'fork' in multiprocessing.get_all_start_methods()
+        self.directory = None
+        if fork:
+            context = multiprocessing.get_context('fork')
+            source = model
+            blocks = self.blocks
+        else:
+            context = multiprocessing.get_context()
+            self.directory = tempfile.mkdtemp()
+            model.snapshot(self.directory)
+            source = self.directory
+            blocks = [block.shm.name for block in self.blocks]
+        self.connections = []
+        self.processes = []
+        for number in range(self.nr_domains):
+            parent_end, child_end = context.Pipe()
+            process = context.Process(target=_run_domain, daemon=True,
+                                      args=(child_end, source, type(model), number, self.edges, halo, blocks,
+                                            capacity))
+            process.start()
+            self.connections.append(parent_end)
+            self.processes.append(process)
+        # domains whose strips are within halo of each strip
+        self.neighbors = [[v for v in range(self.nr_domains)
+                           if v != w and self.edges[v] < self.edges[w + 1] + halo and
+                           self.edges[v + 1] > self.edges[w] - halo]
+                          for w in range(self.nr_domains)]
+        self._all('write_block')
+
+    def _all(self, command, arguments=None):
+        """ Run a command in every worker, with its own argument; returns their results. """
+        if arguments is None:
+            arguments = [None] * self.nr_domains
+        for connection, argument in zip(self.connections, arguments):
+            connection.send((command, argument))
+        return [connection.recv() for connection in self.connections]
+
+    def step(self):
+        """ Advance the battle by one step, like BattleModel.step. """
+        # the workers draw the seeds of the step from their copies of the rng; keep the model's rng in step with them
+        self.model.combat.draw_seeds()
+        records = self._all('stage')
+        deaths = self._all('resolve', [[records[v] for v in self.neighbors[w]] for w in range(self.nr_domains)])
+        migrants = self._all('advance', [[deaths[v] for v in range(self.nr_domains) if v != w]
+                                         for w in range(self.nr_domains)])
+        self._all('settle', [[migrants[v][w] for v in range(self.nr_domains) if w in migrants[v]]
+                             for w in range(self.nr_domains)])
+
+        # commanders fleeing lower the morale of their soldiers, which can make later commanders flee: repeat until
+        # no more of them flee
+        fleeing = set().union(*self._all('morale'))
+        while True:
+            more = set().union(*self._all('flee', [sorted(fleeing)] * self.nr_domains))
+            if more == fleeing:
+                break
+            fleeing = more
+        results = self._all('apply_morale', [sorted(fleeing)] * self.nr_domains)
+        self._all('unprotect', [[results[v][0] for v in range(self.nr_domains) if v != w]
+                                for w in range(self.nr_domains)])
+
+        model = self.model
+        model.alive_subtypes = sum((counts for _, counts in results), Counter())
+        model.alive_sides = Counter()
+        for (side, subtype), count in model.alive_subtypes.items():
+            model.alive_sides[side] += count
+        model.schedule.steps += 1
+        model.schedule.time += 1
+        if model.verbosity != battle_log.OFF:
+            print("Zywych agentow: " + str(sum(model.alive_sides.values())) + "\n")
+        model.running = not model.end_condition(model)
+        return model.running
+
+    def close(self):
+        """ Bring the model up to date with the state of the workers and stop them. """
+        model = self.model
+        agents = {agent.unique_id: agent
+                  for agent in model.space.get_agents_by_index(range(len(model.space._agent_to_index)))}
+        for payload in self._all('gather'):
+            for unique_id, attributes, pos in _Unpickler(io.BytesIO(payload), model, agents).load():
+                agent = agents[unique_id]
+                agent.__dict__.update(attributes)
+                model.space.move_agent(agent, pos)
+        self._all('stop')
+        for process in self.processes:
+            process.join()
+        for block in self.blocks:
+            block.close()
+            block.shm.unlink()
+        if self.directory is not None:
+            shutil.rmtree(self.directory)
+
+        for agent in list(model.schedule.agent_buffer(False)):
+            if agent.type == 'dead':
+                model.schedule.remove(agent)
+        model.combat.protecting = {agent: agent.guarded_ally for agent in agents.values()
+                                   if agent.subtype == "guard" and agent.guarded_ally is not agent}
+        model.combat.clear()
+        model.graph = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class _Block:
+    """ The halo rows of one domain, in a shared memory block: their count, then the rows. """
+
+    def __init__(self, shm, capacity):
+        self.shm = shm
+        self.count = np.ndarray((1,), dtype=np.int64, buffer=shm.buf)
+        self.rows = np.ndarray((capacity,), dtype=HALO_DTYPE, buffer=shm.buf, offset=8)
+
+    def close(self):
+        del self.count, self.rows
+        self.shm.close()
+
+
+class _Pickler(pickle.Pickler):
+    """ Pickles agents and the model as references, to be resolved to the
+    copies on the other side.
+
+    """
+
+    def __init__(self, f, model):
+        super().__init__(f, pickle.HIGHEST_PROTOCOL)
+        self.model = model
+
+    def persistent_id(self, obj):
+        if obj is self.model:
+            return ('model',)
+        if isinstance(obj, mesa.Agent):
+            return ('agent', obj.unique_id)
+        return None
+
+
+class _Unpickler(pickle.Unpickler):
+    def __init__(self, f, model, agents):
+        super().__init__(f)
+        self.model = model
+        self.agents = agents
+
+    def persistent_load(self, pid):
+        if pid[0] == 'model':
+            return self.model
+        return self.agents[pid[1]]
+
+
+def _run_domain(connection, source, model_class, number, edges, halo, blocks, capacity):
+    if isinstance(source, str):
+        model = battle_snapshot.load(model_class, source)
+        blocks = [_Block(shared_memory.SharedMemory(name), capacity) for name in blocks]
+    else:
+        model = source
+    domain = _Domain(model, number, edges, halo, blocks)
+    while True:
+        command, argument = connection.recv()
+        if command == 'stop':
+            connection.send(None)
+            break
+        connection.send(getattr(domain, command)(argument))
+
+
+class _Domain:
+    """ The part of a battle a worker process of a DomainRunner steps.
+
+    It keeps the whole model it was forked (or restored) with, so every
+    agent has a copy here, but only the agents it owns are in its schedule,
+    and its space holds only those still living and the ghosts: the copies
+    of the living agents within halo of its strip owned by other domains,
+    refreshed from their shared memory blocks.
+    """
+
+    def __init__(self, model, number, edges, halo, blocks):
+        self.model = model
+        self.number = number
+        self.edges = edges
+        self.lo, self.hi = edges[number], edges[number + 1]
+        self.halo = halo
+        self.blocks = blocks
+        self.neighbors = [v for v in range(len(edges) - 1)
+                          if v != number and edges[v] < self.hi + halo and edges[v + 1] > self.lo - halo]
+        model.verbosity = battle_log.OFF
+        model.log = battle_log.NullLog()
+
+        space = model.space
+        everyone = space.get_agents_by_index(range(len(space._agent_to_index)))
+        self.agents = {agent.unique_id: agent for agent in everyone}
+        owners = self.owner(space._agent_points[:, 0])
+        self.owned = {agent for agent, owner in zip(everyone, owners.tolist()) if owner == number}
+        self.ghosts = set()
+        # owned agents that died during the run; taken out of the space at the end of the step
+        self.dead = set()
+        # soldiers of every commander, by unique_id
+        self.soldier_ids = {}
+
+        living = sorted((agent for agent in self.owned if agent.type != 'dead'), key=lambda agent: agent.unique_id)
+        model.space = ContinuousSpace(space.x_max, space.y_max, space.torus, space.x_min, space.y_min,
+                                      cell_size=space.cell_size, group_key=space.group_key,
+                                      verlet_radius=space.verlet_radius, verlet_skin=space.verlet_skin)
+        model.space.place_agents(living, [agent.pos for agent in living])
+        schedule = model.schedule
+        model.schedule = battle_combat.SimultaneousCombatActivation(model)
+        model.schedule.steps = schedule.steps
+        model.schedule.time = schedule.time
+        model.schedule.add_agents(living)
+        model.graph = None
+        model.neighbor_cache = warrior_agent.NeighborCache(model)
+        model.combat.owned = self.owned
+        model.combat.clear()
+
+    def owner(self, x):
+        """ Domain of the strip of every x coordinate. """
+        return np.clip(np.searchsorted(self.edges, x, side='right') - 1, 0, len(self.edges) - 2)
+
+    def living(self):
+        """ Living agents of the domain, by unique_id. """
+        return sorted(self.model.schedule.agent_buffer(False), key=lambda agent: agent.unique_id)
+
+    def write_block(self, argument=None):
+        """ Write the owned agents within halo of the edges of the strip to the block of the domain. """
+        near = [agent for agent in self.living()
+                if agent.pos[0] < self.lo + self.halo or agent.pos[0] >= self.hi - self.halo]
+        block = self.blocks[self.number]
+        rows = block.rows[:len(near)]
+        rows['unique_id'] = [agent.unique_id for agent in near]
+        positions = np.array([agent.pos for agent in near], dtype=float).reshape(-1, 2)
+        rows['x'] = positions[:, 0]
+        rows['y'] = positions[:, 1]
+        velocities = np.array([agent.velocity for agent in near], dtype=float).reshape(-1, 2)
+        rows['vx'] = velocities[:, 0]
+        rows['vy'] = velocities[:, 1]
+        rows['hp'] = [agent.hp for agent in near]
+        rows['morale'] = [agent.morale for agent in near]
+        rows['protected'] = [agent.protected for agent in near]
+        rows['guarder'] = [agent.guarder.unique_id for agent in near]
+        block.count[0] = len(near)
+
+    def read_halo(self):
+        """ Bring the ghosts up to date with the blocks of the domains around. """
+        rows = [self.blocks[v].rows[:self.blocks[v].count[0]] for v in self.neighbors]
+        rows = np.concatenate(rows) if rows else np.zeros(0, dtype=HALO_DTYPE)
+        rows = rows[(rows['x'] >= self.lo - self.halo) & (rows['x'] < self.hi + self.halo)]
+        space = self.model.space
+        ghosts = [self.agents[unique_id] for unique_id in rows['unique_id'].tolist()]
+        current = set(ghosts)
+        for agent in self.ghosts - current:
+            if agent in space._agent_to_index:
+                space.remove_agent(agent)
+        self.ghosts = current
+
+        positions = np.column_stack((rows['x'], rows['y']))
+        new = [i for i, agent in enumerate(ghosts) if agent not in space._agent_to_index]
+        if new:
+            space.place_agents([ghosts[i] for i in new], positions[new])
+        velocities = np.column_stack((rows['vx'], rows['vy']))
+        is_new = np.zeros(len(ghosts), dtype=bool)
+        is_new[new] = True
+        for agent, pos, velocity, placed, hp, morale, protected, guarder in zip(
+                ghosts, positions, velocities, is_new.tolist(), rows['hp'].tolist(), rows['morale'].tolist(),
+                rows['protected'].tolist(), rows['guarder'].tolist()):
+            if not placed:
+                space.move_agent(agent, pos)
+            agent.velocity = velocity
+            agent.hp = hp
+            agent.morale = morale
+            agent.protected = bool(protected)
+            agent.guarder = self.agents[guarder]
+
+    def stage(self, argument=None):
+        """ Step the owned agents; returns their combat records, by unique_id. """
+        self.read_halo()
+        self.model.interaction_graph()
+        self.model.combat.draw_seeds()
+        for agent in self.living():
+            agent.step()
+        combat = self.model.combat
+        return ([(attacker.unique_id, target.unique_id, damage, precise)
+                 for attacker, target, damage, precise in combat.attacks],
+                [(healer.unique_id, ally.unique_id, amount) for healer, ally, amount in combat.heals],
+                [(guard.unique_id, ally.unique_id) for guard, ally in combat.claims],
+                [(flagger.unique_id, [ally.unique_id for ally in allies]) for flagger, allies in combat.courage])
+
+    def resolve(self, records):
+        """ Resolve the combat of the owned agents with the records of the domains around; returns the deaths of
+        commanders and guards among them.
+        """
+        agents = self.agents
+        combat = self.model.combat
+        for attacks, heals, claims, courage in records:
+            combat.attacks.extend((agents[attacker], agents[target], damage, precise)
+                                  for attacker, target, damage, precise in attacks)
+            combat.heals.extend((agents[healer], agents[ally], amount) for healer, ally, amount in heals)
+            combat.claims.extend((agents[guard], agents[ally]) for guard, ally in claims)
+            combat.courage.extend((agents[flagger], [agents[ally] for ally in allies]) for flagger, allies in courage)
+        living = self.model.schedule.get_agent_count()
+        combat.resolve()
+        if self.model.schedule.get_agent_count() == living:
+            return [], []
+        return self.deaths()
+
+    def deaths(self):
+        """ Commanders (by unique_id) and guards (with the ally they guarded) of the domain that died since the last
+        call, as far as other domains need to know.
+        """
+        dead = [agent for agent in self.owned if agent.type == 'dead' and agent in self.model.space._agent_to_index
+                and agent not in self.dead]
+        self.dead.update(dead)
+        commanders = sorted(agent.unique_id for agent in dead if hasattr(agent, 'soldiers'))
+        guards = [(agent.unique_id, agent.guarded_ally.unique_id) for agent in dead
+                  if agent.subtype == "guard" and agent.guarded_ally not in self.owned]
+        return commanders, guards
+
+    def apply_deaths(self, deaths):
+        """ Apply the effects of the deaths in other domains on the owned agents. """
+        commanders = sorted(unique_id for dead_commanders, guards in deaths for unique_id in dead_commanders)
+        for unique_id in commanders:
+            for soldier in self.agents[unique_id].soldiers:
+                if soldier in self.owned:
+                    soldier.morale -= 10
+        for dead_commanders, guards in deaths:
+            for guard, ally in guards:
+                if self.agents[ally] in self.owned:
+                    self.agents[ally].protected = False
+
+    def advance(self, deaths):
+        """ Move the living owned agents; returns the pickled ones that left the strip, by domain. """
+        self.apply_deaths(deaths)
+        living = self.living()
+        for agent in living:
+            agent.advance()
+        self.model.schedule.steps += 1
+        self.model.schedule.time += 1
+
+        migrants = {}
+        owners = self.owner(np.array([agent.pos[0] for agent in living], dtype=float))
+        for agent, owner in zip(living, owners.tolist()):
+            if owner != self.number:
+                self.model.schedule.remove(agent)
+                self.owned.discard(agent)
+                self.ghosts.add(agent)
+                migrants.setdefault(owner, []).append(agent)
+        return {owner: self.pickle(agents) for owner, agents in migrants.items()}
+
+    def pickle(self, agents):
+        f = io.BytesIO()
+        _Pickler(f, self.model).dump([(agent.unique_id,
+                                       {name: value for name, value in agent.__dict__.items()
+                                        if name not in ('model', 'pos')},
+                                       np.array(agent.pos, dtype=float))
+                                      for agent in agents])
+        return f.getvalue()
+
+    def settle(self, payloads):
+        """ Take over the agents that moved into the strip, then write the block for the morale phase. """
+        space = self.model.space
+        for payload in payloads:
+            for unique_id, attributes, pos in _Unpickler(io.BytesIO(payload), self.model, self.agents).load():
+                agent = self.agents[unique_id]
+                agent.__dict__.update(attributes)
+                if agent in space._agent_to_index:
+                    space.move_agent(agent, pos)
+                else:
+                    space.place_agents([agent], [pos])
+                self.ghosts.discard(agent)
+                self.owned.add(agent)
+                self.model.schedule.add(agent)
+        self.write_block()
+
+    def morale(self, argument=None):
+        """ Average the morale of the allies of every owned agent; returns the commanders that flee if no other
+        commander does.
+        """
+        self.read_halo()
+        agents = self.living()
+        self.averages = dict(zip(agents, self.model.allies_morale(agents).tolist())) if agents else {}
+        return self.flee([])
+
+    def flee(self, fleeing):
+        """ Owned commanders that flee if the commanders with the given unique_ids flee. """
+        result = set()
+        for agent, average in self.averages.items():
+            if not hasattr(agent, 'soldiers'):
+                continue
+            morale = agent.morale
+            for unique_id in fleeing:
+                if unique_id >= agent.unique_id:
+                    break
+                if agent.unique_id in self.soldiers_of(unique_id):
+                    morale -= 10
+            kept = agent.morale
+            agent.morale = morale
+            new_morale = agent.calculate_new_morale(average)
+            agent.morale = kept
+            if new_morale <= simulation_parameters.TO_FLEE_THRESHOLD:
+                result.add(agent.unique_id)
+        return result
+
+    def soldiers_of(self, unique_id):
+        if unique_id not in self.soldier_ids:
+            self.soldier_ids[unique_id] = {soldier.unique_id for soldier in self.agents[unique_id].soldiers}
+        return self.soldier_ids[unique_id]
+
+    def apply_morale(self, fleeing):
+        """ Update the morale of the owned agents, in unique_id order, with the commanders of other domains that
+        flee in between; returns the guards of the domain that fled and the numbers of its living agents.
+        """
+        remote = [unique_id for unique_id in fleeing if self.agents[unique_id] not in self.owned]
+        turns = sorted([(agent.unique_id, agent) for agent in self.averages] +
+                       [(unique_id, None) for unique_id in remote], key=lambda turn: turn[0])
+        for unique_id, agent in turns:
+            if agent is None:
+                for soldier in self.agents[unique_id].soldiers:
+                    if soldier in self.owned:
+                        soldier.morale -= 10
+            else:
+                agent.update_morale(agent.calculate_new_morale(self.averages[agent]))
+        self.averages = {}
+        commanders, guards = self.deaths()
+        counts = Counter((agent.type, agent.subtype) for agent in self.model.schedule.agent_buffer(False))
+        return guards, counts
+
+    def unprotect(self, deaths):
+        """ Apply the deaths of guards of other domains, take the dead out of the space and write the block for the
+        next step.
+        """
+        self.apply_deaths([([], guards) for guards in deaths])
+        space = self.model.space
+        for agent in self.dead:
+            if agent in space._agent_to_index:
+                pos = agent.pos
+                space.remove_agent(agent)
+                agent.pos = pos
+        self.dead = set()
+        self.write_block()
+
+    def gather(self, argument=None):
+        """ All owned agents, pickled. """
+        return self.pickle(sorted(self.owned, key=lambda agent: agent.unique_id))
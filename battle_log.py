@@ -0,0 +1,334 @@
+import glob
+import os
+import queue
+import threading
+
+import numpy as np
+
+# Event types. Every event has a step, an actor, and optionally a target agent,
+# another agent and two numbers; TEMPLATES tell how to render each of them as
+# the text the agents used to write to their own files.
+SPAWN = 1
+ARMY = 2
+TURN = 3
+DIE = 4
+DIE_COMMANDER = 5
+ATTACK = 6
+ATTACK_GUARDED = 7
+KILL = 8
+DAMAGED = 9
+PRECISE_DAMAGED = 10
+MOVE = 11
+FLEE = 12
+SEEK_MEDIC = 13
+GO_TO_MEDIC = 14
+NO_MEDIC = 15
+GENERAL_LOST = 16
+HEAL = 17
+HEALED = 18
+HEAL_FULL = 19
+HEALED_FULL = 20
+AIM = 21
+HIT = 22
+HIT_KILL = 23
+MISS = 24
+NOBODY_TO_GUARD = 25
+PROTECT = 26
+GUARD_DAMAGED = 27
+COURAGE = 28
+COURAGE_ALLY = 29
+COURAGE_END = 30
+ENCOURAGED = 31
+FLAGGER_LOST = 32
+
+TEMPLATES = {
+    SPAWN: "Powstałem, jestem {actor}\n\n",
+    ARMY: "Moja armia: {army}\n\n",
+    TURN: "\nRuch {amount}:\n",
+    DIE: "Zginąłem, to koniec",
+    DIE_COMMANDER: "Zginąłem, to koniec.\nObniżam morale swoich żołnierzy.",
+    ATTACK: "Haha! Zadałem wrogowi {target} {amount} punktów obrażeń.\n",
+    ATTACK_GUARDED: "Wróg {target} był broniony! Zadałem jego obrońcy {other} {amount} punktów obrażeń.\n",
+    KILL: "Zabiłem go! Hurra!\n",
+    DAMAGED: "Ała! Otrzymałem {amount} punktów obrażeń od {target}. Teraz mam {value} punktów zdrowia.\n",
+    PRECISE_DAMAGED: "Namierzył mnie {target}! Zadał mi {amount} punktów obrażeń. Teraz mam {value} punktów zdrowia.\n",
+    MOVE: "Idę na{position}\n",
+    FLEE: "Muszę się ratować!\n",
+    SEEK_MEDIC: "Jest źle, muszę poszukać medyka!\n",
+    GO_TO_MEDIC: "Idę poszukać medyka!\n",
+    NO_MEDIC: "Taki los, medyka nie ma, walczę dalej!\n",
+    GENERAL_LOST: "Nasz generał powalon! Jak teraz mamy wygrać?\n",
+    HEAL: "Leczę {target} o {amount}. Teraz ma {value}\n",
+    HEALED: "{target} uleczył mnie do {value} punktów hp.\n",
+    HEAL_FULL: "Leczę {target} do pełna. Teraz ma {value}\n",
+    HEALED_FULL: "{target} uleczył mnie do pełna, mam {value} punktów życia.\n",
+    AIM: "Celuję we wroga {target}...\n",
+    HIT: "Tak, trafiłem go! Zadałem mu {amount} punktów obrażeń.\n",
+    HIT_KILL: "W dodatku go zabiłem!\n",
+    MISS: "O nie, chybiłem! Co za wstyd!\n",
+    NOBODY_TO_GUARD: "Nie ma kogo chronić\n",
+    PROTECT: "W tym ruchu chronię sojusznika {target}.\n",
+    GUARD_DAMAGED: "Oj! Chroniąc {other} otrzymałem {amount} punktów obrażeń od {target}. Teraz mam {value} punktów "
+                   "zdrowia.\n",
+    COURAGE: "Zwiększam morale wszystkich pobliskich sojuszników: ",
+    COURAGE_ALLY: "{target}, ",
+    COURAGE_END: ".\n",
+    ENCOURAGED: "Do boju! Moje morale są zwiększone przez chorążego {target}!\n",
+    FLAGGER_LOST: "O nie! Chorąży nie żyje! Nasza flaga!\n",
+}
+
+# Verbosity of a battle: no output at all, only the number of living agents
+# after every step, or that plus the log of every event of every agent.
+OFF = "off"
+SUMMARY = "summary"
+PER_EVENT = "per-event"
+
+# One event record of the binary log. flags tells which of amount and value
+# were logged as ints, so that they are rendered the way they used to be.
+EVENT_DTYPE = np.dtype([('step', '<i4'), ('event', 'u1'), ('flags', 'u1'), ('actor', '<i4'), ('target', '<i4'),
+                        ('other', '<i4'), ('amount', '<f8'), ('value', '<f8')])
+AMOUNT_INT = 1
+VALUE_INT = 2
+
+_STOP = None
+
+
+def _number(x, is_int):
+    return str(int(x)) if is_int else str(float(x))
+
+
+def render(event, roster, actor, target, other, amount, value, flags=0):
+    """ Render one event as the text line(s) the actor used to write.
+
+    Args:
+        event: Event type.
+        roster: Dict mapping agent ids to (name, army).
+        actor, target, other: Agent ids (0 if unused).
+        amount, value: Numbers of the event.
+        flags: AMOUNT_INT / VALUE_INT bits of the numbers logged as ints.
+    """
+    if event == MOVE:
+        position = str(np.array((float(amount), float(value))))
+    else:
+        position = None
+    return TEMPLATES[event].format(actor=roster[actor][0], army=roster[actor][1],
+                                   target=roster[target][0] if target else None,
+                                   other=roster[other][0] if other else None,
+                                   amount=_number(amount, flags & AMOUNT_INT),
+                                   value=_number(value, flags & VALUE_INT), position=position)
+
+
+class BattleLog:
+    """ Collects the events of a battle and writes them in the background.
+
+    Agents emit structured events instead of writing text to their own open
+    files. Events are stored in a preallocated NumPy record buffer (see
+    EVENT_DTYPE); full buffers are handed, through a bounded queue, to one
+    writer thread, which appends them as raw records to one binary file per
+    run (or one per army) and hands the buffer back for reuse. Agent names and
+    armies go to a separate roster file. The old per-agent text can be rebuilt
+    from these files with agent_text / write_agent_files.
+    """
+
+    def __init__(self, model, directory="logi", name="battle", per_army=False, batch_size=4096,
+                 max_batches=64):
+        """ Create a new battle log and start its writer thread.
+
+        Args:
+            model: The model whose step numbers events are stamped with.
+            directory: Directory for the log files.
+            name: Events go to <name>.events, or <name>-<army>.events per army,
+                  and the roster to <name>.roster.
+            per_army: If True, write one events file per army instead of one per run.
+            batch_size: Number of events in a buffer handed to the writer.
+            max_batches: Number of buffers the writer may fall behind before
+                         emitting events blocks.
+        """
+        self.model = model
+        self.directory = directory
+        self.name = name
+        self.per_army = per_army
+        self.batch_size = batch_size
+        self.roster = {}
+        self._new_roster = []
+        self._records = np.zeros(batch_size, dtype=EVENT_DTYPE)
+        self._n = 0
+        self._queue = queue.Queue(max_batches)
+        self._free = queue.Queue()
+        self._closed = False
+        # exception the writer thread stopped writing on, raised by the next flush or close
+        self._error = None
+        for path in _log_files(directory, name) + glob.glob(os.path.join(directory, name + ".roster")):
+            os.remove(path)
+        # files are opened here, so that a missing directory or the like fails the caller, not the writer thread;
+        # per army events files are opened by the writer as armies come up
+        self._roster_file = open(os.path.join(directory, name + ".roster"), "w", encoding="utf-8")
+        self._files = {}
+        if not per_army:
+            try:
+                self._files[None] = open(os.path.join(directory, name + ".events"), "wb")
+            except BaseException:
+                self._roster_file.close()
+                raise
+        self._writer = threading.Thread(target=self._write, daemon=True)
+        self._writer.start()
+
+    def register(self, agent, spawned=True):
+        """ Add an agent to the roster, which logs its SPAWN event unless spawned is False. """
+        self.roster[agent.unique_id] = (agent.name, agent.army)
+        self._new_roster.append((agent.unique_id, agent.name, agent.army))
+        if spawned:
+            self.emit(SPAWN, agent)
+
+    def emit(self, event, actor, target=None, other=None, amount=0, value=0):
+        """ Record an event of the actor, possibly involving target and other. """
+        n = self._n
+        self._records[n] = (self.model.schedule.steps, event,
+                            (type(amount) is int) | (type(value) is int) << 1, actor.unique_id,
+                            target.unique_id if target is not None else 0,
+                            other.unique_id if other is not None else 0,
+                            amount, value)
+        self._n = n + 1
+        if self._n == self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """ Hand the buffered events to the writer thread; raises the error the writer failed on, if it did. """
+        if self._error is not None:
+            raise self._error
+        if self._n or self._new_roster:
+            self._queue.put((self._records, self._n, self._new_roster))
+            try:
+                self._records = self._free.get_nowait()
+            except queue.Empty:
+                self._records = np.zeros(self.batch_size, dtype=EVENT_DTYPE)
+            self._n = 0
+            self._new_roster = []
+
+    def close(self):
+        """ Write out all events and stop the writer thread; raises the error the writer failed on, if it did. """
+        if self._closed:
+            return
+        try:
+            self.flush()
+        finally:
+            self._queue.put(_STOP)
+            self._writer.join()
+            self._closed = True
+        if self._error is not None:
+            raise self._error
+
+    def _write(self):
+        files = self._files
+        army_codes = {}
+        armies = []
+        army_of = np.zeros(0, dtype=int)
+        roster = self._roster_file
+        try:
+            while True:
+                batch = self._queue.get()
+                if batch is _STOP:
+                    break
+                records, n, new_roster = batch
+                for unique_id, agent_name, army in new_roster:
+                    roster.write("%d\t%s\t%s\n" % (unique_id, agent_name, army))
+                    if army not in army_codes:
+                        army_codes[army] = len(armies)
+                        armies.append(army)
+                    if unique_id >= army_of.shape[0]:
+                        army_of = np.resize(army_of, max(2 * army_of.shape[0], unique_id + 1))
+                    army_of[unique_id] = army_codes[army]
+                chunks = {None: records[:n]}
+                if self.per_army:
+                    codes = army_of[records['actor'][:n]]
+                    chunks = {armies[code]: records[:n][codes == code] for code in np.unique(codes)}
+                for army, chunk in chunks.items():
+                    if army not in files:
+                        suffix = "-" + army if army is not None else ""
+                        files[army] = open(os.path.join(self.directory, self.name + suffix + ".events"), "wb")
+                    chunk.tofile(files[army])
+                self._free.put(records)
+        except BaseException as error:
+            self._error = error
+            # keep taking batches, so that nobody blocks on the full queue before seeing the error
+            while self._queue.get() is not _STOP:
+                pass
+        finally:
+            roster.close()
+            for f in files.values():
+                f.close()
+
+    def agent_text(self, name):
+        """ Rebuild the text of the agent with the given name; needs close(). """
+        roster, events = read_events(self.directory, self.name)
+        ids = [unique_id for unique_id, (agent_name, army) in roster.items() if agent_name == name]
+        return _agent_texts(roster, events[np.isin(events['actor'], ids)]).get(name, "")
+
+    def write_agent_files(self, directory=None):
+        """ Rebuild every agent's <name>.txt file; needs close(). """
+        write_agent_files(self.directory, self.name, directory)
+
+
+class NullLog:
+    """ Stand-in for BattleLog when events are not logged; drops everything. """
+
+    def register(self, agent, spawned=True):
+        pass
+
+    def emit(self, event, actor, target=None, other=None, amount=0, value=0):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def agent_text(self, name):
+        return ""
+
+    def write_agent_files(self, directory=None):
+        pass
+
+
+def _log_files(directory, name):
+    return sorted(glob.glob(os.path.join(directory, name + ".events")) +
+                  glob.glob(os.path.join(directory, name + "-*.events")))
+
+
+def read_events(directory, name):
+    """ Read the roster and the events of a logged battle.
+
+    Returns:
+        The roster, mapping agent ids to (name, army), and a record array of
+        EVENT_DTYPE with all events, ordered by step.
+    """
+    roster = {}
+    with open(os.path.join(directory, name + ".roster"), encoding="utf-8") as f:
+        for line in f:
+            unique_id, agent_name, army = line.rstrip("\n").split("\t")
+            roster[int(unique_id)] = (agent_name, army)
+    events = [np.fromfile(path, dtype=EVENT_DTYPE) for path in _log_files(directory, name)]
+    events = np.concatenate(events) if events else np.zeros(0, dtype=EVENT_DTYPE)
+    return roster, events[np.argsort(events['step'], kind='stable')]
+
+
+def _agent_texts(roster, events):
+    texts = {}
+    for step, event, flags, actor, target, other, amount, value in events.tolist():
+        texts.setdefault(roster[actor][0], []).append(render(event, roster, actor, target, other, amount, value,
+                                                             flags))
+    return {agent_name: "".join(lines) for agent_name, lines in texts.items()}
+
+
+def read_agent_texts(directory, name):
+    """ Rebuild the text of every agent of a logged battle, by agent name. """
+    return _agent_texts(*read_events(directory, name))
+
+
+def write_agent_files(directory, name, out_directory=None):
+    """ Rebuild the <agent name>.txt files of a logged battle. """
+    out_directory = directory if out_directory is None else out_directory
+    for agent_name, text in read_agent_texts(directory, name).items():
+        with open(os.path.join(out_directory, agent_name + ".txt"), "w", encoding="utf-8") as f:
+            f.write(text)
@@ -1,22 +1,89 @@
 # model.py
 from mesa import Model
-from mesa.time import RandomActivation
+from mesa.time import RandomActivation, ClassStagedActivation
 from mesa.space import ContinuousSpace
 from mesa.datacollection import DataCollector
-from math import floor
 import random
 import copy
+from collections import Counter
 import numpy as np
 
 import warrior_agent
+import battle_state
+import battle_combat
+import battle_branch
+import battle_domains
+import battle_log
+import battle_shared
+import battle_snapshot
+import boids
+import csr
+import simulation_parameters
 
 class BattleModel(Model):
     """A model with some number of agents."""
-    def __init__(self, red_col,red_row,red_squad, blue_col,blue_row,blue_squad, width, height):
+    def __init__(self, red_col,red_row,red_squad, blue_col,blue_row,blue_squad, width, height,
+                 cell_size=None, use_battle_state=False,
+                 vectorized_movement=False, log_per_army=False, verbosity=battle_log.PER_EVENT,
+                 end_condition=None, verlet_skin=None, seed=None, staged_by_class=False,
+                 simultaneous_combat=False, shared_state=False):
+        if shared_state and not use_battle_state:
+            raise ValueError("shared_state needs use_battle_state")
         self.running = True
-        self.space = ContinuousSpace(width, height, False)
-        self.schedule = RandomActivation(self)
+        # all randomness of a battle comes from the model: self.random (random.Random, also used by the agents and the
+        # schedule) and self.rng (numpy Generator for batched draws), both determined by the seed
+        if seed is not None:
+            super().reset_randomizer(seed)
+        self.rng = np.random.default_rng(self.random.getrandbits(128))
+        # with simultaneous_combat, all agents choose what to do from the state at the start of the step: their attacks,
+        # heals and protections are resolved all at once by self.combat (see battle_combat), and their moves are made
+        # after that; otherwise every agent acts on the state left by the agents that acted before it
+        self.combat = battle_combat.Combat(self) if simultaneous_combat else None
+        # verbosity is battle_log.OFF, SUMMARY (living agents count after every step) or PER_EVENT (that, and agents
+        # log their actions as events into one file per run (or per army) in logi/, see battle_log)
+        self.verbosity = verbosity
+        if verbosity == battle_log.PER_EVENT:
+            self.log = battle_log.BattleLog(self, per_army=log_per_army)
+        else:
+            self.log = battle_log.NullLog()
+        # with vectorized_movement, velocity vectors of all agents are computed at once at the start of each step,
+        # from the positions and velocities at that moment, instead of by each agent right before it moves
+        self.vectorized_movement = vectorized_movement
+        self.velocity_vectors = {}
+        # with shared_state (and use_battle_state), the BattleState columns and the points of the space live in shared
+        # memory, which other processes attach to through state_handle() instead of getting copies (see battle_shared)
+        self.shared = battle_shared.SharedArrays() if shared_state else None
+        # with use_battle_state, agents keep hp, morale, velocity etc. in the columns of one BattleState
+        self.state = None
+        if use_battle_state:
+            self.state = battle_state.BattleState(red_col * red_row * red_squad + blue_col * blue_row * blue_squad,
+                                                  allocate=self.shared.zeros if shared_state else np.zeros,
+                                                  release=self.shared.release if shared_state else None)
+        # cell_size turns on the spatial hash of the space, e.g. simulation_parameters.INTERACTION_RADIUS: it pays off
+        # from thousands of agents on a field many interaction radii wide, below that scanning all agents is faster
+        # (Verlet lists, with verlet_skin, are set up once the agents are spawned, see use_verlet_lists)
+        self.space = ContinuousSpace(width, height, False, cell_size=cell_size, group_key="type",
+                                     allocate=self.shared.empty if shared_state else np.empty,
+                                     release=self.shared.release if shared_state else None)
+        # with staged_by_class, all agents of one class (e.g. RedHealer) act one after another, and a class can
+        # handle its whole cohort at once in a step_batch(agents) class method (not with simultaneous_combat)
+        if simultaneous_combat:
+            self.schedule = battle_combat.SimultaneousCombatActivation(self)
+        elif staged_by_class:
+            self.schedule = ClassStagedActivation(self, shuffle=True)
+        else:
+            self.schedule = RandomActivation(self)
+        self.neighbor_cache = warrior_agent.NeighborCache(self)
+        # neighbors of all agents up to simulation_parameters.INTERACTION_RADIUS, see interaction_graph
+        self.graph = None
         self.next_agent_id = 1
+        # army id -> {subtype -> members, None -> all members}, filled by spawn
+        self.armies = {}
+        # numbers of living agents by side and by (side, subtype), kept up to date by spawn and record_death
+        self.alive_sides = Counter()
+        self.alive_subtypes = Counter()
+        # end_condition(model) tells when the battle is over; by default when one side has no living agents left
+        self.end_condition = end_condition if end_condition is not None else one_side_left
 
         separation_y = 1.5
         # Find center
@@ -26,108 +93,231 @@ class BattleModel(Model):
         # Create agents
         self.spawner(15.0,red_first_y, 1.5,separation_y, red_col,red_row,red_squad, 'red')
         self.spawner(width - 15.0,blue_first_y, -1.5,separation_y, blue_col,blue_row,blue_squad, 'blue')
+        if verlet_skin is not None:
+            self.use_verlet_lists(verlet_skin)
             
+    def use_verlet_lists(self, skin=True):
+        """ Make the space keep Verlet neighbor lists for the scans of the agents up to
+        simulation_parameters.INTERACTION_RADIUS.
+
+        The lists stay valid until some agent has moved skin / 2 from where it was when they were built; rebuilding
+        them takes a batched query of all agents. skin has to be more than two moves of the fastest agent, else they
+        would be rebuilt after nearly every move. skin=True makes it simulation_parameters.VERLET_SKIN_STEPS moves
+        (so the lists are rebuilt about once that many steps).
+        """
+        max_move = max(agent.movement_speed for agent in self.schedule.agents)
+        if skin is True:
+            skin = 2 * simulation_parameters.VERLET_SKIN_STEPS * max_move
+        elif not skin > 2 * max_move:
+            raise ValueError("verlet_skin must be more than twice the longest move of an agent (%g)" % max_move)
+        self.space.verlet_radius = simulation_parameters.INTERACTION_RADIUS
+        self.space.verlet_skin = skin
+        self.space._verlet = None
+
     def spawner(self, first_x, first_y, separation_x, separation_y, cols, rows, squad, type):
-        for i in range(cols):
-            for j in range(rows * squad):
-                x = first_x + (separation_x * i)
-                y = first_y + (separation_y * j)
-                army = type + str(floor(j/rows))
-                
-                # Squad separator
-                y = y + (4*separation_y) * (floor(j / rows))
-
-                subtype = "warrior"
-
-                if i == 0:
-                    if j%5 == 1 or j%5 == 3:
-                        subtype = "guard"
-
-                if i == 1:
-                    if j%5==2:
-                        subtype = "general"
-
-                if i == 2:
-                    if j%5 == 1 or j%5 == 3:
-                        subtype = "healer"
-                    elif j%5 == 0 or j%5 == 4:
-                        subtype = "marksman"
-                    elif j%5 == 2:
-                        subtype = "flagger"
-
-
-                self.spawn(x,y,type,subtype,army)
-
-        for agent in self.schedule.agent_buffer(False):
-            if agent.subtype == "general":
-                for soldier in self.schedule.agent_buffer(False):
-                    if soldier.subtype != "general" and soldier.army == agent.army:
-                        agent.soldiers.append(soldier)
-            elif agent.subtype == "flagger":
-                for soldier in self.schedule.agent_buffer(False):
-                    if soldier.subtype != "flagger" and soldier.army == agent.army:
-                        agent.soldiers.append(soldier)
+        # column i and row j of every soldier of the formation, column by column
+        i, j = np.divmod(np.arange(cols * rows * squad), rows * squad)
+        squads = j // rows
+        x = first_x + (separation_x * i)
+        y = first_y + (separation_y * j)
+        # Squad separator
+        y = y + (4*separation_y) * squads
 
+        subtypes = np.full(i.shape, "warrior", dtype=object)
+        subtypes[(i == 0) & ((j%5 == 1) | (j%5 == 3))] = "guard"
+        subtypes[(i == 1) & (j%5 == 2)] = "general"
+        subtypes[(i == 2) & ((j%5 == 1) | (j%5 == 3))] = "healer"
+        subtypes[(i == 2) & ((j%5 == 0) | (j%5 == 4))] = "marksman"
+        subtypes[(i == 2) & (j%5 == 2)] = "flagger"
 
-        
-        
-    def spawn(self,x,y,type,subtype,army):
+        armies = [type + str(k) for k in squads.tolist()]
+        self.spawn_many(np.column_stack((x, y)), type, subtypes.tolist(), armies)
+
+        # generals and flaggers command everyone else in their army
+        for army in set(armies):
+            members = self.armies[army]
+            for commander in members.get("general", []) + members.get("flagger", []):
+                commander.soldiers = [soldier for soldier in members[None] if soldier.subtype != commander.subtype]
+
+    def get_army(self, army, subtype=None):
+        """ Members of the given army (all, or only those of the given subtype), living or dead, in spawn order. """
+        return self.armies.get(army, {}).get(subtype, [])
+
+    def agent_class(self, type, subtype):
         if(type == 'red' and subtype == "general"):
-            a = warrior_agent.RedGeneral(self.next_agent_id, army, self)
+            agent_class = warrior_agent.RedGeneral
         elif(type == "red" and subtype == "warrior"):
-            a = warrior_agent.RedCommonWarrior(self.next_agent_id, army, self)
+            agent_class = warrior_agent.RedCommonWarrior
         elif(type == "red" and subtype == "healer"):
-            a = warrior_agent.RedHealer(self.next_agent_id, army, self)
+            agent_class = warrior_agent.RedHealer
         elif(type == "red" and subtype == "marksman"):
-            a = warrior_agent.RedMarksman(self.next_agent_id, army, self)
+            agent_class = warrior_agent.RedMarksman
         elif(type == "red" and subtype == "guard"):
-            a = warrior_agent.RedGuard(self.next_agent_id, army, self)
+            agent_class = warrior_agent.RedGuard
         elif(type == "red" and subtype == "flagger"):
-            a = warrior_agent.RedFlagger(self.next_agent_id, army, self)
+            agent_class = warrior_agent.RedFlagger
         elif(type == "blue" and subtype == "general"):
-            a = warrior_agent.BlueGeneral(self.next_agent_id, army, self)
+            agent_class = warrior_agent.BlueGeneral
         elif(type == "blue" and subtype == "warrior"):
-            a = warrior_agent.BlueCommonWarrior(self.next_agent_id, army, self)
+            agent_class = warrior_agent.BlueCommonWarrior
         elif(type == "blue" and subtype == "healer"):
-            a = warrior_agent.BlueHealer(self.next_agent_id, army, self)
+            agent_class = warrior_agent.BlueHealer
         elif(type == "blue" and subtype == "marksman"):
-            a = warrior_agent.BlueMarksman(self.next_agent_id, army, self)
+            agent_class = warrior_agent.BlueMarksman
         elif(type == "blue" and subtype == "guard"):
-            a = warrior_agent.BlueGuard(self.next_agent_id, army, self)
+            agent_class = warrior_agent.BlueGuard
         elif(type == "blue" and subtype == "flagger"):
-            a = warrior_agent.BlueFlagger(self.next_agent_id, army, self)
+            agent_class = warrior_agent.BlueFlagger
 
-        pos = np.array((x, y))
-        self.schedule.add(a)
-        self.space.place_agent(a, pos)
+        if self.state is not None:
+            agent_class = battle_state.state_view_class(agent_class)
+        return agent_class
 
-        self.next_agent_id += 1
+    def spawn(self,x,y,type,subtype,army):
+        return self.spawn_many(np.array(((x, y),)), type, [subtype], [army])[0]
+
+    def spawn_many(self, positions, type, subtypes, armies):
+        """ Create agents of one side, add them to the schedule and place them in the space all at once.
+
+        Args:
+            positions: Array of shape (n, 2) with the positions of the agents.
+            type: Side of the agents, 'red' or 'blue'.
+            subtypes, armies: Lists with the subtype and the army of every agent.
+
+        Returns:
+            The list of new agents.
+        """
+        agents = []
+        for subtype, army in zip(subtypes, armies):
+            agents.append(self.agent_class(type, subtype)(self.next_agent_id, army, self))
+            self.next_agent_id += 1
+
+        self.schedule.add_agents(agents)
+        self.space.place_agents(agents, positions)
+        for a, subtype, army in zip(agents, subtypes, armies):
+            members = self.armies.setdefault(army, {None: []})
+            members[None].append(a)
+            members.setdefault(subtype, []).append(a)
+        self.alive_sides[type] += len(agents)
+        self.alive_subtypes.update((type, subtype) for subtype in subtypes)
 
         #print("zespawnowane")
+        return agents
+
+    def record_death(self, agent):
+        """ Count the agent out of the living ones; called by its die() before it changes its type to 'dead'. """
+        self.alive_sides[agent.type] -= 1
+        self.alive_subtypes[(agent.type, agent.subtype)] -= 1
+
+    def alive_count(self, side, subtype=None):
+        """ Number of living agents of the side, or only of its given subtype. """
+        if subtype is None:
+            return self.alive_sides[side]
+        return self.alive_subtypes[(side, subtype)]
+
+    def reset_randomizer(self, seed=None):
+        """ Reset the random number generators of the model; if seed is None, using the current seed. """
+        super().reset_randomizer(seed)
+        self.rng = np.random.default_rng(self.random.getrandbits(128))
+
+    def snapshot(self, path):
+        """ Save the battle, between steps, to the directory path; see battle_snapshot.save. """
+        battle_snapshot.save(self, path)
+
+    @classmethod
+    def restore(cls, path, verbosity=battle_log.OFF, mmap_mode=None):
+        """ Rebuild a battle saved with snapshot, to continue it from there; see battle_snapshot.load. """
+        return battle_snapshot.load(cls, path, verbosity, mmap_mode)
+
+    def branch(self, n, mutate_fn=None, max_steps=1000, nr_processes=None, summary=battle_branch.battle_summary):
+        """ Continue the battle from here in n variants in parallel; see battle_branch.branch. """
+        return battle_branch.branch(self, n, mutate_fn, max_steps, nr_processes, summary)
+
+    def decompose(self, nr_domains=None, halo=battle_domains.HALO_RADIUS):
+        """ Runner stepping the battle (in simultaneous_combat mode) in one process per vertical strip of the space;
+        see battle_domains.DomainRunner.
+        """
+        return battle_domains.DomainRunner(self, nr_domains, halo)
+
+    def state_handle(self):
+        """ Handle other processes attach to the shared battle state with (shared_state only); see
+        battle_shared.StateHandle.
+        """
+        return battle_shared.StateHandle(self)
+
+    def unshare_state(self):
+        """ Move the battle state out of shared memory and free its blocks; handles can no longer be attached. """
+        battle_shared.unshare(self)
+
+    def interaction_graph(self):
+        """ Neighbor graph (mesa.space.NeighborGraph) of all agents within simulation_parameters.INTERACTION_RADIUS.
+
+        It is built once for the current positions and shared by every phase until some agent moves: the morale
+        phase, the velocity vectors of the next step in vectorized_movement mode, and the scans of agents (through
+        the neighbor cache) for as long as it stays current.
+        """
+        if self.graph is None or not self.graph.is_current():
+            self.graph = self.space.get_neighbor_graph(simulation_parameters.INTERACTION_RADIUS)
+        return self.graph
+
+    def allies_morale(self, agents):
+        """ Average morale of the living allies in the flocking radius of each of the agents (0 if it has none), over
+        everyone's morale as it is now, with one batched neighbor query; with use_battle_state, morale and types are
+        read from the BattleState columns.
+        """
+        everyone = self.space.get_agents_by_index(range(len(self.space._agent_to_index)))
+        if self.state is not None:
+            slots = battle_state.slots_of(everyone)
+            morale = self.state.morale[slots]
+            types = self.state.type[slots]
+        else:
+            morale = np.array([warrior.get_morale() for warrior in everyone], dtype=float)
+            types = np.array([warrior.type for warrior in everyone])
+        own_types = types[[self.space._agent_to_index[agent] for agent in agents]]
+
+        indptr, indices = self.interaction_graph().get_agent_neighbors_batch(agents,
+                                                                             simulation_parameters.FLOCKING_RADIUS)
+        indptr, indices = csr.filter_rows(indptr, indices, types[indices] == own_types[csr.row_numbers(indptr)])
+        if self.combat is not None:
+            # summed in unique_id order, like the scans of simultaneous_combat mode
+            unique_ids = np.array([warrior.unique_id for warrior in everyone], dtype=int)
+            indptr, indices = csr.sort_rows(indptr, indices, unique_ids[indices])
+        return csr.row_means(indptr, morale[indices])
+
+    def morale_phase(self):
+        """ Update the morale of every living agent from the average morale of its allies in the flocking radius.
+
+        Averages are taken over a snapshot of everyone's morale from before the phase (allies_morale), so the order in
+        which agents are updated does not change them.
+        """
+        agents = list(self.schedule.agent_buffer(False))
+        allies_morale = self.allies_morale(agents)
+
+        # applied one by one: fleeing commanders lower the morale of their soldiers still waiting for their update
+        for agent, average in zip(agents, allies_morale.tolist()): #type: (warrior_agent.WarriorAgent, float)
+            agent.update_morale(agent.calculate_new_morale(average))
 
     def step(self):
+        if self.combat is not None:
+            # nobody moves before everyone has stepped, so one graph answers all their scans
+            self.interaction_graph()
+        if self.vectorized_movement:
+            agents = list(self.schedule.agent_buffer(False))
+            self.velocity_vectors = dict(zip(agents, boids.velocity_vectors(self.space, agents,
+                                                                            self.interaction_graph(), self.state)))
         self.schedule.step()
 
-        agents_and_allies_morale = []
-        for agent in self.schedule.agent_buffer(False): #type: warrior_agent.WarriorAgent
-            agents_and_allies_morale.append((agent, agent.get_average_morale_of_allies_in_flocking_radius()))
+        self.morale_phase()
 
-        for (agent, allies_morale) in agents_and_allies_morale: #type: (warrior_agent.WarriorAgent, float)
-            agent.update_morale(agent.calculate_new_morale(allies_morale))
+        if self.verbosity != battle_log.OFF:
+            print("Zywych agentow: " + str(self.schedule.get_agent_count()) + "\n")
 
-        print("Zywych agentow: " + str(len(self.schedule.agents)) + "\n")
+        both = not self.end_condition(self)
+        self.running = both
 
-        both = True
-        blue = False
-        red = False
-        for agent in self.schedule.agents:
-            if agent.type == "red":
-                red = True
-            elif agent.type == "blue":
-                blue = True
+        return both
 
-        if red and blue:
-            both = True
-        else: both = False
 
-        return both
+def one_side_left(model):
+    """ Default end condition of a battle: red or blue has no living agents. """
+    return model.alive_count('red') == 0 or model.alive_count('blue') == 0
@@ -0,0 +1,185 @@
+import os
+import sys
+import weakref
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+import battle_state
+
+
+class SharedArrays:
+    """ Allocator of NumPy arrays in shared memory, one block per array.
+
+    A BattleModel with shared_state makes the columns of its BattleState and
+    the points of its space with it, so that other processes can attach to
+    the very same memory (see StateHandle) instead of being sent copies.
+
+    The state and the space release the arrays they replace when growing,
+    whose blocks are then freed at once. All other blocks are freed by
+    close, or when the allocator is garbage collected (with the model whose
+    state and space use it), whichever comes first; only by the process that
+    made them, not by its forks. Freeing a block unmaps it: no array made
+    here (or view on one) may be used after it is released or closed.
+    """
+
+    def __init__(self):
+        # address of the data of an array -> its block
+        self.blocks = {}
+        self._finalizer = weakref.finalize(self, _free, self.blocks, os.getpid())
+
+    def empty(self, shape, dtype=float):
+        """ New array in a block of its own. """
+        dtype = np.dtype(dtype)
+        shm = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * dtype.itemsize))
+        array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        self.blocks[array.ctypes.data] = shm
+        return array
+
+    def zeros(self, shape, dtype=float):
+        """ New zeroed array in a block of its own. """
+        array = self.empty(shape, dtype)
+        array[...] = 0
+        return array
+
+    def release(self, array):
+        """ Free the block of an array made here, which is no longer used. """
+        shm = self.blocks.pop(array.ctypes.data)
+        shm.close()
+        shm.unlink()
+
+    def block_of(self, array):
+        """ The block of an array made here, or of a view on the start of one. """
+        return self.blocks[array.ctypes.data]
+
+    def close(self, unlink=True):
+        """ Unmap all blocks, and unless unlink is False, free them.
+
+        No array made here may be used any more.
+        """
+        self._finalizer.detach()
+        _free(self.blocks, os.getpid() if unlink else None)
+
+
+def _free(blocks, pid):
+    """ Unmap the blocks, and unlink them if this is process pid (the one that made them). """
+    for shm in blocks.values():
+        shm.close()
+        if os.getpid() == pid:
+            shm.unlink()
+    blocks.clear()
+
+
+class StateHandle:
+    """ Picklable reference to the shared battle state of a model.
+
+    It holds only the names of the shared memory blocks, the shapes of the
+    arrays and the number of slots and points in use when it was taken, so
+    it is cheap to send to a worker process, which attaches to the arrays
+    themselves. The state and the space get new blocks when they grow, so a
+    handle is good until the next agent is spawned.
+    """
+
+    def __init__(self, model):
+        if model.shared is None:
+            raise ValueError("the battle state of the model is not shared (shared_state=False)")
+        self.size = model.state.size
+        self.columns = {name: _spec(model.shared, getattr(model.state, name)) for name in battle_state.COLUMNS}
+        self.nr_points = len(model.space._agent_to_index)
+        self.points = _spec(model.shared, model.space._points_buffer) if self.nr_points else None
+        self.tracker = _tracker_id()
+
+    def attach(self):
+        """ SharedState on the arrays of the handle, without copying them. """
+        return SharedState(self)
+
+
+class SharedState(battle_state.BattleState):
+    """ BattleState attached to the shared arrays of a StateHandle, in any process.
+
+    The columns (indexed by slot) and points (the positions of the agents in
+    the order of the space, ContinuousSpace._agent_points of the model) are
+    the model's own memory: writes to them are writes to the battle. close()
+    before dropping the last reference, with no views on the arrays left.
+
+    Attaching never makes a process responsible for the blocks: a process
+    with a resource tracker other than the model's (one not started by
+    multiprocessing from the model's process) would otherwise have them
+    unlinked under the model when it exits.
+    """
+
+    def __init__(self, handle):
+        self.size = handle.size
+        self._untrack = handle.tracker is not None and handle.tracker != _tracker_id()
+        self.allocate = None
+        self.release = None
+        self._blocks = []
+        for name, spec in handle.columns.items():
+            setattr(self, name, self._attach(spec))
+        self.points = np.empty((0, 2))
+        if handle.points is not None:
+            self.points = self._attach(handle.points)[:handle.nr_points]
+
+    def _attach(self, spec):
+        name, shape, dtype = spec
+        if sys.version_info >= (3, 13):
+            shm = shared_memory.SharedMemory(name, track=False)
+        else:
+            shm = shared_memory.SharedMemory(name)
+            if self._untrack:
+                # registered by attaching; the tracker of the model's process keeps it registered there
+                resource_tracker.unregister(shm._name, "shared_memory")
+        self._blocks.append(shm)
+        return np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+    def add(self):
+        raise TypeError("agents can only be added to the battle state by its model")
+
+    def close(self):
+        """ Detach from the blocks (the model keeps them). """
+        for name in battle_state.COLUMNS:
+            setattr(self, name, None)
+        self.points = None
+        for shm in self._blocks:
+            shm.close()
+        self._blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def unshare(model, unlink=True):
+    """ Move the battle state of a model from shared memory to private arrays
+    and close its blocks (freeing them, unless unlink is False, e.g. in a
+    forked process whose parent still uses them).
+
+    """
+    state = model.state
+    for name in battle_state.COLUMNS:
+        setattr(state, name, np.array(getattr(state, name)))
+    state.allocate = np.zeros
+    state.release = None
+    space = model.space
+    space.allocate = np.empty
+    space.release = None
+    if space._points_buffer is not None:
+        space._points_buffer = np.array(space._points_buffer)
+        space._agent_points = space._points_buffer[:len(space._agent_to_index)]
+    model.shared.close(unlink)
+    model.shared = None
+
+
+def _tracker_id():
+    """ Identity of the resource tracker of this process (the inode of its pipe, which the processes sharing the
+    tracker share), or None where shared memory is not tracked (Windows).
+    """
+    if os.name != 'posix':
+        return None
+    return os.fstat(resource_tracker.getfd()).st_ino
+
+
+def _spec(shared, array):
+    return shared.block_of(array).name, array.shape, array.dtype.str
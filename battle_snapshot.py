@@ -0,0 +1,176 @@
+import os
+import pickle
+import random
+
+import numpy as np
+
+from mesa.space import ContinuousSpace
+
+import battle_log
+import battle_state
+import warrior_agent
+
+# Per-agent numbers stored as arrays instead of in the pickled agents (unless
+# the model keeps them in a BattleState, whose columns are stored instead).
+AGENT_COLUMNS = ('hp', 'initial_hp', 'morale', 'velocity')
+STATE_COLUMNS = ('hp', 'initial_hp', 'morale', 'velocity', 'position', 'type', 'subtype')
+
+# Model attributes rebuilt on restore rather than stored.
+_REBUILT = ('log', 'neighbor_cache', 'graph', 'space', 'schedule', 'state', 'velocity_vectors', 'random', 'rng',
+            'shared')
+
+
+class _Pickler(pickle.Pickler):
+    """ Pickles the model and its agents as references, so agent state can be
+    stored one agent at a time, cross references (guarders, soldiers, armies)
+    included.
+
+    """
+
+    def __init__(self, f, model, agents):
+        super().__init__(f, pickle.HIGHEST_PROTOCOL)
+        self.model = model
+        self.agents = {id(agent): agent.unique_id for agent in agents}
+
+    def persistent_id(self, obj):
+        if obj is self.model:
+            return ('model',)
+        if id(obj) in self.agents:
+            return ('agent', self.agents[id(obj)])
+        return None
+
+
+class _Unpickler(pickle.Unpickler):
+    def __init__(self, f, model, agents):
+        super().__init__(f)
+        self.model = model
+        self.agents = agents
+
+    def persistent_load(self, pid):
+        if pid[0] == 'model':
+            return self.model
+        return self.agents[pid[1]]
+
+
+def save(model, path):
+    """ Write a snapshot of a BattleModel between steps to the directory path.
+
+    The positions of all agents (in space order) and their hp, morale and
+    velocity (or the BattleState columns) go to .npy files, which restore can
+    memory-map; everything else (agent attributes, model attributes, schedule
+    class, order and step, the state of both random number generators) to
+    model.pkl.
+    """
+    os.makedirs(path, exist_ok=True)
+    space = model.space
+    agents = space.get_agents_by_index(range(len(space._agent_to_index)))
+    np.save(os.path.join(path, 'points.npy'), space._agent_points)
+
+    skipped = ('pos',) if model.state is not None else ('pos',) + AGENT_COLUMNS
+    if model.state is not None:
+        for name in STATE_COLUMNS:
+            np.save(os.path.join(path, 'state_' + name + '.npy'), getattr(model.state, name)[:model.state.size])
+    else:
+        for name in AGENT_COLUMNS:
+            np.save(os.path.join(path, name + '.npy'), np.array([agent.__dict__[name] for agent in agents], dtype=float))
+
+    header = {
+        'agents': [(agent.unique_id, _base_class(agent)) for agent in agents],
+        'state': model.state is not None,
+        'space': dict(x_max=space.x_max, y_max=space.y_max, torus=space.torus, x_min=space.x_min,
+                      y_min=space.y_min, cell_size=space.cell_size, group_key=space.group_key,
+                      verlet_radius=space.verlet_radius, verlet_skin=space.verlet_skin),
+        'groups': [space.get_group(agent) for agent in agents] if space.group_key is not None else None,
+    }
+    body = {
+        'agents': [{name: value for name, value in agent.__dict__.items() if name not in skipped}
+                   for agent in agents],
+        'model': {name: value for name, value in model.__dict__.items() if name not in _REBUILT},
+        'schedule': (type(model.schedule), [agent.unique_id for agent in model.schedule.agent_buffer(False)],
+                     {name: value for name, value in model.schedule.__dict__.items()
+                      if not name.startswith('_') and name != 'model'}),
+        'random': model.random.getstate(),
+        'rng': model.rng.bit_generator.state,
+    }
+    with open(os.path.join(path, 'model.pkl'), 'wb') as f:
+        pickle.dump(header, f, pickle.HIGHEST_PROTOCOL)
+        _Pickler(f, model, agents).dump(body)
+
+
+def load(model_class, path, verbosity=battle_log.OFF, mmap_mode=None):
+    """ Rebuild a BattleModel from a snapshot written by save.
+
+    Args:
+        model_class: BattleModel, or the subclass the snapshot was taken of.
+        path: Directory of the snapshot.
+        verbosity: Verbosity of the restored model; with PER_EVENT, its log
+                   starts again, in logi/, from the current step.
+        mmap_mode: If provided, mode in which to np.load the arrays, e.g. 'c'
+                   to memory-map them copy-on-write. BattleState columns are
+                   used as loaded, so many models restored from one snapshot
+                   share its pages until they write to them; the model writes
+                   to its columns every step, so 'r' is refused for them, and
+                   'r+' writes the battle back into the snapshot.
+    """
+    def array(name):
+        return np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode)
+
+    model = model_class.__new__(model_class)
+    with open(os.path.join(path, 'model.pkl'), 'rb') as f:
+        header = pickle.load(f)
+        if header['state'] and mmap_mode == 'r':
+            raise ValueError("BattleState columns are written to every step, so they cannot be mapped read-only; "
+                             "use mmap_mode='c' to map them copy-on-write")
+        agents = {}
+        for unique_id, agent_class in header['agents']:
+            if header['state']:
+                agent_class = battle_state.state_view_class(agent_class)
+            agents[unique_id] = agent_class.__new__(agent_class)
+        body = _Unpickler(f, model, agents).load()
+
+    model.__dict__.update(body['model'])
+    model.random = random.Random()
+    model.random.setstate(body['random'])
+    model.rng = np.random.default_rng()
+    model.rng.bit_generator.state = body['rng']
+    model.verbosity = verbosity
+    model.log = battle_log.BattleLog(model) if verbosity == battle_log.PER_EVENT else battle_log.NullLog()
+    model.velocity_vectors = {}
+    model.neighbor_cache = warrior_agent.NeighborCache(model)
+    model.graph = None
+    # a restored battle state is private to the model, never shared
+    model.shared = None
+
+    in_space_order = [agents[unique_id] for unique_id, _ in header['agents']]
+    for agent, attributes in zip(in_space_order, body['agents']):
+        agent.__dict__.update(attributes)
+    model.state = None
+    if header['state']:
+        model.state = battle_state.BattleState(0)
+        for name in STATE_COLUMNS:
+            setattr(model.state, name, array('state_' + name))
+        model.state.size = model.state.hp.shape[0]
+    else:
+        columns = {name: array(name) for name in AGENT_COLUMNS}
+        for i, agent in enumerate(in_space_order):
+            agent.hp = float(columns['hp'][i])
+            agent.initial_hp = float(columns['initial_hp'][i])
+            agent.morale = float(columns['morale'][i])
+            agent.velocity = np.array(columns['velocity'][i])
+
+    model.space = ContinuousSpace(**header['space'])
+    model.space.place_agents(in_space_order, array('points'), header['groups'])
+    schedule_class, order, attributes = body['schedule']
+    model.schedule = schedule_class(model)
+    model.schedule.__dict__.update(attributes)
+    model.schedule.add_agents(agents[unique_id] for unique_id in order)
+    for agent in in_space_order:
+        model.log.register(agent, spawned=False)
+    return model
+
+
+def _base_class(agent):
+    """ The warrior agent class of an agent, also for BattleState views. """
+    if isinstance(agent, battle_state.StateView):
+        return type(agent).__bases__[1]
+    return type(agent)
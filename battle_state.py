@@ -0,0 +1,144 @@
+import numpy as np
+
+TYPES = ('red', 'blue', 'dead')
+SUBTYPES = ('warrior', 'general', 'healer', 'marksman', 'guard', 'flagger')
+COLUMNS = ('hp', 'initial_hp', 'morale', 'velocity', 'position', 'type', 'subtype')
+
+
+class BattleState:
+    """ Columnar store of the per-agent battle state.
+
+    Every agent gets a slot when it is created; hp, morale, velocity, position,
+    type and subtype of all agents live in NumPy arrays indexed by slot, so
+    that whole-army updates can work on the arrays directly. Slots are never
+    reused: dead agents keep theirs, with the 'dead' type.
+
+    The columns are made by allocate(shape, dtype), which returns a new
+    zeroed array: np.zeros, or e.g. battle_shared.SharedArrays.zeros to keep
+    them in shared memory. If release is given, it is called with every
+    column replaced by a larger one.
+    """
+
+    def __init__(self, capacity=16, allocate=np.zeros, release=None):
+        self.size = 0
+        self.allocate = allocate
+        self.release = release
+        self.hp = allocate(capacity, float)
+        self.initial_hp = allocate(capacity, float)
+        self.morale = allocate(capacity, float)
+        self.velocity = allocate((capacity, 2), float)
+        self.position = allocate((capacity, 2), float)
+        self.position[:] = np.nan
+        self.type = allocate(capacity, np.int8)
+        self.subtype = allocate(capacity, np.int8)
+
+    def add(self):
+        """ Reserve the slot of a new agent and return it. """
+        if self.size == self.hp.shape[0]:
+            self._grow(max(16, 2 * self.size))
+        slot = self.size
+        self.size += 1
+        return slot
+
+    def _grow(self, capacity):
+        for name in COLUMNS:
+            column = getattr(self, name)
+            grown = self.allocate((capacity,) + column.shape[1:], column.dtype)
+            grown[:column.shape[0]] = column
+            setattr(self, name, grown)
+            if self.release is not None:
+                self.release(column)
+        self.position[self.size:] = np.nan
+
+    def alive(self):
+        """ Boolean mask of the slots of living agents. """
+        return self.type[:self.size] != TYPES.index('dead')
+
+    def of_type(self, type):
+        """ Boolean mask of the slots of agents of the given type. """
+        return self.type[:self.size] == TYPES.index(type)
+
+
+def slots_of(agents):
+    """ Array of the slots of the given agents, to index the columns of their BattleState with. """
+    return np.fromiter((agent.slot for agent in agents), dtype=int, count=len(agents))
+
+
+class StateColumn:
+    """ Attribute of an agent stored in a column of its model's BattleState. """
+
+    def __init__(self, column):
+        self.column = column
+
+    def __get__(self, agent, owner=None):
+        if agent is None:
+            return self
+        return float(getattr(agent.model.state, self.column)[agent.slot])
+
+    def __set__(self, agent, value):
+        getattr(agent.model.state, self.column)[agent.slot] = value
+
+
+class VectorColumn(StateColumn):
+    """ 2D vector attribute; reading it returns a view on the agent's row. """
+
+    def __get__(self, agent, owner=None):
+        if agent is None:
+            return self
+        row = getattr(agent.model.state, self.column)[agent.slot]
+        if self.column == 'position' and np.isnan(row[0]):
+            return None
+        return row
+
+    def __set__(self, agent, value):
+        if value is None:
+            value = np.nan
+        getattr(agent.model.state, self.column)[agent.slot] = value
+
+
+class CodeColumn(StateColumn):
+    """ String attribute stored as its index in a tuple of known values. """
+
+    def __init__(self, column, values):
+        super().__init__(column)
+        self.values = values
+        self.codes = {value: code for code, value in enumerate(values)}
+
+    def __get__(self, agent, owner=None):
+        if agent is None:
+            return self
+        return self.values[getattr(agent.model.state, self.column)[agent.slot]]
+
+    def __set__(self, agent, value):
+        getattr(agent.model.state, self.column)[agent.slot] = self.codes[value]
+
+
+class StateView:
+    """ Mixin turning a warrior agent class into a thin view on a BattleState.
+
+    Must come before the agent class in the bases, so its columns take the
+    place of the plain instance attributes.
+    """
+    hp = StateColumn('hp')
+    initial_hp = StateColumn('initial_hp')
+    morale = StateColumn('morale')
+    velocity = VectorColumn('velocity')
+    pos = VectorColumn('position')
+    type = CodeColumn('type', TYPES)
+    subtype = CodeColumn('subtype', SUBTYPES)
+
+    def __init__(self, unique_id, army, model):
+        self.model = model
+        self.slot = model.state.add()
+        super().__init__(unique_id, army, model)
+
+
+_view_classes = {}
+
+
+def state_view_class(agent_class):
+    """ Get the BattleState-backed version of a warrior agent class. """
+    if agent_class not in _view_classes:
+        _view_classes[agent_class] = type(agent_class.__name__, (StateView, agent_class),
+                                          {'__module__': agent_class.__module__})
+    return _view_classes[agent_class]
@@ -0,0 +1,98 @@
+import numpy as np
+
+from battle_state import TYPES, slots_of
+from csr import filter_rows, row_means, row_numbers, row_sums
+
+
+def _neighbors(space, agents, radii, graph=None):
+    """ CSR neighbors (excluding agents at the exact same position) of every
+    agent, each within its own radius; from the graph for the radii it covers.
+
+    """
+    indptr = np.zeros(len(agents) + 1, dtype=int)
+    rows_indices = [None] * len(agents)
+    for radius in set(radii):
+        rows = [i for i, r in enumerate(radii) if r == radius]
+        if graph is not None and radius <= graph.radius:
+            sub_indptr, sub_indices = graph.get_agent_neighbors_batch([agents[i] for i in rows], radius)
+        else:
+            sub_indptr, sub_indices = space.get_agent_neighbors_batch([agents[i] for i in rows], radius, False)
+        for k, i in enumerate(rows):
+            rows_indices[i] = sub_indices[sub_indptr[k]:sub_indptr[k + 1]]
+    np.cumsum([len(row) for row in rows_indices], out=indptr[1:])
+    indices = np.concatenate(rows_indices) if agents else np.empty(0, dtype=int)
+    return indptr, indices
+
+
+def velocity_vectors(space, agents, graph=None, state=None):
+    """ Compute the boids velocity vector of many warriors at once.
+
+    For every agent this gives what its calculate_velocity_vector() returns
+    for the current positions and velocities: coherence, match and separation
+    with the allies in its flocking radius, plus coherence with the enemies in
+    its scanning radius unless the agent's class has follows_enemies False.
+    Sums are accumulated in the same order as the per-agent loops, so the
+    results are numerically identical.
+
+    Args:
+        space: The ContinuousSpace the agents are placed in.
+        agents: List of living warrior agents.
+        graph: Optional current NeighborGraph of the space, used for the
+               radii it covers.
+        state: The BattleState of the agents, if they are views on one; the
+               types and velocities of everyone are then read from its
+               columns instead of from each agent.
+
+    Returns:
+        Array with one velocity vector (before normalisation) per agent.
+    """
+    n_space = space._agent_points.shape[0]
+    everyone = space.get_agents_by_index(range(n_space))
+    if state is not None:
+        slots = slots_of(everyone)
+        types = state.type[slots]
+        velocities = state.velocity[slots]
+        dead = TYPES.index('dead')
+    else:
+        types = np.array([warrior.type for warrior in everyone])
+        velocities = np.array([warrior.velocity for warrior in everyone]).reshape(-1, 2)
+        dead = 'dead'
+    points = space._agent_points
+    own = np.array([space._agent_to_index[agent] for agent in agents], dtype=int)
+    own_points = points[own]
+    own_types = types[own]
+
+    def factor(name):
+        return np.array([getattr(agent, name) for agent in agents], dtype=float)[:, np.newaxis]
+
+    # allies in flocking radius
+    indptr, indices = _neighbors(space, agents, [agent.FLOCKING_RADIUS for agent in agents], graph)
+    rows = row_numbers(indptr)
+    indptr, indices = filter_rows(indptr, indices, types[indices] == own_types[rows])
+    rows = row_numbers(indptr)
+    headings = space.get_headings(own_points[rows], points[indices])
+
+    coherence = row_means(indptr, headings)
+    match = row_means(indptr, velocities[indices])
+    separation_distance = factor('SEPARATION_DISTANCE')[:, 0]
+    close = space.get_distances(own_points[rows], points[indices]) < separation_distance[rows]
+    close_indptr, _ = filter_rows(indptr, indices, close)
+    separation = -row_sums(close_indptr, headings[close])
+
+    velocity = (coherence * factor('COHERENCE_FACTOR') +
+                match * factor('MATCH_FACTOR') +
+                separation * factor('SEPARATION_FACTOR'))
+
+    # enemies in scanning radius
+    hunters = [i for i, agent in enumerate(agents) if agent.follows_enemies]
+    if hunters:
+        hunting = [agents[i] for i in hunters]
+        indptr, indices = _neighbors(space, hunting, [agent.ENEMY_SCANNING_RADIUS for agent in hunting], graph)
+        rows = row_numbers(indptr)
+        enemy = (types[indices] != own_types[hunters][rows]) & (types[indices] != dead)
+        indptr, indices = filter_rows(indptr, indices, enemy)
+        rows = row_numbers(indptr)
+        enemies = row_means(indptr, space.get_headings(own_points[hunters][rows], points[indices]))
+        velocity[hunters] = velocity[hunters] + enemies * factor('ENEMY_POSITION_FACTOR')[hunters]
+
+    return velocity
@@ -0,0 +1,62 @@
+import numpy as np
+
+# Helpers for neighbor structures in CSR form, as returned by
+# ContinuousSpace.get_neighbors_batch: the neighbors of row i are
+# indices[indptr[i]:indptr[i + 1]].
+
+
+def row_numbers(indptr):
+    """ Row of every entry of a CSR structure. """
+    return np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+
+
+def filter_rows(indptr, indices, keep):
+    """ Drop the entries of a CSR neighbor structure where keep is False. """
+    counts = np.bincount(row_numbers(indptr)[keep], minlength=len(indptr) - 1)
+    new_indptr = np.zeros(len(indptr), dtype=int)
+    np.cumsum(counts, out=new_indptr[1:])
+    return new_indptr, indices[keep]
+
+
+def sort_rows(indptr, indices, keys):
+    """ Sort the entries of every CSR row by their keys (stable). """
+    order = np.lexsort((keys, row_numbers(indptr)))
+    return indptr, indices[order]
+
+
+def row_sums(indptr, values):
+    """ Sum the values of every CSR row, adding them one at a time in row
+    order, so that the sums are bit-identical to a Python loop of +=.
+
+    """
+    counts = np.diff(indptr)
+    sums = np.zeros((len(counts),) + values.shape[1:])
+    for k in range(counts.max() if len(counts) else 0):
+        rows = np.flatnonzero(counts > k)
+        sums[rows] += values[indptr[rows] + k]
+    return sums
+
+
+def row_means(indptr, values):
+    """ Mean of the values of every CSR row, 0 for empty rows. """
+    sums = row_sums(indptr, values)
+    counts = np.diff(indptr)
+    nonempty = counts > 0
+    sums[nonempty] /= counts[nonempty].reshape((-1,) + (1,) * (values.ndim - 1))
+    return sums
+
+
+def row_cumsums(indptr, values):
+    """ Running sums of the values within every CSR row, added one at a time
+    in row order like row_sums, whose sums are the last running sums of the
+    rows.
+
+    """
+    counts = np.diff(indptr)
+    running = np.zeros(values.shape)
+    sums = np.zeros((len(counts),) + values.shape[1:])
+    for k in range(counts.max() if len(counts) else 0):
+        rows = np.flatnonzero(counts > k)
+        sums[rows] += values[indptr[rows] + k]
+        running[indptr[rows] + k] = sums[rows]
+    return running
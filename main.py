@@ -5,4 +5,7 @@ a = True
 while a:
     a = walka.step()
 
+walka.log.close()
+walka.log.write_agent_files()
+
 print("Bitwa została zakończona.")
\ No newline at end of file
@@ -610,10 +610,32 @@ class ContinuousSpace:
     their position as an (x, y) tuple. This class uses a numpy array internally
     to store agent objects, to speed up neighborhood lookups.
 
+    If a cell_size is given, the space additionally keeps a uniform-grid
+    spatial hash: the agent indices sorted by cell, so radius queries only
+    need to look at the agents in the cells overlapping the query. Agents
+    that changed cell since the hash was built are looked at by every query,
+    until there are enough of them to rebuild it. Queries covering a large
+    part of the grid scan all agents instead.
+
+    If a group_key is given, every agent is assigned to the group named by
+    that attribute of the agent when it is placed (e.g. its team), and
+    neighbor queries can be restricted to one group or to all but one group
+    without building Python lists of the agents filtered out.
+
+    If a verlet_radius is given, the space keeps Verlet neighbor lists: the
+    agents within verlet_radius + verlet_skin of every agent, rebuilt only
+    once some agent has moved more than verlet_skin / 2 since the last build
+    (or agents were placed or removed). Queries around an agent with a radius
+    up to verlet_radius (get_agent_neighbors) then only look at its list.
+
     """
     _grid = None
+    # Largest number of pairwise distances computed at once by batch queries
+    _batch_block_size = 2 ** 20
 
-    def __init__(self, x_max, y_max, torus, x_min=0, y_min=0):
+    def __init__(self, x_max, y_max, torus, x_min=0, y_min=0, cell_size=None,
+                 group_key=None, verlet_radius=None, verlet_skin=1.0,
+                 allocate=np.empty, release=None):
         """ Create a new continuous space.
 
         Args:
@@ -622,6 +644,25 @@ class ContinuousSpace:
             x_min, y_min: (default 0) If provided, set the minimum x and y
                           coordinates for the space. Below them, values loop to
                           the other edge (if torus=True) or raise an exception.
+            cell_size: (default None) If provided, the side length of the
+                       spatial hash cells used to speed up get_neighbors.
+                       Queries return exactly the same agents either way.
+            group_key: (default None) If provided, the name of the agent
+                       attribute partitioning the agents into groups. It is
+                       read once, when the agent is placed.
+            verlet_radius: (default None) If provided, the largest radius of
+                           the agent queries answered from Verlet lists.
+                           Queries return exactly the same agents either way.
+            verlet_skin: (default 1.0) Extra radius of the Verlet lists. It
+                         has to be more than twice the distance agents move
+                         at once, or the lists are rebuilt on nearly every
+                         move, which is slower than no lists at all.
+            allocate: (default np.empty) Function (shape, dtype) returning
+                      a new array, used for the storage of the points, e.g.
+                      to keep them in shared memory.
+            release: (default None) If provided, function called with an
+                     array made by allocate once the space has replaced it
+                     with a larger one.
 
         """
         self.x_min = x_min
@@ -634,10 +675,48 @@ class ContinuousSpace:
         self.size = np.array((self.width, self.height))
         self.torus = torus
 
+        # _agent_points is a view on the first rows of _points_buffer, whose
+        # capacity doubles whenever it fills up
+        self.allocate = allocate
+        self.release = release
+        self._points_buffer = None
         self._agent_points = None
         self._index_to_agent = {}
         self._agent_to_index = {}
 
+        # Group codes of the agents, stored alongside _agent_points
+        self.group_key = group_key
+        self._group_codes = {}
+        self._groups_buffer = None
+        self._agent_groups = None
+
+        # Bumped on every change of agent positions, so that callers can tell
+        # whether neighbor query results they kept are still valid
+        self.version = 0
+
+        # (order, starts, built_codes) of the spatial hash: the indices of
+        # the agents sorted by cell code (cy * n_cells_x + cx), those in cell
+        # c being order[starts[c]:starts[c + 1]], and the cell code of every
+        # index at the build (-1 for a NaN or infinite point); None when it
+        # has to be built before the next query. _dirty holds the indices
+        # whose cell has changed since the build (_dirty_array the same, as
+        # an array, or None when it has to be made again).
+        self.cell_size = cell_size
+        self._cells = None
+        self._dirty = set()
+        self._dirty_array = None
+        if cell_size is not None:
+            self._n_cells_x = int(np.ceil(self.width / cell_size))
+            self._n_cells_y = int(np.ceil(self.height / cell_size))
+
+        # (indptr, indices, points at the build) of the Verlet lists, None
+        # when they have to be rebuilt before the next query
+        if verlet_radius is not None and not verlet_skin > 0:
+            raise ValueError("verlet_skin must be positive")
+        self.verlet_radius = verlet_radius
+        self.verlet_skin = verlet_skin
+        self._verlet = None
+
     def place_agent(self, agent, pos):
         """ Place a new agent in the space.
 
@@ -647,14 +726,99 @@ class ContinuousSpace:
 
         """
         pos = self.torus_adj(pos)
-        if self._agent_points is None:
-            self._agent_points = np.array([pos])
-        else:
-            self._agent_points = np.append(self._agent_points, np.array([pos]), axis=0)
-        self._index_to_agent[self._agent_points.shape[0] - 1] = agent
-        self._agent_to_index[agent] = self._agent_points.shape[0] - 1
+        idx = len(self._agent_to_index)
+        self._reserve(idx + 1)
+        self._points_buffer[idx] = pos
+        self._agent_points = self._points_buffer[:idx + 1]
+        if self.group_key is not None:
+            group = getattr(agent, self.group_key)
+            self._groups_buffer[idx] = self._group_codes.setdefault(group, len(self._group_codes))
+            self._agent_groups = self._groups_buffer[:idx + 1]
+        self._index_to_agent[idx] = agent
+        self._agent_to_index[agent] = idx
+        if self._cells is not None:
+            self._cell_update(idx)
+        self._verlet = None
+        self.version += 1
         agent.pos = pos
 
+    def place_agents(self, agents, positions, groups=None):
+        """ Place many new agents in the space at once.
+
+        Same as calling place_agent for every agent in turn, but the storage
+        grows at most once and positions are adjusted with array operations.
+
+        Args:
+            agents: List of agent objects to place.
+            positions: Array of shape (n, 2) with the positions of the agents.
+            groups: (default None) If provided, the groups to place the agents
+                    in, instead of reading their group_key attribute.
+
+        """
+        positions = np.array(positions, dtype=float).reshape(-1, 2)
+        out = ((positions[:, 0] < self.x_min) | (positions[:, 0] >= self.x_max) |
+               (positions[:, 1] < self.y_min) | (positions[:, 1] >= self.y_max))
+        if out.any():
+            if not self.torus:
+                raise Exception("Point out of bounds, and space non-toroidal.")
+            positions[out] = (self.x_min, self.y_min) + (positions[out] - (self.x_min, self.y_min)) % self.size
+        start = len(self._agent_to_index)
+        end = start + len(agents)
+        self._reserve(end)
+        self._points_buffer[start:end] = positions
+        self._agent_points = self._points_buffer[:end]
+        if self.group_key is not None:
+            if groups is None:
+                groups = [getattr(agent, self.group_key) for agent in agents]
+            self._groups_buffer[start:end] = [
+                self._group_codes.setdefault(group, len(self._group_codes))
+                for group in groups]
+            self._agent_groups = self._groups_buffer[:end]
+        self._index_to_agent.update(zip(range(start, end), agents))
+        self._agent_to_index.update(zip(agents, range(start, end)))
+        if self._cells is not None:
+            built_codes = self._cells[2]
+            codes = self._cell_codes(positions)
+            built = np.full(end - start, -2)
+            known = max(0, min(end, built_codes.shape[0]) - start)
+            built[:known] = built_codes[start:start + known]
+            rows = np.arange(start, end)
+            self._dirty.difference_update(rows[codes == built].tolist())
+            self._dirty.update(rows[codes != built].tolist())
+            self._dirty_array = None
+            self._check_dirty()
+        self._verlet = None
+        self.version += 1
+        for agent, pos in zip(agents, positions):
+            agent.pos = pos
+
+    def _reserve(self, n):
+        """ Make sure the storage has room for n agents, doubling its capacity
+        as many times as needed.
+
+        """
+        if self._points_buffer is None:
+            capacity = 16
+        else:
+            capacity = self._points_buffer.shape[0]
+            if n <= capacity:
+                return
+        while capacity < n:
+            capacity *= 2
+        size = len(self._agent_to_index)
+        buffer = self.allocate((capacity, 2), float)
+        old_buffer, self._points_buffer = self._points_buffer, buffer
+        if old_buffer is not None:
+            buffer[:size] = old_buffer[:size]
+            self._agent_points = buffer[:size]
+            if self.release is not None:
+                self.release(old_buffer)
+        if self.group_key is not None:
+            groups = np.empty(capacity, dtype=int)
+            if self._groups_buffer is not None:
+                groups[:size] = self._groups_buffer[:size]
+            self._groups_buffer = groups
+
     def move_agent(self, agent, pos):
         """ Move an agent from its current position to a new position.
 
@@ -667,6 +831,18 @@ class ContinuousSpace:
         idx = self._agent_to_index[agent]
         self._agent_points[idx, 0] = pos[0]
         self._agent_points[idx, 1] = pos[1]
+        if self._cells is not None:
+            self._cell_update(idx)
+        if self._verlet is not None:
+            built_x, built_y = self._verlet[2][idx].tolist()
+            dx = abs(float(pos[0]) - built_x)
+            dy = abs(float(pos[1]) - built_y)
+            if self.torus:
+                dx = min(dx, self.width - dx)
+                dy = min(dy, self.height - dy)
+            if not dx * dx + dy * dy <= (self.verlet_skin / 2) ** 2:
+                self._verlet = None
+        self.version += 1
         agent.pos = pos
 
     def remove_agent(self, agent):
@@ -677,20 +853,32 @@ class ContinuousSpace:
             """
         if agent not in self._agent_to_index:
             raise Exception("Agent does not exist in the space")
-        idx = self._agent_to_index[agent]
-        del self._agent_to_index[agent]
-        max_idx = max(self._index_to_agent.keys())
-        # Delete the agent's position and decrement the index/agent mapping
-        self._agent_points = np.delete(self._agent_points, idx, axis=0)
-        for a, index in self._agent_to_index.items():
-            if index > idx:
-                self._agent_to_index[a] = index - 1
-                self._index_to_agent[index - 1] = a
-        # The largest index is now redundant
-        del self._index_to_agent[max_idx]
+        idx = self._agent_to_index.pop(agent)
+        last_idx = self._agent_points.shape[0] - 1
+        # Move the last agent into the freed row, so only its mapping changes
+        if idx != last_idx:
+            last_agent = self._index_to_agent[last_idx]
+            self._agent_points[idx] = self._agent_points[last_idx]
+            if self._agent_groups is not None:
+                self._agent_groups[idx] = self._agent_groups[last_idx]
+            if self._cells is not None:
+                self._cell_update(idx)
+            self._index_to_agent[idx] = last_agent
+            self._agent_to_index[last_agent] = idx
+        del self._index_to_agent[last_idx]
+        # The hash may still list last_idx; queries skip indices past the end
+        if last_idx in self._dirty:
+            self._dirty.discard(last_idx)
+            self._dirty_array = None
+        self._agent_points = self._points_buffer[:last_idx]
+        if self._agent_groups is not None:
+            self._agent_groups = self._groups_buffer[:last_idx]
+        self._verlet = None
+        self.version += 1
         agent.pos = None
 
-    def get_neighbors(self, pos, radius, include_center=True):
+    def get_neighbors(self, pos, radius, include_center=True, group=None,
+                      exclude_group=None):
         """ Get all objects within a certain radius.
 
         Args:
@@ -700,16 +888,430 @@ class ContinuousSpace:
                             coordinates. i.e. if you are searching for the
                             neighbors of a given agent, True will include that
                             agent in the results.
+            group: If provided, only return agents placed in this group.
+            exclude_group: If provided, skip agents placed in this group.
+                           Both need the space to have a group_key.
 
         """
-        deltas = np.abs(self._agent_points - np.array(pos))
+        idxs, _ = self._neighbor_indices(pos, radius, include_center, group,
+                                         exclude_group)
+        return self.get_agents_by_index(idxs)
+
+    def get_neighbors_with_sq_distances(self, pos, radius, include_center=True,
+                                        group=None, exclude_group=None):
+        """ Get all objects within a certain radius, with their distances.
+
+        Args:
+            pos, radius, include_center, group, exclude_group: As in
+                get_neighbors.
+
+        Returns:
+            The neighbors list, as returned by get_neighbors, and a numpy
+            array of their *squared* distances from pos. Comparing these with
+            a smaller radius ** 2 gives exactly what get_neighbors would
+            return for that radius.
+
+        """
+        idxs, sq_dists = self._neighbor_indices(pos, radius, include_center,
+                                                group, exclude_group)
+        return self.get_agents_by_index(idxs), sq_dists
+
+    def _neighbor_indices(self, pos, radius, include_center, group=None,
+                          exclude_group=None, candidates=None):
+        """ Get the sorted space indices of the agents within radius of pos,
+        and their squared distances from it; only among the given sorted
+        candidate indices, if any.
+
+        """
+        codes = self._wanted_group_codes(group, exclude_group)
+        if candidates is not None:
+            if codes is not None:
+                candidates = candidates[self._group_mask(codes)[self._agent_groups[candidates]]]
+        elif self.cell_size is not None:
+            candidates = self._cell_candidates(pos, radius, codes)
+        if candidates is None and codes is not None:
+            candidates, = np.where(self._group_mask(codes)[self._agent_groups])
+        if candidates is None:
+            points = self._agent_points
+        else:
+            points = self._agent_points[candidates]
+
+        deltas = np.abs(points - np.array(pos))
         if self.torus:
             deltas = np.minimum(deltas, self.size - deltas)
         dists = deltas[:, 0] ** 2 + deltas[:, 1] ** 2
 
-        idxs, = np.where(dists <= radius ** 2)
-        neighbors = [self._index_to_agent[x] for x in idxs if include_center or dists[x] > 0]
-        return neighbors
+        within = dists <= radius ** 2
+        if not include_center:
+            within &= dists > 0
+        idxs, = np.where(within)
+        if candidates is None:
+            return idxs, dists[idxs]
+        return candidates[idxs], dists[idxs]
+
+    def get_agent_neighbors(self, agent, radius, include_center=True,
+                            group=None, exclude_group=None):
+        """ Get all objects within a certain radius of an agent.
+
+        Same as get_neighbors(agent.pos, ...), but answered from the Verlet
+        lists when the space keeps them and radius <= verlet_radius.
+
+        Args:
+            agent: Agent placed in the space to center the search at.
+            radius, include_center, group, exclude_group: As in get_neighbors.
+
+        """
+        return self.get_agent_neighbors_with_sq_distances(
+            agent, radius, include_center, group, exclude_group)[0]
+
+    def get_agent_neighbors_with_sq_distances(self, agent, radius,
+                                              include_center=True, group=None,
+                                              exclude_group=None):
+        """ Get all objects within a certain radius of an agent, with their
+        squared distances, as get_neighbors_with_sq_distances(agent.pos, ...).
+
+        """
+        candidates = None
+        if self.verlet_radius is not None and radius <= self.verlet_radius:
+            candidates = self._verlet_list(self._agent_to_index[agent])
+        idxs, sq_dists = self._neighbor_indices(agent.pos, radius,
+                                                include_center, group,
+                                                exclude_group, candidates)
+        return self.get_agents_by_index(idxs), sq_dists
+
+    def _verlet_list(self, idx):
+        """ Get the sorted indices in the Verlet list of the agent with the
+        given index, rebuilding the lists first if needed.
+
+        """
+        if self._verlet is None:
+            points = self._agent_points.copy()
+            indptr, indices = self.get_neighbors_batch(
+                points, self.verlet_radius + self.verlet_skin, True)
+            self._verlet = (indptr, indices, points)
+        indptr, indices, _ = self._verlet
+        return indices[indptr[idx]:indptr[idx + 1]]
+
+    def get_neighbors_batch(self, positions, radius, include_center=True,
+                            return_distances=False):
+        """ Get the agents within a certain radius of many points at once.
+
+        The distances are computed in one vectorized pass over blocks of the
+        query points, instead of one get_neighbors call per point. With the
+        spatial hash, the query points are grouped by tiles of cells, and
+        every block only pairs the points of a tile with the agents in the
+        cells around it, instead of with all agents.
+
+        Args:
+            positions: Array-like of (x, y) coordinates to center the searches
+                       at, one row per query.
+            radius: Get all the objects within this distance of each center.
+            include_center: If True, include objects at the *exact* provided
+                            coordinates, as in get_neighbors.
+            return_distances: If True, also return the *squared* distances of
+                              the neighbors, aligned with indices.
+
+        Returns:
+            (indptr, indices) CSR-style arrays: the space indices of the
+            neighbors of query i are indices[indptr[i]:indptr[i + 1]], in the
+            same order get_neighbors would return them. Use get_agents_by_index
+            to turn them into agents. With return_distances, (indptr, indices,
+            sq_distances).
+
+        """
+        positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        n_queries = positions.shape[0]
+        points = self._agent_points
+        if points is None:
+            points = np.empty((0, 2))
+        if self.cell_size is not None and n_queries and points.shape[0]:
+            result = self._hashed_batch(positions, radius, include_center,
+                                        return_distances)
+            if result is not None:
+                return result
+        indptr = np.zeros(n_queries + 1, dtype=int)
+        chunks = [np.empty(0, dtype=int)]
+        dist_chunks = [np.empty(0)]
+        block = max(1, self._batch_block_size // max(1, points.shape[0]))
+        for start in range(0, n_queries, block):
+            stop = min(start + block, n_queries)
+            deltas = np.abs(points[np.newaxis, :, :] - positions[start:stop, np.newaxis, :])
+            if self.torus:
+                deltas = np.minimum(deltas, self.size - deltas)
+            dists = deltas[..., 0] ** 2 + deltas[..., 1] ** 2
+            within = dists <= radius ** 2
+            if not include_center:
+                within &= dists > 0
+            rows, cols = np.nonzero(within)
+            indptr[start + 1:stop + 1] = np.bincount(rows, minlength=stop - start)
+            chunks.append(cols)
+            if return_distances:
+                dist_chunks.append(dists[rows, cols])
+        np.cumsum(indptr, out=indptr)
+        if return_distances:
+            return indptr, np.concatenate(chunks), np.concatenate(dist_chunks)
+        return indptr, np.concatenate(chunks)
+
+    def _hashed_batch(self, positions, radius, include_center,
+                      return_distances):
+        """ get_neighbors_batch, with the spatial hash; None if the radius is
+        too large for the hash to help.
+
+        """
+        # Tiles of cells about twice the radius wide: the agents around a
+        # tile are then only a few times more than the points in it
+        k = max(1, int(2 * radius // self.cell_size))
+        span = (k + 2 * int(np.ceil(radius / self.cell_size)) + 1) ** 2
+        if 4 * span >= self._n_cells_x * self._n_cells_y:
+            return None
+        n_queries = positions.shape[0]
+        points = self._agent_points
+        codes = self._cell_codes(positions)
+        finite = codes >= 0
+        n_tiles_x = -(-self._n_cells_x // k)
+        tiles = (codes // self._n_cells_x // k) * n_tiles_x + codes % self._n_cells_x // k
+        queries, = np.where(finite)
+        queries = queries[np.argsort(tiles[queries], kind='stable')]
+        bounds = np.flatnonzero(np.diff(tiles[queries])) + 1
+        rows_chunks = [np.empty(0, dtype=int)]
+        cols_chunks = [np.empty(0, dtype=int)]
+        dist_chunks = [np.empty(0)]
+        for tile_queries in np.split(queries, bounds):
+            if not tile_queries.shape[0]:
+                continue
+            tile_positions = positions[tile_queries]
+            lo = tile_positions.min(axis=0) - radius
+            hi = tile_positions.max(axis=0) + radius
+            candidates = self._box_candidates(lo[0], hi[0], lo[1], hi[1])
+            if candidates is None:
+                candidates = np.arange(points.shape[0])
+            deltas = np.abs(points[candidates][np.newaxis, :, :] - tile_positions[:, np.newaxis, :])
+            if self.torus:
+                deltas = np.minimum(deltas, self.size - deltas)
+            dists = deltas[..., 0] ** 2 + deltas[..., 1] ** 2
+            within = dists <= radius ** 2
+            if not include_center:
+                within &= dists > 0
+            rows, cols = np.nonzero(within)
+            rows_chunks.append(tile_queries[rows])
+            cols_chunks.append(candidates[cols])
+            if return_distances:
+                dist_chunks.append(dists[rows, cols])
+        rows = np.concatenate(rows_chunks)
+        cols = np.concatenate(cols_chunks)
+        # Row by row, in the order of the space indices, as the plain scan
+        order = np.lexsort((cols, rows))
+        indptr = np.zeros(n_queries + 1, dtype=int)
+        np.cumsum(np.bincount(rows, minlength=n_queries), out=indptr[1:])
+        if return_distances:
+            return indptr, cols[order], np.concatenate(dist_chunks)[order]
+        return indptr, cols[order]
+
+    def get_agent_neighbors_batch(self, agents, radius, include_center=True):
+        """ Get the agents within a certain radius of each of the given agents.
+
+        Args:
+            agents: Sequence of agents placed in the space.
+            radius: Get all the objects within this distance of each agent.
+            include_center: If True, include objects at the *exact* position of
+                            each agent, i.e. the agent itself.
+
+        Returns:
+            (indptr, indices) CSR-style arrays as in get_neighbors_batch, with
+            one row per agent.
+
+        """
+        idxs = [self._agent_to_index[agent] for agent in agents]
+        return self.get_neighbors_batch(self._agent_points[idxs], radius,
+                                        include_center)
+
+    def get_neighbor_graph(self, radius):
+        """ Get the NeighborGraph of all agents within radius of each other,
+        for their current positions.
+
+        """
+        return NeighborGraph(self, radius)
+
+    def get_group(self, agent):
+        """ Get the group the agent was placed in. """
+        code = self._agent_groups[self._agent_to_index[agent]]
+        return next(group for group, group_code in self._group_codes.items()
+                    if group_code == code)
+
+    def get_agents_by_index(self, indices):
+        """ Get the list of agents stored at the given space indices. """
+        return [self._index_to_agent[idx] for idx in indices]
+
+    def _wanted_group_codes(self, group, exclude_group):
+        """ Get the list of group codes a query is restricted to, or None if
+        it is not restricted.
+
+        """
+        if group is None and exclude_group is None:
+            return None
+        if self.group_key is None:
+            raise Exception("Space is not partitioned into groups.")
+        if group is not None:
+            codes = [self._group_codes[group]] if group in self._group_codes else []
+        else:
+            codes = list(self._group_codes.values())
+        if exclude_group in self._group_codes:
+            codes = [code for code in codes if code != self._group_codes[exclude_group]]
+        return codes
+
+    def _group_mask(self, codes):
+        """ Get a boolean array telling, by group code, whether the code is
+        one of the given ones.
+
+        """
+        mask = np.zeros(len(self._group_codes), dtype=bool)
+        mask[codes] = True
+        return mask
+
+    def _cell_code(self, pos):
+        """ Get the spatial hash cell code of a point, or -1 for a NaN or
+        infinite point, which is kept out of the hash (it is never within any
+        radius anyway).
+
+        """
+        x, y = float(pos[0]), float(pos[1])
+        if not (np.isfinite(x) and np.isfinite(y)):
+            return -1
+        # Torus wrapping can land a point exactly on the max edge
+        cx = min(max(int((x - self.x_min) // self.cell_size), 0), self._n_cells_x - 1)
+        cy = min(max(int((y - self.y_min) // self.cell_size), 0), self._n_cells_y - 1)
+        return cy * self._n_cells_x + cx
+
+    def _cell_codes(self, points):
+        """ Get the spatial hash cell codes of many points, as _cell_code. """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        finite = np.isfinite(points).all(axis=1)
+        cells = np.zeros(points.shape, dtype=int)
+        cells[finite] = np.clip((points[finite] - (self.x_min, self.y_min)) // self.cell_size,
+                                0, (self._n_cells_x - 1, self._n_cells_y - 1))
+        codes = cells[:, 1] * self._n_cells_x + cells[:, 0]
+        codes[~finite] = -1
+        return codes
+
+    def _build_cells(self):
+        """ Sort the indices of the agents by cell, for the spatial hash. """
+        n_cells = self._n_cells_x * self._n_cells_y
+        points = self._agent_points
+        if points is None:
+            points = np.empty((0, 2))
+        codes = self._cell_codes(points)
+        order = np.argsort(np.where(codes < 0, n_cells, codes), kind='stable')
+        starts = np.zeros(n_cells + 1, dtype=int)
+        np.cumsum(np.bincount(codes[codes >= 0], minlength=n_cells), out=starts[1:])
+        self._cells = (order, starts, codes)
+        self._dirty = set()
+        self._dirty_array = None
+
+    def _cell_update(self, idx):
+        """ Note whether the agent at the index is still in the cell it was
+        in when the hash was built.
+
+        """
+        built_codes = self._cells[2]
+        if idx < built_codes.shape[0] and \
+                self._cell_code(self._agent_points[idx]) == built_codes[idx]:
+            if idx in self._dirty:
+                self._dirty.discard(idx)
+                self._dirty_array = None
+        elif idx not in self._dirty:
+            self._dirty.add(idx)
+            self._dirty_array = None
+            self._check_dirty()
+
+    def _check_dirty(self):
+        """ Drop the hash, to be rebuilt by the next query, once every query
+        would have to look at too many agents that changed cell.
+
+        """
+        if len(self._dirty) > max(16, len(self._agent_to_index) // 16):
+            self._cells = None
+            self._dirty = set()
+            self._dirty_array = None
+
+    def _cell_ranges(self, lo, hi, v_min, extent, n_cells):
+        """ Get the cells along one axis overlapping [lo, hi], as a list of
+        (start, stop) ranges of cell indices.
+
+        """
+        def cell(v):
+            return min(max(int((v - v_min) // self.cell_size), 0), n_cells - 1)
+
+        if not self.torus:
+            if hi < v_min or lo >= v_min + extent:
+                return []
+            return [(cell(lo), cell(hi) + 1)]
+        if hi - lo >= extent:
+            return [(0, n_cells)]
+        span = hi - lo
+        lo = v_min + (lo - v_min) % extent
+        hi = lo + span
+        if hi < v_min + extent:
+            return [(cell(lo), cell(hi) + 1)]
+        first, last = cell(lo), cell(hi - extent) + 1
+        if last >= first:
+            return [(0, n_cells)]
+        return [(0, last), (first, n_cells)]
+
+    def _box_candidates(self, x_lo, x_hi, y_lo, y_hi):
+        """ Get the sorted indices of all agents in the cells overlapping a
+        box (and those that changed cell since the hash was built), or None
+        if the box covers a quarter of the grid or more, which is left to a
+        scan of all agents.
+
+        """
+        xs = self._cell_ranges(x_lo, x_hi, self.x_min, self.width, self._n_cells_x)
+        ys = self._cell_ranges(y_lo, y_hi, self.y_min, self.height, self._n_cells_y)
+        n_xs = sum(stop - start for start, stop in xs)
+        n_ys = sum(stop - start for start, stop in ys)
+        if 4 * n_xs * n_ys >= self._n_cells_x * self._n_cells_y:
+            return None
+        if self._cells is None:
+            self._build_cells()
+        order, starts, _ = self._cells
+        # The cells of one row of the grid with consecutive cx are one slice
+        pieces = [order[starts[row + x_start]:starts[row + x_stop]]
+                  for y_start, y_stop in ys
+                  for row in range(y_start * self._n_cells_x, y_stop * self._n_cells_x, self._n_cells_x)
+                  for x_start, x_stop in xs]
+        if self._dirty:
+            if self._dirty_array is None:
+                self._dirty_array = np.fromiter(self._dirty, dtype=int, count=len(self._dirty))
+            pieces.append(self._dirty_array)
+        if not pieces:
+            return np.empty(0, dtype=int)
+        candidates = np.concatenate(pieces)
+        candidates.sort()
+        if self._dirty and candidates.shape[0] > 1:
+            # An agent that changed cell can be both in the hash and dirty
+            keep = np.empty(candidates.shape[0], dtype=bool)
+            keep[0] = True
+            np.not_equal(candidates[1:], candidates[:-1], out=keep[1:])
+            candidates = candidates[keep]
+        # The hash may list indices of agents removed since the build
+        n = len(self._agent_to_index)
+        if candidates.shape[0] and candidates[-1] >= n:
+            candidates = candidates[:np.searchsorted(candidates, n)]
+        return candidates
+
+    def _cell_candidates(self, pos, radius, codes=None):
+        """ Get the sorted indices of all agents of the given group codes in
+        the cells overlapping a query, as _box_candidates, or None if the
+        query is left to a scan of all agents, or is around a NaN or infinite
+        point.
+
+        """
+        if not (np.isfinite(pos[0]) and np.isfinite(pos[1])):
+            return None
+        candidates = self._box_candidates(pos[0] - radius, pos[0] + radius,
+                                          pos[1] - radius, pos[1] + radius)
+        if candidates is not None and codes is not None:
+            candidates = candidates[self._group_mask(codes)[self._agent_groups[candidates]]]
+        return candidates
 
     def get_heading(self, pos_1, pos_2):
         """ Get the heading angle between two points, accounting for toroidal space.
@@ -744,6 +1346,45 @@ class ContinuousSpace:
             dy = min(dy, self.height - dy)
         return np.sqrt(dx * dx + dy * dy)
 
+    def get_headings(self, pos, positions):
+        """ Get the headings from a point to many points at once, as
+        get_heading does for one pair, accounting for toroidal space.
+
+        Args:
+            pos: Coordinates of the origin, or an array of origins with one
+                 row per point.
+            positions: Array of shape (n, 2) with the points.
+
+        Returns:
+            Array of shape (n, 2) with the heading to every point.
+
+        """
+        one = np.asarray(pos, dtype=float)
+        two = np.asarray(positions, dtype=float).reshape(-1, 2)
+        if self.torus:
+            one = (one - self.center) % self.size
+            two = (two - self.center) % self.size
+        return two - one
+
+    def get_distances(self, pos, positions):
+        """ Get the distances from a point to many points at once, as
+        get_distance does for one pair, accounting for toroidal space.
+
+        Args:
+            pos: Coordinates of the origin, or an array of origins with one
+                 row per point.
+            positions: Array of shape (n, 2) with the points.
+
+        Returns:
+            Array of shape (n,) with the distance to every point.
+
+        """
+        deltas = np.abs(np.asarray(pos, dtype=float) -
+                        np.asarray(positions, dtype=float).reshape(-1, 2))
+        if self.torus:
+            deltas = np.minimum(deltas, self.size - deltas)
+        return np.sqrt(deltas[:, 0] * deltas[:, 0] + deltas[:, 1] * deltas[:, 1])
+
     def torus_adj(self, pos):
         """ Adjust coordinates to handle torus looping.
 
@@ -774,6 +1415,85 @@ class ContinuousSpace:
                 y < self.y_min or y >= self.y_max)
 
 
+class NeighborGraph:
+    """ Neighbors of every agent of a ContinuousSpace within a fixed radius.
+
+    Built with one batched query, as CSR arrays over space indices with the
+    squared distances of the neighbors (agents at the exact same position are
+    left out, as with include_center=False). Any neighbor query with a radius
+    up to the graph's own is then answered by thresholding these distances,
+    with exactly the result the space would give. The graph describes the
+    positions at the time it was built: it is current only while the space's
+    version has not changed.
+
+    """
+    def __init__(self, space, radius):
+        """ Build the neighbor graph of a space.
+
+        Args:
+            space: The ContinuousSpace.
+            radius: Largest radius the graph can answer queries for.
+
+        """
+        self.space = space
+        self.radius = radius
+        self.version = space.version
+        points = space._agent_points
+        if points is None:
+            points = np.empty((0, 2))
+        self.indptr, self.indices, self.sq_distances = \
+            space.get_neighbors_batch(points, radius, False, True)
+
+    def is_current(self):
+        """ Whether no agent was placed, moved or removed since the build. """
+        return self.version == self.space.version
+
+    def _check(self, radius):
+        if not self.is_current():
+            raise Exception("Neighbor graph is out of date.")
+        if radius > self.radius:
+            raise Exception("Radius larger than the radius of the graph.")
+
+    def get_neighbors_with_sq_distances(self, agent, radius, group=None,
+                                        exclude_group=None):
+        """ Get the neighbors of an agent within a radius, with their squared
+        distances, as space.get_neighbors_with_sq_distances(agent.pos, radius,
+        False, group, exclude_group) would.
+
+        """
+        self._check(radius)
+        idx = self.space._agent_to_index[agent]
+        start, stop = self.indptr[idx], self.indptr[idx + 1]
+        idxs = self.indices[start:stop]
+        sq_dists = self.sq_distances[start:stop]
+        within = sq_dists <= radius ** 2
+        codes = self.space._wanted_group_codes(group, exclude_group)
+        if codes is not None:
+            within &= self.space._group_mask(codes)[self.space._agent_groups[idxs]]
+        return self.space.get_agents_by_index(idxs[within]), sq_dists[within]
+
+    def get_agent_neighbors_batch(self, agents, radius):
+        """ Get the neighbors of each of the given agents within a radius, as
+        space.get_agent_neighbors_batch(agents, radius, False) would.
+
+        """
+        self._check(radius)
+        rows = np.array([self.space._agent_to_index[agent] for agent in agents],
+                        dtype=int)
+        starts = self.indptr[rows]
+        counts = self.indptr[rows + 1] - starts
+        # positions in indices of the entries of the selected rows, row by row
+        offsets = np.zeros(len(rows) + 1, dtype=int)
+        np.cumsum(counts, out=offsets[1:])
+        take = np.arange(offsets[-1]) + np.repeat(starts - offsets[:-1], counts)
+        within = self.sq_distances[take] <= radius ** 2
+        row_of = np.repeat(np.arange(len(rows)), counts)
+        indptr = np.zeros(len(rows) + 1, dtype=int)
+        np.cumsum(np.bincount(row_of[within], minlength=len(rows)),
+                  out=indptr[1:])
+        return indptr, self.indices[take[within]]
+
+
 class NetworkGrid:
     """ Network Grid where each node contains zero or more agents. """
 
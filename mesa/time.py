@@ -22,6 +22,7 @@ Key concepts:
     model has taken.
 """
 
+import itertools
 from collections import OrderedDict
 
 
@@ -33,6 +34,13 @@ class BaseScheduler:
 
     (This is explicitly meant to replicate the scheduler in MASON).
 
+    Besides the id -> agent dict, agents are kept in a list of slots in the
+    order they were added. Removing an agent leaves a tombstone (None) in its
+    slot; tombstones are compacted away at the start of an activation once
+    they are a quarter of the slots.
+    Shuffled activations permute a reused buffer of slot numbers, so stepping
+    does not copy the keys of the dict every time.
+
     """
     def __init__(self, model):
         """ Create a new, empty BaseScheduler. """
@@ -40,6 +48,12 @@ class BaseScheduler:
         self.steps = 0
         self.time = 0
         self._agents = OrderedDict()
+        self._slots = []
+        self._slot_of = {}
+        self._tombstones = 0
+        self._permutation = []
+        self._iterating = 0
+        self._agent_list = None
 
     def add(self, agent):
         """ Add an Agent object to the schedule.
@@ -50,6 +64,23 @@ class BaseScheduler:
 
         """
         self._agents[agent.unique_id] = agent
+        slot = self._slot_of.get(agent.unique_id)
+        if slot is None:
+            self._slot_of[agent.unique_id] = len(self._slots)
+            self._slots.append(agent)
+        else:
+            self._slots[slot] = agent
+        self._agent_list = None
+
+    def add_agents(self, agents):
+        """ Add many Agent objects to the schedule at once, in the given order.
+
+        Args:
+            agents: Iterable of agents to be added to the schedule.
+
+        """
+        for agent in agents:
+            self.add(agent)
 
     def remove(self, agent):
         """ Remove all instances of a given agent from the schedule.
@@ -59,6 +90,9 @@ class BaseScheduler:
 
         """
         del self._agents[agent.unique_id]
+        self._slots[self._slot_of.pop(agent.unique_id)] = None
+        self._tombstones += 1
+        self._agent_list = None
 
     def step(self):
         """ Execute the step of all the agents, one at a time. """
@@ -69,24 +103,55 @@ class BaseScheduler:
 
     def get_agent_count(self):
         """ Returns the current number of agents in the queue. """
-        return len(self._agents.keys())
+        return len(self._agents)
 
     @property
     def agents(self):
-        return list(self._agents.values())
+        """ List of the agents, in the order they were added. Every call
+        returns a new list, copied from a tuple kept until agents are added
+        or removed.
+
+        """
+        if self._agent_list is None:
+            self._agent_list = tuple(self._agents.values())
+        return list(self._agent_list)
+
+    def _compact(self):
+        """ Drop the tombstones from the slots, keeping the order. """
+        self._slots[:] = [agent for agent in self._slots if agent is not None]
+        self._slot_of = {agent.unique_id: slot for slot, agent in enumerate(self._slots)}
+        self._tombstones = 0
 
     def agent_buffer(self, shuffled=False):
         """ Simple generator that yields the agents while letting the user
         remove and/or add agents during stepping.
 
         """
-        agent_keys = list(self._agents.keys())
+        if 4 * self._tombstones > len(self._slots) and not self._iterating:
+            self._compact()
+        n = len(self._slots)
         if shuffled:
-            self.model.random.shuffle(agent_keys)
-
-        for key in agent_keys:
-            if key in self._agents:
-                yield self._agents[key]
+            # nested shuffled activations get their own buffer
+            permutation = self._permutation if not self._iterating else []
+            if self._tombstones:
+                # only the live slots, in order, so the shuffle gives the same
+                # order as shuffling the keys of the dict
+                permutation[:] = itertools.compress(range(n), self._slots)
+            else:
+                permutation[:] = range(n)
+            self.model.random.shuffle(permutation)
+        else:
+            permutation = range(n)
+
+        slots = self._slots
+        self._iterating += 1
+        try:
+            for slot in permutation:
+                agent = slots[slot]
+                if agent is not None:
+                    yield agent
+        finally:
+            self._iterating -= 1
 
 
 class RandomActivation(BaseScheduler):
@@ -110,6 +175,52 @@ class RandomActivation(BaseScheduler):
         self.time += 1
 
 
+class ClassStagedActivation(BaseScheduler):
+    """ A scheduler which activates the agents class by class: every agent of
+    one class, then every agent of the next one, and so on.
+
+    A class may define a step_batch(agents) class (or static) method; it is
+    then called once per step with the list of its agents, so that it can
+    process the whole cohort at once, instead of the step() of each of them.
+    Agents removed from the schedule during the step, before their turn, are
+    not activated.
+
+    """
+    def __init__(self, model, shuffle=False):
+        """ Create an empty class-staged schedule.
+
+        Args:
+            model: Model object associated with the schedule.
+            shuffle: If True, shuffle the order of the classes, and of the
+                     agents within each class, every step. Otherwise classes
+                     come in the order their first agent was added.
+
+        """
+        super().__init__(model)
+        self.shuffle = shuffle
+
+    def step(self):
+        """ Executes the step of all agents, class by class. """
+        cohorts = OrderedDict()
+        for agent in self.agent_buffer(shuffled=self.shuffle):
+            cohorts.setdefault(type(agent), []).append(agent)
+        classes = list(cohorts)
+        if self.shuffle:
+            self.model.random.shuffle(classes)
+        for agent_class in classes:
+            agents = cohorts[agent_class]
+            step_batch = getattr(agent_class, "step_batch", None)
+            if step_batch is not None:
+                step_batch([agent for agent in agents
+                            if self._agents.get(agent.unique_id) is agent])
+            else:
+                for agent in agents:
+                    if self._agents.get(agent.unique_id) is agent:
+                        agent.step()
+        self.steps += 1
+        self.time += 1
+
+
 class SimultaneousActivation(BaseScheduler):
     """ A scheduler to simulate the simultaneous activation of all the agents.
 
@@ -0,0 +1,98 @@
+'''
+Test continuing a battle in parallel branches.
+'''
+import multiprocessing
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import battle_branch
+import battle_log
+import battle_model
+
+
+def make_battle(**kwargs):
+    return battle_model.BattleModel(3, 5, 2, 3, 5, 2, 70, 70, verbosity=battle_log.OFF, seed=9, **kwargs)
+
+
+def reseed(model, i):
+    model.reset_randomizer(100 + i)
+
+
+def outcome(model):
+    '''
+    Summary of a branch, with the hp of every agent, by unique_id.
+    '''
+    agents = sorted(model.space.get_agents_by_index(range(len(model.space._agent_to_index))),
+                    key=lambda agent: agent.unique_id)
+    return dict(battle_branch.battle_summary(model), hp=[agent.hp for agent in agents])
+
+
+def continued(options, steps, max_steps, mutate_fn=None, i=0):
+    '''
+    What branch i of a battle of the given options, branched after steps, ends with.
+    '''
+    model = make_battle(**options)
+    for _ in range(steps):
+        model.step()
+    if mutate_fn is not None:
+        mutate_fn(model, i)
+    while model.running and model.schedule.steps < max_steps:
+        model.step()
+    return outcome(model)
+
+
+class TestBranch(unittest.TestCase):
+    '''
+    Testing that every branch goes on as the battle would have, after its
+    mutation, and that the battle branched from is left as it was.
+    '''
+
+    steps = 20
+    max_steps = 50
+
+    def branch(self, options, n=3, mutate_fn=reseed):
+        model = make_battle(**options)
+        for _ in range(self.steps):
+            model.step()
+        before = outcome(model)
+        results = model.branch(n, mutate_fn, max_steps=self.max_steps, nr_processes=2, summary=outcome)
+        self.assertEqual(outcome(model), before)
+        self.assertEqual(model.schedule.steps, self.steps)
+        return model, results
+
+    def test_variants(self):
+        options = {}
+        model, results = self.branch(options)
+        self.assertEqual(results, [continued(options, self.steps, self.max_steps, reseed, i) for i in range(3)])
+        self.assertEqual(len({str(result) for result in results}), 3)
+        # the battle itself goes on
+        model.step()
+        self.assertEqual(model.schedule.steps, self.steps + 1)
+
+    def test_unchanged(self):
+        options = {'simultaneous_combat': True}
+        _, results = self.branch(options, 2, None)
+        self.assertEqual(results, [continued(options, self.steps, self.max_steps)] * 2)
+
+    def test_shared_state(self):
+        options = {'use_battle_state': True, 'shared_state': True}
+        model, results = self.branch(options)
+        self.assertEqual(results, [continued(options, self.steps, self.max_steps, reseed, i) for i in range(3)])
+        # the forks left the shared blocks to the battle, which goes on in them
+        with model.state_handle().attach() as state:
+            np.testing.assert_array_equal(state.hp[:state.size], model.state.hp[:model.state.size])
+        model.step()
+        model.unshare_state()
+
+    def test_without_fork(self):
+        # restoring a snapshot in every branch, where processes cannot be forked
+        options = {'use_battle_state': True}
+        with mock.patch.object(multiprocessing, 'get_all_start_methods', return_value=['spawn']):
+            _, results = self.branch(options, 2)
+        self.assertEqual(results, [continued(options, self.steps, self.max_steps, reseed, i) for i in range(2)])
+
+
+if __name__ == '__main__':
+    unittest.main()
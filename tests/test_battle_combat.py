@@ -0,0 +1,125 @@
+'''
+Test the resolution of the simultaneous combat mode.
+'''
+import unittest
+
+import battle_log
+import battle_model
+
+
+def make_battle():
+    return battle_model.BattleModel(3, 5, 2, 3, 5, 2, 70, 70, verbosity=battle_log.OFF, seed=10,
+                                    simultaneous_combat=True)
+
+
+class TestResolve(unittest.TestCase):
+    '''
+    Testing that the attacks, heals and protections recorded in a step are
+    applied all at once, whatever the order they were recorded in.
+    '''
+
+    def setUp(self):
+        self.model = make_battle()
+        self.combat = self.model.combat
+        self.red = self.model.get_army("red0", "warrior")
+        self.blue = self.model.get_army("blue0", "warrior")
+
+    def test_damage(self):
+        target = self.blue[0]
+        target.hp = 25.0
+        self.combat.attack(self.red[1], target, 10.0)
+        self.combat.attack(self.red[0], target, 10.0)
+        self.combat.resolve()
+        self.assertEqual(target.hp, 5.0)
+        self.assertEqual(target.damage_received_recently, 20.0)
+        self.assertEqual(target.type, 'blue')
+        self.assertEqual(self.combat.attacks, [])
+
+    def test_kill(self):
+        target = self.blue[0]
+        target.hp = 15.0
+        count = self.model.alive_count('blue')
+        for attacker in (self.red[2], self.red[0], self.red[1]):
+            self.combat.attack(attacker, target, 10.0)
+        self.combat.resolve()
+        self.assertEqual(target.hp, -15.0)
+        self.assertEqual(target.type, 'dead')
+        self.assertEqual(self.model.alive_count('blue'), count - 1)
+        self.assertNotIn(target, self.model.schedule.agents)
+        # attacks are applied in unique_id order: the second one kills
+        self.assertEqual([attacker.has_killed_recently for attacker in self.red[:3]], [False, True, False])
+
+    def test_mutual_kill(self):
+        # both attacks were chosen from the same state, so both land
+        red, blue = self.red[0], self.blue[0]
+        red.hp = blue.hp = 5.0
+        self.combat.attack(red, blue, 10.0)
+        self.combat.attack(blue, red, 10.0)
+        self.combat.resolve()
+        self.assertEqual((red.type, blue.type), ('dead', 'dead'))
+
+    def test_guard(self):
+        guards = self.model.get_army("blue0", "guard")
+        ally = self.blue[0]
+        guard_hp, ally_hp = guards[0].hp, ally.hp
+        # of the guards claiming the same ally, the one with the lowest unique_id protects it, from the attacks of
+        # the same step on
+        self.combat.protect(guards[1], ally)
+        self.combat.protect(guards[0], ally)
+        self.combat.attack(self.red[0], ally, 10.0)
+        self.combat.resolve()
+        self.assertIs(ally.guarder, guards[0])
+        self.assertTrue(ally.protected)
+        self.assertEqual((guards[0].guarded_ally, guards[1].guarded_ally), (ally, guards[1]))
+        self.assertEqual(ally.hp, ally_hp)
+        self.assertEqual(guards[0].hp, guard_hp - 10.0)
+        self.assertEqual(guards[1].hp, guard_hp)
+
+        # precise attacks get past the guard
+        self.combat.attack(self.red[1], ally, 3.0, precise=True)
+        self.combat.protect(guards[0], ally)
+        self.combat.resolve()
+        self.assertEqual(guards[0].hp, guard_hp - 10.0)
+        self.assertEqual(ally.hp, ally_hp - 3.0)
+
+        # a protection ends in the next step, unless claimed again
+        self.combat.attack(self.red[0], ally, 10.0)
+        self.combat.resolve()
+        self.assertFalse(ally.protected)
+        self.assertFalse(guards[0].guarding)
+        self.assertEqual(ally.hp, ally_hp - 13.0)
+
+    def test_heal(self):
+        healer = self.model.get_army("blue0", "healer")[0]
+        hurt, nearly = self.blue[0], self.blue[1]
+        hurt.hp = hurt.initial_hp - 30.0
+        nearly.hp = nearly.initial_hp - 5.0
+        self.combat.heal(healer, hurt, 10.0)
+        self.combat.heal(healer, nearly, 10.0)
+        self.combat.heal(healer, hurt, 10.0)
+        self.combat.resolve()
+        self.assertEqual(hurt.hp, hurt.initial_hp - 10.0)
+        self.assertEqual(nearly.hp, nearly.initial_hp)
+
+    def test_order(self):
+        # the same records, in another order, in an identical battle
+        other = make_battle()
+        for model, reverse in ((self.model, False), (other, True)):
+            red = model.get_army("red0", "warrior")
+            blue = model.get_army("blue0", "warrior")
+            guard = model.get_army("blue0", "guard")[0]
+            blue[0].hp = 12.0
+            records = [(model.combat.attack, red[k], blue[k % 2], 5.0 + k) for k in range(4)]
+            records += [(model.combat.heal, blue[2], blue[1], 4.0), (model.combat.protect, guard, blue[1])]
+            records.append((model.combat.attack, blue[3], red[0], 7.0))
+            for record in (reversed(records) if reverse else records):
+                record[0](*record[1:])
+            model.combat.resolve()
+        outcome = [[(agent.unique_id, agent.type, agent.hp, agent.has_killed_recently, agent.protected)
+                    for agent in model.space.get_agents_by_index(range(len(model.space._agent_to_index)))]
+                   for model in (self.model, other)]
+        self.assertEqual(outcome[0], outcome[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+'''
+Test that the domain-decomposed runner steps a battle as one model does.
+'''
+import unittest
+
+import numpy as np
+
+import battle_log
+import battle_model
+
+
+def make_battle():
+    return battle_model.BattleModel(3, 5, 2, 3, 5, 2, 70, 70, verbosity=battle_log.OFF, seed=7,
+                                    simultaneous_combat=True)
+
+
+def battle_state(model):
+    '''
+    hp, morale, type and position of every agent of the battle, by unique_id.
+    '''
+    space = model.space
+    agents = sorted(space.get_agents_by_index(range(len(space._agent_to_index))),
+                    key=lambda agent: agent.unique_id)
+    return ([(agent.unique_id, agent.type, agent.hp, agent.morale) for agent in agents],
+            np.array([agent.pos for agent in agents], dtype=float))
+
+
+class TestDomainRunner(unittest.TestCase):
+    '''
+    Testing the DomainRunner against the single-process simultaneous combat.
+    '''
+
+    # long enough for agents to die and to cross strips
+    steps = 80
+
+    @classmethod
+    def setUpClass(cls):
+        model = make_battle()
+        cls.alive = []
+        for _ in range(cls.steps):
+            model.step()
+            cls.alive.append(dict(model.alive_sides))
+        cls.expected = battle_state(model)
+        model.step()
+        cls.expected_next = battle_state(model)
+
+    def check(self, nr_domains):
+        model = make_battle()
+        with model.decompose(nr_domains) as runner:
+            for alive in self.alive:
+                runner.step()
+                self.assertEqual(dict(model.alive_sides), alive)
+        agents, positions = battle_state(model)
+        self.assertEqual(agents, self.expected[0])
+        np.testing.assert_allclose(positions, self.expected[1], rtol=0, atol=1e-9)
+        # the model goes on from where the workers left it
+        model.step()
+        agents, positions = battle_state(model)
+        self.assertEqual(agents, self.expected_next[0])
+        np.testing.assert_allclose(positions, self.expected_next[1], rtol=0, atol=1e-9)
+
+    def test_two_strips(self):
+        self.check(2)
+
+    def test_three_strips(self):
+        self.check(3)
+
+    def test_five_strips(self):
+        self.check(5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,231 @@
+'''
+Test the battle log: the background writer, the event files and the text
+of the agents rebuilt from them.
+'''
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import battle_log
+import battle_model
+
+
+class MockSchedule:
+    def __init__(self):
+        self.steps = 0
+
+
+class MockModel:
+    def __init__(self):
+        self.schedule = MockSchedule()
+
+
+class MockAgent:
+    def __init__(self, unique_id, army):
+        self.unique_id = unique_id
+        self.name = "warrior" + str(unique_id)
+        self.army = army
+
+
+class TestBattleLog(unittest.TestCase):
+    '''
+    Testing that the events emitted into a BattleLog end up in its files, in
+    order, whatever the batches the writer gets them in.
+    '''
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        self.model = MockModel()
+        self.agents = [MockAgent(unique_id, "red" + str(unique_id % 3)) for unique_id in range(1, 31)]
+
+    def fight(self, log, steps=20):
+        '''
+        Emit a few events of every agent at every step; returns the expected
+        (step, actor, target) of all of them.
+        '''
+        for agent in self.agents:
+            log.register(agent)
+        expected = [(0, agent.unique_id, 0) for agent in self.agents]
+        for step in range(1, steps + 1):
+            self.model.schedule.steps = step
+            for k, agent in enumerate(self.agents):
+                target = self.agents[(k + step) % len(self.agents)]
+                log.emit(battle_log.TURN, agent, amount=step)
+                log.emit(battle_log.ATTACK, agent, target, amount=10)
+                expected += [(step, agent.unique_id, 0), (step, agent.unique_id, target.unique_id)]
+        return expected
+
+    def test_one_file(self):
+        log = battle_log.BattleLog(self.model, self.directory, batch_size=64, max_batches=2)
+        expected = self.fight(log)
+        log.close()
+        self.assertEqual(os.listdir(self.directory).count("battle.events"), 1)
+        roster, events = battle_log.read_events(self.directory, "battle")
+        self.assertEqual(roster, {agent.unique_id: (agent.name, agent.army) for agent in self.agents})
+        self.assertEqual(list(zip(events['step'].tolist(), events['actor'].tolist(), events['target'].tolist())),
+                         expected)
+
+    def test_per_army(self):
+        log = battle_log.BattleLog(self.model, self.directory, per_army=True, batch_size=50)
+        expected = self.fight(log)
+        log.close()
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         ["battle-red0.events", "battle-red1.events", "battle-red2.events", "battle.roster"])
+        red1 = np.fromfile(os.path.join(self.directory, "battle-red1.events"), dtype=battle_log.EVENT_DTYPE)
+        self.assertTrue((red1['actor'] % 3 == 1).all())
+        roster, events = battle_log.read_events(self.directory, "battle")
+        # ordered by step; within a step, the files of the armies follow one another
+        self.assertEqual(sorted(zip(events['step'].tolist(), events['actor'].tolist(), events['target'].tolist())),
+                         sorted(expected))
+        self.assertTrue((np.diff(events['step']) >= 0).all())
+
+    def test_agent_text(self):
+        log = battle_log.BattleLog(self.model, self.directory)
+        first, second = self.agents[:2]
+        log.register(first)
+        log.register(second)
+        self.model.schedule.steps = 1
+        log.emit(battle_log.TURN, first, amount=1)
+        log.emit(battle_log.ATTACK, first, second, amount=10)
+        log.emit(battle_log.KILL, first)
+        log.emit(battle_log.DAMAGED, second, first, amount=10, value=-2.5)
+        log.emit(battle_log.DIE, second)
+        log.close()
+        self.assertEqual(log.agent_text(first.name),
+                         "Powstałem, jestem warrior1\n\n\nRuch 1:\nHaha! Zadałem wrogowi warrior2 10 punktów "
+                         "obrażeń.\nZabiłem go! Hurra!\n")
+        self.assertEqual(log.agent_text(second.name),
+                         "Powstałem, jestem warrior2\n\nAła! Otrzymałem 10 punktów obrażeń od warrior1. Teraz mam "
+                         "-2.5 punktów zdrowia.\nZginąłem, to koniec")
+        out = os.path.join(self.directory, "txt")
+        os.mkdir(out)
+        log.write_agent_files(out)
+        with open(os.path.join(out, "warrior2.txt"), encoding="utf-8") as f:
+            self.assertEqual(f.read(), log.agent_text(second.name))
+
+    def test_writer_error(self):
+        # the writer fails to open the events file of an army that comes up after the directory is gone
+        log = battle_log.BattleLog(self.model, self.directory, per_army=True, batch_size=8)
+        shutil.rmtree(self.directory)
+        try:
+            self.fight(log)
+        except OSError:
+            # raised by the first flush after the writer failed
+            pass
+        with self.assertRaises(OSError):
+            log.close()
+        # nothing is left blocked
+        self.assertFalse(log._writer.is_alive())
+
+    def test_null_log(self):
+        log = battle_log.NullLog()
+        self.fight(log)
+        log.close()
+        self.assertEqual(log.agent_text(self.agents[0].name), "")
+
+
+class TestEventRecords(unittest.TestCase):
+    '''
+    Testing the binary records of the events and the text rendered from them.
+    '''
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        self.model = MockModel()
+        self.roster = {1: ("redwarrior1", "red0"), 2: ("bluewarrior2", "blue0")}
+
+    def test_records(self):
+        log = battle_log.BattleLog(self.model, self.directory)
+        first, second = MockAgent(1, "red0"), MockAgent(2, "blue0")
+        self.model.schedule.steps = 7
+        log.emit(battle_log.ATTACK_GUARDED, first, second, first, amount=10)
+        log.emit(battle_log.DAMAGED, second, first, amount=2.5, value=97.5)
+        log.close()
+        path = os.path.join(self.directory, "battle.events")
+        self.assertEqual(os.path.getsize(path), 2 * battle_log.EVENT_DTYPE.itemsize)
+        events = np.fromfile(path, dtype=battle_log.EVENT_DTYPE)
+        self.assertEqual(events.tolist(), [(7, battle_log.ATTACK_GUARDED, battle_log.AMOUNT_INT | battle_log.VALUE_INT,
+                                            1, 2, 1, 10.0, 0.0),
+                                           (7, battle_log.DAMAGED, 0, 2, 1, 0, 2.5, 97.5)])
+
+    def test_render(self):
+        self.assertEqual(battle_log.render(battle_log.HEAL, self.roster, 1, 2, 0, 5, 55.0, battle_log.AMOUNT_INT),
+                         "Leczę bluewarrior2 o 5. Teraz ma 55.0\n")
+        self.assertEqual(battle_log.render(battle_log.HEAL, self.roster, 1, 2, 0, 5.0, 55.0),
+                         "Leczę bluewarrior2 o 5.0. Teraz ma 55.0\n")
+        self.assertEqual(battle_log.render(battle_log.MOVE, self.roster, 1, 0, 0, 15.5, 30.25),
+                         "Idę na" + str(np.array((15.5, 30.25))) + "\n")
+        self.assertEqual(battle_log.render(battle_log.ARMY, self.roster, 1, 0, 0, 0, 0), "Moja armia: red0\n\n")
+
+    def test_read_agent_texts(self):
+        log = battle_log.BattleLog(self.model, self.directory)
+        agent = MockAgent(2, "blue0")
+        # e.g. restored from a snapshot
+        log.register(agent, spawned=False)
+        log.emit(battle_log.TURN, agent, amount=1)
+        log.emit(battle_log.FLEE, agent)
+        log.close()
+        self.assertEqual(battle_log.read_agent_texts(self.directory, "battle"),
+                         {"warrior2": "\nRuch 1:\nMuszę się ratować!\n"})
+
+
+class TestVerbosity(unittest.TestCase):
+    '''
+    Testing what battles print and log at every verbosity, in a directory of
+    their own (the model logs into logi/ of the working directory).
+    '''
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        os.mkdir(os.path.join(directory, "logi"))
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(directory)
+
+    def run_battle(self, verbosity, steps=5):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            model = battle_model.BattleModel(2, 5, 1, 2, 5, 1, 40, 40, verbosity=verbosity, seed=1)
+            for _ in range(steps):
+                model.step()
+        model.log.close()
+        return model, out.getvalue()
+
+    def test_off(self):
+        model, out = self.run_battle(battle_log.OFF)
+        self.assertEqual(out, "")
+        self.assertIsInstance(model.log, battle_log.NullLog)
+        self.assertEqual(os.listdir("logi"), [])
+
+    def test_summary(self):
+        model, out = self.run_battle(battle_log.SUMMARY)
+        self.assertEqual(out, "Zywych agentow: 20\n\n" * 5)
+        self.assertIsInstance(model.log, battle_log.NullLog)
+        self.assertEqual(os.listdir("logi"), [])
+
+    def test_per_event(self):
+        model, out = self.run_battle(battle_log.PER_EVENT)
+        self.assertEqual(out, "Zywych agentow: 20\n\n" * 5)
+        self.assertEqual(sorted(os.listdir("logi")), ["battle.events", "battle.roster"])
+        agent = next(iter(model.schedule.agent_buffer(False)))
+        text = model.log.agent_text(agent.name)
+        self.assertTrue(text.startswith("Powstałem, jestem " + agent.name))
+        self.assertEqual(text.count("\nRuch "), 5)
+
+    def test_same_battle(self):
+        # logging does not change the battle
+        quiet, _ = self.run_battle(battle_log.OFF, 30)
+        logged, _ = self.run_battle(battle_log.PER_EVENT, 30)
+        self.assertEqual([(agent.unique_id, agent.hp, tuple(agent.pos)) for agent in logged.schedule.agents],
+                         [(agent.unique_id, agent.hp, tuple(agent.pos)) for agent in quiet.schedule.agents])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,222 @@
+'''
+Test setting up and keeping track of the armies of a BattleModel.
+'''
+import math
+import random
+import unittest
+
+import numpy as np
+
+import battle_log
+import battle_model
+import warrior_agent
+
+
+MODES = ({}, {'vectorized_movement': True}, {'simultaneous_combat': True}, {'staged_by_class': True},
+         {'use_battle_state': True}, {'cell_size': 5, 'verlet_skin': True})
+
+
+def make_battle(**kwargs):
+    kwargs.setdefault('seed', 6)
+    return battle_model.BattleModel(3, 5, 2, 3, 10, 1, 70, 70, verbosity=battle_log.OFF, **kwargs)
+
+
+def battle_outcome(model):
+    '''
+    Type, hp, morale, velocity and position of every agent, by unique_id.
+    '''
+    agents = sorted(model.space.get_agents_by_index(range(len(model.space._agent_to_index))),
+                    key=lambda agent: agent.unique_id)
+    return [(agent.unique_id, agent.type, agent.hp, agent.morale, tuple(agent.velocity), tuple(agent.pos))
+            for agent in agents]
+
+
+def run(model, steps):
+    for _ in range(steps):
+        if not model.step():
+            break
+    return battle_outcome(model)
+
+
+class TestArmies(unittest.TestCase):
+    '''
+    Testing the army registry filled while spawning.
+    '''
+
+    def setUp(self):
+        self.model = make_battle()
+        self.agents = list(self.model.schedule.agent_buffer(False))
+
+    def test_members(self):
+        armies = {}
+        for agent in self.agents:
+            armies.setdefault(agent.army, []).append(agent)
+        self.assertEqual(sorted(armies), ["blue0", "red0", "red1"])
+        for army, members in armies.items():
+            self.assertEqual(self.model.get_army(army), members)
+            for subtype in ("warrior", "guard", "general", "healer", "marksman", "flagger"):
+                self.assertEqual(self.model.get_army(army, subtype),
+                                 [agent for agent in members if agent.subtype == subtype])
+        self.assertEqual(self.model.get_army("red2"), [])
+        self.assertEqual(self.model.get_army("red0", "archer"), [])
+
+    def test_soldiers(self):
+        # every general and flagger commands everyone else of its army, once, in spawn order
+        commanders = [agent for agent in self.agents if agent.subtype in ("general", "flagger")]
+        # one general and one flagger per 5 rows of an army
+        self.assertEqual(len(commanders), 2 + 2 + 4)
+        for commander in commanders:
+            self.assertEqual(commander.soldiers, [agent for agent in self.agents
+                                                  if agent.army == commander.army
+                                                  and agent.subtype != commander.subtype])
+
+    def test_dead_members(self):
+        # the dead stay in their army
+        agent = self.model.get_army("red1")[0]
+        agent.die()
+        self.assertIn(agent, self.model.get_army("red1"))
+
+
+def formation(first_x, first_y, separation_x, separation_y, cols, rows, squad, type):
+    '''
+    Position, subtype and army of every soldier of a formation, in spawn
+    order, as the spawner used to lay them out one by one.
+    '''
+    soldiers = []
+    for i in range(cols):
+        for j in range(rows * squad):
+            x = first_x + (separation_x * i)
+            y = first_y + (separation_y * j) + (4 * separation_y) * math.floor(j / rows)
+            subtype = "warrior"
+            if i == 0 and j % 5 in (1, 3):
+                subtype = "guard"
+            if i == 1 and j % 5 == 2:
+                subtype = "general"
+            if i == 2:
+                subtype = {0: "marksman", 1: "healer", 2: "flagger", 3: "healer", 4: "marksman"}[j % 5]
+            soldiers.append(((x, y), subtype, type + str(math.floor(j / rows))))
+    return soldiers
+
+
+class TestSpawn(unittest.TestCase):
+    '''
+    Testing that the formations spawned at once are laid out, registered and
+    placed as they were agent by agent.
+    '''
+
+    def test_formations(self):
+        for options in ({}, {'use_battle_state': True}, {'cell_size': 5}, {'simultaneous_combat': True}):
+            model = make_battle(**options)
+            red_y = ((70 / 2 - (2 * 5 / 2 * 1.5)) + 1.5 / 2) - ((2 - 1) * 1.5 * 2)
+            blue_y = ((70 / 2 - (1 * 10 / 2 * 1.5)) + 1.5 / 2) - ((1 - 1) * 1.5 * 2)
+            expected = (formation(15.0, red_y, 1.5, 1.5, 3, 5, 2, 'red') +
+                        formation(70 - 15.0, blue_y, -1.5, 1.5, 3, 10, 1, 'blue'))
+            agents = list(model.schedule.agent_buffer(False))
+            self.assertEqual([agent.unique_id for agent in agents], list(range(1, len(expected) + 1)))
+            self.assertEqual([(tuple(agent.pos), agent.subtype, agent.army) for agent in agents], expected)
+            self.assertEqual(model.next_agent_id, len(expected) + 1)
+            self.assertEqual(model.schedule.get_agent_count(), len(expected))
+            np.testing.assert_array_equal(model.space._agent_points, [position for position, _, _ in expected])
+            self.assertEqual(model.space.get_agents_by_index(range(len(agents))), agents)
+            for agent in agents:
+                self.assertIsInstance(agent, model.agent_class(agent.type, agent.subtype))
+                self.assertIsInstance(agent, warrior_agent.RedWarrior if agent.type == 'red'
+                                      else warrior_agent.BlueWarrior)
+
+    def test_spawn(self):
+        model = make_battle()
+        count = model.schedule.get_agent_count()
+        agent = model.spawn(35.0, 36.5, 'blue', 'healer', 'blue1')
+        self.assertIsInstance(agent, warrior_agent.BlueHealer)
+        self.assertEqual(agent.unique_id, count + 1)
+        self.assertEqual(tuple(agent.pos), (35.0, 36.5))
+        self.assertEqual(model.get_army('blue1'), [agent])
+        self.assertIn(agent, model.space.get_neighbors((35.0, 36.5), 0.1))
+        self.assertEqual(model.schedule.get_agent_count(), count + 1)
+
+
+class TestAliveCount(unittest.TestCase):
+    '''
+    Testing the counts of living agents against counting the schedule.
+    '''
+
+    def check_counts(self, model):
+        living = [agent for agent in model.schedule.agent_buffer(False) if agent.type != 'dead']
+        for side in ('red', 'blue'):
+            self.assertEqual(model.alive_count(side), sum(agent.type == side for agent in living))
+            for subtype in ("warrior", "guard", "general", "healer", "marksman", "flagger"):
+                self.assertEqual(model.alive_count(side, subtype),
+                                 sum(agent.type == side and agent.subtype == subtype for agent in living))
+
+    def test_spawn(self):
+        model = make_battle()
+        self.assertEqual((model.alive_count('red'), model.alive_count('blue')), (30, 30))
+        self.assertEqual(model.alive_count('red', 'general'), 2)
+        self.check_counts(model)
+
+    def test_die(self):
+        model = make_battle()
+        # one of every class, each with its own die()
+        for subtype in ("warrior", "guard", "general", "healer", "marksman", "flagger"):
+            agent = model.get_army("blue0", subtype)[0]
+            agent.die()
+            self.assertEqual(agent.type, 'dead')
+            self.assertEqual(model.alive_count('blue', subtype), len(model.get_army("blue0", subtype)) - 1)
+            self.check_counts(model)
+        self.assertEqual(model.alive_count('blue'), 30 - 6)
+        model.get_army("red0", "warrior")[0].flee()
+        self.assertEqual(model.alive_count('red'), 30 - 1)
+        self.check_counts(model)
+
+    def test_battle(self):
+        for options in ({}, {'simultaneous_combat': True}, {'staged_by_class': True}):
+            model = make_battle(**options)
+            for _ in range(80):
+                if not model.step():
+                    break
+                self.check_counts(model)
+            self.assertLess(model.alive_count('red') + model.alive_count('blue'), 60)
+
+    def test_end_condition(self):
+        model = make_battle(end_condition=lambda model: model.alive_count('red', 'general') < 2)
+        self.assertTrue(model.step())
+        model.get_army("red1", "general")[0].die()
+        self.assertFalse(model.step())
+        self.assertFalse(model.running)
+
+        model = make_battle()
+        for agent in model.get_army("blue0"):
+            agent.die()
+        self.assertTrue(battle_model.one_side_left(model))
+        self.assertFalse(model.step())
+
+
+class TestSeed(unittest.TestCase):
+    '''
+    Testing that the seed alone determines a battle, in every mode.
+    '''
+
+    def test_same_seed(self):
+        for options in MODES:
+            random.seed(1)
+            first = run(make_battle(**options), 40)
+            # the global random module plays no part
+            random.seed(2)
+            second = run(make_battle(**options), 40)
+            self.assertEqual(first, second, options)
+
+    def test_other_seed(self):
+        for options in MODES:
+            self.assertNotEqual(run(make_battle(**options), 40), run(make_battle(seed=7, **options), 40), options)
+
+    def test_reset_randomizer(self):
+        for options in MODES:
+            model = make_battle(seed=None, **options)
+            model.reset_randomizer(11)
+            other = make_battle(seed=5, **options)
+            other.reset_randomizer(11)
+            self.assertEqual(run(model, 40), run(other, 40), options)
+
+
+if __name__ == '__main__':
+    unittest.main()
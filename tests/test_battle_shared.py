@@ -0,0 +1,74 @@
+'''
+Test attaching to the shared battle state from other processes.
+'''
+import multiprocessing
+import os
+import pickle
+import subprocess
+import sys
+import unittest
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import battle_log
+import battle_model
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# reads the handle from stdin, attaches, doubles every hp and exits, after its resource tracker is done cleaning up
+ATTACH = '''
+import os, pickle, sys
+from multiprocessing import resource_tracker
+handle = pickle.load(sys.stdin.buffer)
+with handle.attach() as state:
+    state.hp[:state.size] *= 2
+tracker = resource_tracker._resource_tracker
+if tracker._pid is not None:
+    os.close(tracker._fd)
+    os.waitpid(tracker._pid, 0)
+'''
+
+
+def double_hp(handle):
+    with handle.attach() as state:
+        state.hp[:state.size] *= 2
+
+
+class TestAttach(unittest.TestCase):
+    '''
+    Testing that processes attaching to the shared state write to the battle
+    and leave its blocks alone when they exit.
+    '''
+
+    def setUp(self):
+        self.model = battle_model.BattleModel(3, 5, 2, 3, 5, 2, 70, 70, verbosity=battle_log.OFF, seed=3,
+                                              use_battle_state=True, shared_state=True)
+        self.handle = self.model.state_handle()
+        self.hp = self.model.state.hp[:self.model.state.size].copy()
+
+    def tearDown(self):
+        self.model.unshare_state()
+
+    def check(self):
+        np.testing.assert_array_equal(self.model.state.hp[:self.model.state.size], 2 * self.hp)
+        for name, _, _ in list(self.handle.columns.values()) + [self.handle.points]:
+            shared_memory.SharedMemory(name).close()
+
+    def test_unrelated_process(self):
+        # a new interpreter, with a resource tracker of its own
+        subprocess.run([sys.executable, '-c', ATTACH], input=pickle.dumps(self.handle), cwd=ROOT, check=True,
+                       env=dict(os.environ, PYTHONPATH=ROOT))
+        self.check()
+
+    def test_spawned_process(self):
+        # started by multiprocessing, sharing the resource tracker of this process
+        process = multiprocessing.get_context('spawn').Process(target=double_hp, args=(self.handle,))
+        process.start()
+        process.join()
+        self.assertEqual(process.exitcode, 0)
+        self.check()
+
+
+if __name__ == '__main__':
+    unittest.main()
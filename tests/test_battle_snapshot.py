@@ -0,0 +1,86 @@
+'''
+Test saving a running battle and continuing it from the snapshot.
+'''
+import os
+import shutil
+import tempfile
+import unittest
+
+import battle_log
+import battle_model
+
+MODES = ({}, {'vectorized_movement': True}, {'simultaneous_combat': True}, {'staged_by_class': True},
+         {'use_battle_state': True}, {'use_battle_state': True, 'shared_state': True},
+         {'cell_size': 5, 'verlet_skin': True})
+
+
+def make_battle(**kwargs):
+    return battle_model.BattleModel(3, 5, 2, 3, 5, 2, 70, 70, verbosity=battle_log.OFF, seed=8, **kwargs)
+
+
+def battle_outcome(model):
+    '''
+    Everything about every agent that the battle changes, by unique_id, and the schedule.
+    '''
+    agents = sorted(model.space.get_agents_by_index(range(len(model.space._agent_to_index))),
+                    key=lambda agent: agent.unique_id)
+    return ([(agent.unique_id, agent.type, agent.hp, agent.morale, tuple(agent.velocity), tuple(agent.pos),
+              agent.guarder.unique_id, [soldier.unique_id for soldier in getattr(agent, 'soldiers', [])])
+             for agent in agents],
+            model.schedule.steps, [agent.unique_id for agent in model.schedule.agent_buffer(False)],
+            model.alive_count('red'), model.alive_count('blue'))
+
+
+class TestSnapshot(unittest.TestCase):
+    '''
+    Testing that a battle restored from a snapshot goes on exactly as the
+    battle it was taken of.
+    '''
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+
+    def test_continue(self):
+        for k, options in enumerate(MODES):
+            for mmap_mode in (None, 'c'):
+                # a snapshot of its own, not overwriting the files mapped by the last restored model
+                path = os.path.join(self.directory, "%d-%s" % (k, mmap_mode))
+                model = make_battle(**options)
+                for _ in range(30):
+                    model.step()
+                model.snapshot(path)
+                restored = battle_model.BattleModel.restore(path, mmap_mode=mmap_mode)
+                self.assertEqual(battle_outcome(restored), battle_outcome(model), options)
+                for _ in range(40):
+                    model.step()
+                    restored.step()
+                self.assertEqual(battle_outcome(restored), battle_outcome(model), (options, mmap_mode))
+                self.assertIsNone(restored.shared)
+                if model.shared is not None:
+                    model.unshare_state()
+
+    def test_restored_twice(self):
+        # every restored model is a battle of its own
+        model = make_battle(use_battle_state=True)
+        for _ in range(30):
+            model.step()
+        model.snapshot(self.directory)
+        first = battle_model.BattleModel.restore(self.directory, mmap_mode='c')
+        second = battle_model.BattleModel.restore(self.directory, mmap_mode='c')
+        for _ in range(20):
+            first.step()
+        self.assertEqual(battle_outcome(second)[1], 30)
+        for _ in range(20):
+            second.step()
+        self.assertEqual(battle_outcome(second), battle_outcome(first))
+
+    def test_read_only(self):
+        model = make_battle(use_battle_state=True)
+        model.snapshot(self.directory)
+        with self.assertRaises(ValueError):
+            battle_model.BattleModel.restore(self.directory, mmap_mode='r')
+
+
+if __name__ == '__main__':
+    unittest.main()
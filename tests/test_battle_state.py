@@ -0,0 +1,110 @@
+'''
+Test the BattleState columns and the battles kept in them.
+'''
+import unittest
+
+import numpy as np
+
+import battle_log
+import battle_model
+import battle_state
+import boids
+
+
+def make_battle(**kwargs):
+    return battle_model.BattleModel(3, 5, 2, 3, 5, 2, 70, 70, verbosity=battle_log.OFF, seed=5, **kwargs)
+
+
+def battle_outcome(model):
+    '''
+    Type, hp, morale, velocity and position of every agent, by unique_id.
+    '''
+    agents = sorted(model.space.get_agents_by_index(range(len(model.space._agent_to_index))),
+                    key=lambda agent: agent.unique_id)
+    return [(agent.unique_id, agent.type, agent.hp, agent.morale, tuple(agent.velocity), tuple(agent.pos))
+            for agent in agents]
+
+
+class TestBattleState(unittest.TestCase):
+    '''
+    Testing the columns of a BattleState and the agents viewing them.
+    '''
+
+    def setUp(self):
+        self.model = make_battle(use_battle_state=True)
+        self.state = self.model.state
+        self.agents = list(self.model.schedule.agent_buffer(False))
+
+    def test_views(self):
+        self.assertEqual(self.state.size, len(self.agents))
+        agent = self.agents[7]
+        agent.hp = 42.0
+        agent.velocity = (1.0, -1.0)
+        self.assertEqual(self.state.hp[agent.slot], 42.0)
+        np.testing.assert_array_equal(self.state.velocity[agent.slot], (1.0, -1.0))
+        self.state.morale[agent.slot] = 3.5
+        self.assertEqual(agent.morale, 3.5)
+        np.testing.assert_array_equal(agent.pos, self.model.space._agent_points[
+            self.model.space._agent_to_index[agent]])
+
+    def test_masks(self):
+        self.agents[0].die()
+        alive = self.state.alive()
+        self.assertEqual(alive.sum(), len(self.agents) - 1)
+        self.assertFalse(alive[self.agents[0].slot])
+        red = self.state.of_type('red')
+        self.assertEqual(red.sum(), self.model.alive_count('red'))
+        np.testing.assert_array_equal(battle_state.slots_of(self.agents),
+                                      [agent.slot for agent in self.agents])
+
+    def test_grow(self):
+        state = battle_state.BattleState(2)
+        slots = [state.add() for _ in range(5)]
+        self.assertEqual(slots, list(range(5)))
+        self.assertGreaterEqual(state.hp.shape[0], 5)
+        self.assertTrue(np.isnan(state.position[:5]).all())
+
+
+class TestStateBackedBattle(unittest.TestCase):
+    '''
+    Testing that a battle kept in a BattleState goes exactly as one kept in
+    the agents, and that the whole-army passes reading its columns give what
+    reading the agents gives.
+    '''
+
+    def test_same_battle(self):
+        for options in ({}, {'vectorized_movement': True}, {'simultaneous_combat': True}):
+            plain = make_battle(**options)
+            columnar = make_battle(use_battle_state=True, **options)
+            for _ in range(70):
+                plain.step()
+                columnar.step()
+            self.assertEqual(battle_outcome(columnar), battle_outcome(plain))
+
+    def test_velocity_vectors_from_columns(self):
+        model = make_battle(use_battle_state=True, vectorized_movement=True)
+        for _ in range(40):
+            model.step()
+        agents = list(model.schedule.agent_buffer(False))
+        graph = model.interaction_graph()
+        np.testing.assert_array_equal(boids.velocity_vectors(model.space, agents, graph, model.state),
+                                      boids.velocity_vectors(model.space, agents, graph))
+
+    def test_allies_morale_from_columns(self):
+        plain = make_battle()
+        columnar = make_battle(use_battle_state=True)
+        for _ in range(40):
+            plain.step()
+            columnar.step()
+        averages = []
+        for model in (plain, columnar):
+            agents = sorted(model.schedule.agent_buffer(False), key=lambda agent: agent.unique_id)
+            for agent in agents[::3]:
+                agent.morale -= agent.unique_id % 7
+            averages.append(model.allies_morale(agents))
+            np.testing.assert_allclose(averages[-1],
+                                       [agent.get_average_morale_of_allies_in_flocking_radius() for agent in agents])
+        np.testing.assert_array_equal(averages[1], averages[0])
+
+if __name__ == '__main__':
+    unittest.main()
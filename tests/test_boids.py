@@ -0,0 +1,65 @@
+'''
+Test the vectorized boids velocity vectors against the per-agent ones.
+'''
+import unittest
+
+import numpy as np
+
+import battle_log
+import battle_model
+import boids
+
+
+def make_battle(**kwargs):
+    return battle_model.BattleModel(3, 5, 2, 3, 5, 2, 70, 70, verbosity=battle_log.OFF, seed=4, **kwargs)
+
+
+def battle_outcome(model):
+    '''
+    Type, hp, velocity and position of every agent, by unique_id.
+    '''
+    agents = sorted(model.space.get_agents_by_index(range(len(model.space._agent_to_index))),
+                    key=lambda agent: agent.unique_id)
+    return [(agent.unique_id, agent.type, agent.hp, tuple(agent.velocity), tuple(agent.pos)) for agent in agents]
+
+
+class TestVelocityVectors(unittest.TestCase):
+    '''
+    Testing that velocity_vectors gives, for every agent, exactly what its
+    calculate_velocity_vector gives when nobody has moved yet, i.e. under the
+    semantics of simultaneous_combat, where moves are made after everyone has
+    stepped.
+    '''
+
+    def check(self, model, steps):
+        for _ in range(steps):
+            agents = list(model.schedule.agent_buffer(False))
+            expected = np.array([agent.calculate_velocity_vector() for agent in agents])
+            np.testing.assert_array_equal(boids.velocity_vectors(model.space, agents, model.interaction_graph(),
+                                                                 model.state), expected)
+            np.testing.assert_array_equal(boids.velocity_vectors(model.space, agents), expected)
+            model.step()
+
+    def test_simultaneous(self):
+        for options in ({}, {'cell_size': 5}, {'use_battle_state': True}):
+            self.check(make_battle(simultaneous_combat=True, **options), 60)
+
+    def test_follows_enemies(self):
+        # healers and flaggers ignore the enemies
+        model = make_battle(simultaneous_combat=True)
+        ignoring = [agent for agent in model.schedule.agent_buffer(False) if not agent.follows_enemies]
+        self.assertTrue({'healer', 'flagger'} <= {agent.subtype for agent in ignoring})
+        self.check(model, 30)
+
+    def test_same_battle(self):
+        # in simultaneous_combat mode, computing the vectors up front is exactly what the agents do in their steps
+        per_agent = make_battle(simultaneous_combat=True)
+        vectorized = make_battle(simultaneous_combat=True, vectorized_movement=True)
+        for _ in range(80):
+            per_agent.step()
+            vectorized.step()
+        self.assertEqual(battle_outcome(vectorized), battle_outcome(per_agent))
+
+
+if __name__ == '__main__':
+    unittest.main()
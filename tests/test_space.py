@@ -0,0 +1,400 @@
+'''
+Test the ContinuousSpace and its indexes.
+'''
+import random
+import unittest
+
+import numpy as np
+
+from mesa.space import ContinuousSpace
+
+
+class MockAgent:
+    '''
+    Minimalistic agent for testing purposes.
+    '''
+    def __init__(self, unique_id, type=None):
+        self.unique_id = unique_id
+        self.type = type
+        self.pos = None
+
+
+class TestHashedGroupRemoval(unittest.TestCase):
+    '''
+    Testing the spatial hash of a space partitioned into groups, after
+    removing agents.
+    '''
+
+    def setUp(self):
+        self.space = ContinuousSpace(20, 20, False, cell_size=5, group_key="type")
+        self.red = [MockAgent(i, "red") for i in range(3)]
+        self.blue = MockAgent(3, "blue")
+        for agent in self.red:
+            self.space.place_agent(agent, (10, 10))
+        self.space.place_agent(self.blue, (11, 10))
+
+    def test_moved_agent_keeps_its_group(self):
+        '''
+        Removing an agent of one group moves the last agent, of the other
+        group, into its slot; it has to stay in the cells of its own group.
+        '''
+        self.space.remove_agent(self.red[0])
+        red = self.space.get_neighbors((10, 10), 2, group="red")
+        self.assertEqual(set(red), set(self.red[1:]))
+        not_blue = self.space.get_neighbors((10, 10), 2, exclude_group="blue")
+        self.assertEqual(set(not_blue), set(self.red[1:]))
+        self.assertEqual(self.space.get_neighbors((10, 10), 2, group="blue"), [self.blue])
+        self.assertEqual(self.space.get_group(self.blue), "blue")
+
+
+class RandomSpaces:
+    '''
+    Mixin placing, moving and removing random agents in several spaces at
+    once (one per set of space_options, toroidal or not), and scanning them
+    by brute force.
+    '''
+    space_options = [{}]
+    types = [None]
+    # (radius, group, exclude_group) of the queries to check
+    queries = [(radius, None, None) for radius in (0.5, 2, 4, 12)]
+
+    def setUp(self):
+        self.random = random.Random(1)
+        self.spaces = [ContinuousSpace(30, 20, torus, -10, 0, **options)
+                       for torus in (False, True)
+                       for options in self.space_options]
+        self.agents = []
+        for i in range(60):
+            self.place(MockAgent(i, self.random.choice(self.types)))
+
+    def random_pos(self):
+        return (self.random.uniform(-10, 30), self.random.uniform(0, 20))
+
+    def place(self, agent, pos=None):
+        pos = self.random_pos() if pos is None else pos
+        self.agents.append(agent)
+        for space in self.spaces:
+            space.place_agent(agent, pos)
+
+    def move(self, agent, pos):
+        for space in self.spaces:
+            space.move_agent(agent, pos)
+
+    def remove(self, agent):
+        self.agents.remove(agent)
+        for space in self.spaces:
+            space.remove_agent(agent)
+
+    def shake(self):
+        '''
+        Move some agents a little, some far, remove some and place new ones.
+        '''
+        for agent in self.random.sample(self.agents, 20):
+            x, y = agent.pos
+            self.move(agent, (min(max(x + self.random.uniform(-0.5, 0.5), -10), 29.9),
+                              min(max(y + self.random.uniform(-0.5, 0.5), 0), 19.9)))
+        for agent in self.random.sample(self.agents, 3):
+            self.move(agent, self.random_pos())
+        for agent in self.random.sample(self.agents, 5):
+            self.remove(agent)
+        for i in range(3):
+            self.place(MockAgent(1000 + len(self.agents) + i, self.random.choice(self.types)))
+
+    def brute_force(self, space, pos, radius, include_center=True, group=None,
+                    exclude_group=None):
+        '''
+        The agents get_neighbors should return, by a scan of all of them.
+        '''
+        result = set()
+        for agent in self.agents:
+            if group is not None and agent.type != group:
+                continue
+            if exclude_group is not None and agent.type == exclude_group:
+                continue
+            dx, dy = abs(agent.pos[0] - pos[0]), abs(agent.pos[1] - pos[1])
+            if space.torus:
+                dx, dy = min(dx, space.width - dx), min(dy, space.height - dy)
+            sq_dist = dx * dx + dy * dy
+            if sq_dist <= radius ** 2 and (include_center or sq_dist > 0):
+                result.add(agent)
+        return result
+
+    def check(self):
+        for space in self.spaces:
+            for agent in self.agents:
+                for radius, group, exclude_group in self.queries:
+                    expected = self.brute_force(space, agent.pos, radius, False,
+                                                group, exclude_group)
+                    found = space.get_neighbors(agent.pos, radius, False, group,
+                                                exclude_group)
+                    self.assertEqual(len(found), len(expected))
+                    self.assertEqual(set(found), expected)
+
+
+class TestSpatialHash(RandomSpaces, unittest.TestCase):
+    '''
+    Testing that the spatial hash gives the same neighbors as a plain scan.
+    '''
+    space_options = [{}, {'cell_size': 3}, {'cell_size': 25}]
+
+    def test_equivalence(self):
+        self.check()
+        for _ in range(4):
+            self.shake()
+            self.check()
+
+    def test_same_order(self):
+        '''
+        Queries return the agents in the same order with or without the hash.
+        '''
+        self.shake()
+        for plain, hashed in ((self.spaces[0], self.spaces[1]), (self.spaces[3], self.spaces[4])):
+            for agent in self.agents:
+                self.assertEqual(hashed.get_neighbors(agent.pos, 4, False),
+                                 plain.get_neighbors(agent.pos, 4, False))
+
+    def test_queries_between_changes(self):
+        '''
+        Query after every single change, so that queries see agents that
+        changed cell, and indices removed, since the hash was built.
+        '''
+        for i in range(150):
+            action = self.random.random()
+            if action < 0.6:
+                agent = self.random.choice(self.agents)
+                x, y = agent.pos
+                self.move(agent, (min(max(x + self.random.uniform(-4, 4), -10), 29.9),
+                                  min(max(y + self.random.uniform(-4, 4), 0), 19.9)))
+            elif action < 0.8:
+                self.remove(self.random.choice(self.agents))
+            else:
+                self.place(MockAgent(2000 + i))
+            for space in self.spaces:
+                for pos in (self.random.choice(self.agents).pos, self.random_pos()):
+                    self.assertEqual(set(space.get_neighbors(pos, 4)),
+                                     self.brute_force(space, pos, 4))
+
+    def test_query_around_edges(self):
+        for space in self.spaces:
+            for pos in ((-10, 0), (29.99, 19.99), (-10, 19.99)):
+                self.assertEqual(set(space.get_neighbors(pos, 6)),
+                                 self.brute_force(space, pos, 6))
+
+
+class TestBatchQueries(RandomSpaces, unittest.TestCase):
+    '''
+    Testing get_neighbors_batch and get_agent_neighbors_batch against
+    get_neighbors.
+    '''
+    space_options = [{}, {'cell_size': 0.5}, {'cell_size': 1}]
+
+    def check_batch(self, block_size=None):
+        for space in self.spaces:
+            if block_size is not None:
+                space._batch_block_size = block_size
+            positions = [agent.pos for agent in self.agents] + [self.random_pos()]
+            for include_center in (True, False):
+                indptr, indices, sq_dists = space.get_neighbors_batch(
+                    positions, 3, include_center, return_distances=True)
+                self.assertEqual(len(indptr), len(positions) + 1)
+                for i, pos in enumerate(positions):
+                    row = indices[indptr[i]:indptr[i + 1]]
+                    found, expected_sq_dists = space.get_neighbors_with_sq_distances(
+                        pos, 3, include_center)
+                    self.assertEqual(space.get_agents_by_index(row), found)
+                    np.testing.assert_array_equal(sq_dists[indptr[i]:indptr[i + 1]], expected_sq_dists)
+            indptr, indices = space.get_agent_neighbors_batch(self.agents[::2], 3, False)
+            for i, agent in enumerate(self.agents[::2]):
+                self.assertEqual(space.get_agents_by_index(indices[indptr[i]:indptr[i + 1]]),
+                                 space.get_neighbors(agent.pos, 3, False))
+
+    def test_batch(self):
+        self.check_batch()
+        self.shake()
+        self.check_batch()
+
+    def test_hashed_tiles(self):
+        '''
+        Spaces with small enough cells pair tiles of cells with the agents
+        around them, which has to give what the plain scan gives.
+        '''
+        for space in self.spaces[1:3] + self.spaces[4:6]:
+            positions = np.array([agent.pos for agent in self.agents] + [(np.nan, 1), (-20, 5)])
+            self.assertIsNotNone(space._hashed_batch(positions, 3, False, False))
+            space.cell_size, cell_size = None, space.cell_size
+            expected = space.get_neighbors_batch(positions, 3, False, True)
+            space.cell_size = cell_size
+            found = space.get_neighbors_batch(positions, 3, False, True)
+            for array, expected_array in zip(found, expected):
+                np.testing.assert_array_equal(array, expected_array)
+
+    def test_small_blocks(self):
+        self.check_batch(block_size=7)
+
+    def test_empty(self):
+        space = ContinuousSpace(10, 10, False)
+        indptr, indices = space.get_neighbors_batch([(1, 1), (2, 2)], 3)
+        self.assertEqual(indptr.tolist(), [0, 0, 0])
+        self.assertEqual(indices.tolist(), [])
+
+
+class TestGroups(RandomSpaces, unittest.TestCase):
+    '''
+    Testing group-restricted queries, with and without the spatial hash, as
+    agents of several groups are moved and removed.
+    '''
+    space_options = [{'group_key': "type"}, {'group_key': "type", 'cell_size': 3}]
+    types = ["red", "blue", "green"]
+    queries = [(radius, group, exclude_group)
+               for radius in (0.5, 2, 4, 12)
+               for group, exclude_group in ((None, None), ("red", None), (None, "red"),
+                                            ("blue", "red"), ("purple", None))]
+
+    def test_equivalence(self):
+        self.check()
+        for _ in range(4):
+            self.shake()
+            self.check()
+
+    def test_get_group(self):
+        self.shake()
+        for space in self.spaces:
+            for agent in self.agents:
+                self.assertEqual(space.get_group(agent), agent.type)
+
+    def test_no_groups(self):
+        space = ContinuousSpace(10, 10, False)
+        space.place_agent(MockAgent(0), (1, 1))
+        with self.assertRaises(Exception):
+            space.get_neighbors((1, 1), 2, group="red")
+
+
+class TestNeighborGraph(RandomSpaces, unittest.TestCase):
+    '''
+    Testing that thresholding a NeighborGraph gives what the space's own
+    queries give.
+    '''
+    space_options = [{'group_key': "type"}, {'group_key': "type", 'cell_size': 3},
+                     {'group_key': "type", 'cell_size': 0.5}]
+    types = ["red", "blue"]
+    queries = TestGroups.queries[:-5]
+
+    def test_thresholding(self):
+        self.shake()
+        for space in self.spaces:
+            graph = space.get_neighbor_graph(4)
+            self.assertTrue(graph.is_current())
+            for agent in self.agents:
+                for radius, group, exclude_group in self.queries:
+                    if radius > graph.radius:
+                        continue
+                    neighbors, sq_dists = graph.get_neighbors_with_sq_distances(
+                        agent, radius, group, exclude_group)
+                    expected, expected_sq_dists = space.get_neighbors_with_sq_distances(
+                        agent.pos, radius, False, group, exclude_group)
+                    self.assertEqual(neighbors, expected)
+                    np.testing.assert_array_equal(sq_dists, expected_sq_dists)
+            indptr, indices = graph.get_agent_neighbors_batch(self.agents, 2)
+            expected_indptr, expected_indices = space.get_agent_neighbors_batch(
+                self.agents, 2, False)
+            np.testing.assert_array_equal(indptr, expected_indptr)
+            np.testing.assert_array_equal(indices, expected_indices)
+
+    def test_out_of_date(self):
+        graph = self.spaces[0].get_neighbor_graph(4)
+        with self.assertRaises(Exception):
+            graph.get_neighbors_with_sq_distances(self.agents[0], 5)
+        self.move(self.agents[0], self.agents[0].pos)
+        self.assertFalse(graph.is_current())
+        with self.assertRaises(Exception):
+            graph.get_neighbors_with_sq_distances(self.agents[0], 2)
+
+
+class TestVerletLists(RandomSpaces, unittest.TestCase):
+    '''
+    Testing that agent queries answered from Verlet lists give the same
+    neighbors as a brute-force scan, as agents move by small and large steps.
+    '''
+    space_options = [{'group_key': "type", 'verlet_radius': 4, 'verlet_skin': 2},
+                     {'group_key': "type", 'verlet_radius': 4, 'verlet_skin': 2, 'cell_size': 3}]
+    types = ["red", "blue"]
+    queries = TestGroups.queries[:-5]
+
+    def check(self):
+        super().check()
+        for space in self.spaces:
+            for agent in self.agents:
+                for radius, group, exclude_group in self.queries:
+                    expected = self.brute_force(space, agent.pos, radius, False,
+                                                group, exclude_group)
+                    found = space.get_agent_neighbors(agent, radius, False,
+                                                      group, exclude_group)
+                    self.assertEqual(set(found), expected)
+
+    def test_equivalence(self):
+        self.check()
+        for _ in range(4):
+            self.shake()
+            self.check()
+
+    def test_rebuilt_after_long_moves(self):
+        space = self.spaces[0]
+        agent = self.agents[0]
+        space.get_agent_neighbors(agent, 4)
+        self.assertIsNotNone(space._verlet)
+        self.move(agent, (agent.pos[0] + 0.1, agent.pos[1]))
+        self.assertIsNotNone(space._verlet)
+        self.move(agent, (agent.pos[0] + 1.5, agent.pos[1]))
+        self.assertIsNone(space._verlet)
+        self.check()
+
+    def test_skin(self):
+        with self.assertRaises(ValueError):
+            ContinuousSpace(10, 10, False, verlet_radius=4, verlet_skin=0)
+
+
+class TestHeadingsAndDistances(unittest.TestCase):
+    '''
+    Testing that get_headings and get_distances give for many points exactly
+    what get_heading and get_distance give for every one of them.
+    '''
+
+    def setUp(self):
+        rng = np.random.default_rng(17)
+        self.points = rng.uniform((-5, 10), (25, 30), size=(200, 2))
+        self.origins = rng.uniform((-5, 10), (25, 30), size=(200, 2))
+
+    def test_one_origin(self):
+        for torus in (False, True):
+            space = ContinuousSpace(20, 20, torus, x_min=-5, y_min=10)
+            for origin in self.origins[:20]:
+                headings = space.get_headings(origin, self.points)
+                distances = space.get_distances(origin, self.points)
+                self.assertEqual(headings.shape, (200, 2))
+                self.assertEqual(distances.shape, (200,))
+                for point, heading, distance in zip(self.points, headings, distances):
+                    np.testing.assert_array_equal(heading, space.get_heading(origin, point))
+                    self.assertEqual(distance, space.get_distance(origin, point))
+
+    def test_origin_per_point(self):
+        for torus in (False, True):
+            space = ContinuousSpace(20, 20, torus, x_min=-5, y_min=10)
+            headings = space.get_headings(self.origins, self.points)
+            distances = space.get_distances(self.origins, self.points)
+            for origin, point, heading, distance in zip(self.origins, self.points, headings, distances):
+                np.testing.assert_array_equal(heading, space.get_heading(origin, point))
+                self.assertEqual(distance, space.get_distance(origin, point))
+
+    def test_torus(self):
+        space = ContinuousSpace(20, 20, True)
+        np.testing.assert_allclose(space.get_headings((1, 1), [(19, 19), (1, 5)]), [(-2, -2), (0, 4)])
+        np.testing.assert_allclose(space.get_distances((1, 1), [(19, 1), (1, 5)]), [2, 4])
+
+    def test_no_points(self):
+        space = ContinuousSpace(20, 20, False)
+        self.assertEqual(space.get_headings((1, 1), []).shape, (0, 2))
+        self.assertEqual(space.get_distances((1, 1), np.empty((0, 2))).shape, (0,))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+'''
+Test the schedulers.
+'''
+import random
+import unittest
+
+from mesa.time import BaseScheduler, RandomActivation, ClassStagedActivation
+
+
+class MockModel:
+    '''
+    Minimalistic model for testing purposes, recording the steps of agents.
+    '''
+    def __init__(self, seed=0):
+        self.random = random.Random(seed)
+        self.log = []
+
+
+class MockAgent:
+    '''
+    Minimalistic agent for testing purposes; it can remove or add agents when
+    it steps.
+    '''
+    def __init__(self, unique_id, model):
+        self.unique_id = unique_id
+        self.model = model
+        self.on_step = None
+
+    def step(self):
+        self.model.log.append(self.unique_id)
+        if self.on_step is not None:
+            self.on_step()
+
+
+class OtherAgent(MockAgent):
+    pass
+
+
+class BatchAgent(MockAgent):
+    @classmethod
+    def step_batch(cls, agents):
+        agents[0].model.log.append(tuple(agent.unique_id for agent in agents))
+
+
+class TestSchedulerTombstones(unittest.TestCase):
+    '''
+    Testing that schedulers with tombstoned slots activate agents in the same
+    order as the id -> agent dict they replace, and skip removed agents.
+    '''
+
+    def setUp(self):
+        self.model = MockModel()
+        self.agents = [MockAgent(i, self.model) for i in range(20)]
+
+    def churn(self, schedule):
+        '''
+        Remove agents, then add new ones and some of the removed ones back;
+        returns the ids in the order the dict would keep them.
+        '''
+        expected = dict((agent.unique_id, agent) for agent in self.agents)
+        for agent in self.agents[::3] + self.agents[1:6]:
+            if agent.unique_id in expected:
+                schedule.remove(agent)
+                del expected[agent.unique_id]
+        for agent in [MockAgent(i, self.model) for i in range(20, 25)] + self.agents[3:5]:
+            schedule.add(agent)
+            expected[agent.unique_id] = agent
+        return list(expected)
+
+    def test_base_order(self):
+        schedule = BaseScheduler(self.model)
+        schedule.add_agents(self.agents)
+        expected = self.churn(schedule)
+        self.assertGreater(schedule._tombstones, 0)
+        for _ in range(2):
+            self.model.log = []
+            schedule.step()
+            self.assertEqual(self.model.log, expected)
+        self.assertEqual(schedule._tombstones, 0)
+        self.assertEqual([agent.unique_id for agent in schedule.agents], expected)
+        self.assertEqual(schedule.get_agent_count(), len(expected))
+
+    def test_random_order(self):
+        '''
+        The shuffled order is the one shuffling the keys of the dict gives.
+        '''
+        schedule = RandomActivation(self.model)
+        schedule.add_agents(self.agents)
+        expected = self.churn(schedule)
+        reference = random.Random(5)
+        self.model.random = random.Random(5)
+        for _ in range(3):
+            keys = list(expected)
+            reference.shuffle(keys)
+            self.model.log = []
+            schedule.step()
+            self.assertEqual(self.model.log, keys)
+
+    def test_remove_while_stepping(self):
+        '''
+        Agents removed during a step before their turn do not step; agents
+        added during a step only step from the next one.
+        '''
+        schedule = BaseScheduler(self.model)
+        schedule.add_agents(self.agents)
+        new = MockAgent(99, self.model)
+
+        def remove_and_add():
+            for agent in self.agents[3:15]:
+                schedule.remove(agent)
+            schedule.add(new)
+            self.agents[0].on_step = None
+
+        self.agents[0].on_step = remove_and_add
+        schedule.step()
+        self.assertEqual(self.model.log, [0, 1, 2] + list(range(15, 20)))
+        self.model.log = []
+        schedule.step()
+        self.assertEqual(self.model.log, [0, 1, 2] + list(range(15, 20)) + [99])
+
+    def test_agents_is_a_new_list(self):
+        schedule = BaseScheduler(self.model)
+        schedule.add_agents(self.agents)
+        agents = schedule.agents
+        self.assertIsInstance(agents, list)
+        agents.append(MockAgent(99, self.model))
+        agents.sort(key=lambda agent: -agent.unique_id)
+        self.assertEqual(schedule.agents, self.agents)
+        schedule.remove(self.agents[0])
+        self.assertEqual(schedule.agents, self.agents[1:])
+
+
+class TestClassStagedActivation(unittest.TestCase):
+    '''
+    Testing the class-staged scheduler.
+    '''
+
+    def setUp(self):
+        self.model = MockModel()
+        self.schedule = ClassStagedActivation(self.model)
+        self.agents = [(MockAgent, OtherAgent, BatchAgent)[i % 3](i, self.model)
+                       for i in range(12)]
+        self.schedule.add_agents(self.agents)
+
+    def test_class_order(self):
+        self.schedule.step()
+        self.assertEqual(self.model.log, [0, 3, 6, 9, 1, 4, 7, 10, (2, 5, 8, 11)])
+
+    def test_removed_agents_skipped(self):
+        def remove():
+            for agent in self.agents[3:9]:
+                self.schedule.remove(agent)
+            self.agents[0].on_step = None
+
+        self.agents[0].on_step = remove
+        self.schedule.step()
+        self.assertEqual(self.model.log, [0, 9, 1, 10, (2, 11)])
+        self.model.log = []
+        self.schedule.step()
+        self.assertEqual(self.model.log, [0, 9, 1, 10, (2, 11)])
+
+    def test_shuffled_keeps_every_agent(self):
+        schedule = ClassStagedActivation(self.model, shuffle=True)
+        schedule.add_agents(self.agents)
+        schedule.remove(self.agents[4])
+        schedule.step()
+        stepped = [entry for entry in self.model.log if not isinstance(entry, tuple)]
+        batch, = [entry for entry in self.model.log if isinstance(entry, tuple)]
+        self.assertEqual(sorted(stepped + list(batch)), [i for i in range(12) if i != 4])
+
+
+if __name__ == '__main__':
+    unittest.main()
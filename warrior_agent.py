@@ -1,12 +1,65 @@
 import mesa.agent
 import functools
 import numpy as np
-import random
 
+import battle_log
 import simulation_parameters
 
 
+# wektor predkosci o dlugosci 1; gdy reguly sie znosza (wektor zerowy), agent stoi w miejscu
+# zamiast dzielic przez zero i zostawac w punkcie NaN
+def normalise(velocity_vector):
+    norm = np.linalg.norm(velocity_vector)
+    return velocity_vector / norm if norm > 0 else velocity_vector
+
+
+# pamiec wynikow wyszukiwania sasiadow przez agenta wykonujacego krok; kolejne skanowania tego samego agenta
+# w tym samym kroku, z tym samym lub mniejszym promieniem i tym samym filtrem grup, filtruja zapamietany wynik
+# zamiast pytac przestrzen; klucz (agent, krok, wersja przestrzeni) uniewaznia wyniki po kazdym place/move/remove,
+# a dopoki graf interakcji modelu jest aktualny, zapytania w jego promieniu obsluguje graf
+class NeighborCache:
+
+    def __init__(self, model):
+        self.model = model
+        self._key = None
+        # (grupa, wykluczona grupa) -> (promien, sasiedzi, kwadraty odleglosci)
+        self._results = {}
+
+    # wszyscy wojownicy w promieniu od agenta, bez niego samego
+    def get_neighbors(self, agent, radius, group=None, exclude_group=None):
+        space = self.model.space
+        key = (agent, self.model.schedule.steps, space.version)
+        if key != self._key:
+            self._key = key
+            self._results = {}
+
+        result = self._results.get((group, exclude_group))
+        if result is not None and radius <= result[0]:
+            cached_radius, neighbors, sq_distances = result
+            if radius == cached_radius:
+                return list(neighbors)
+            within = np.flatnonzero(sq_distances <= radius ** 2)
+            return [neighbors[i] for i in within]
+
+        graph = self.model.graph
+        if graph is not None and radius <= graph.radius and graph.is_current():
+            neighbors, sq_distances = graph.get_neighbors_with_sq_distances(agent, radius, group, exclude_group)
+        else:
+            neighbors, sq_distances = space.get_agent_neighbors_with_sq_distances(
+                agent, radius, False, group, exclude_group)
+        if self.model.combat is not None:
+            # w trybie simultaneous_combat sasiedzi sa w kolejnosci unique_id, zeby to, co agent z nimi zrobi,
+            # nie zalezalo od tego, gdzie trzyma ich przestrzen (patrz battle_domains)
+            order = np.argsort([neighbor.unique_id for neighbor in neighbors], kind='stable')
+            neighbors = [neighbors[i] for i in order]
+            sq_distances = sq_distances[order]
+        self._results[(group, exclude_group)] = (radius, neighbors, sq_distances)
+        return list(neighbors)
+
+
 class WarriorAgent(mesa.Agent):
+    # czy regula podazania za wrogami wchodzi do wektora predkosci (patrz boids.velocity_vectors)
+    follows_enemies = True
 
     def __init__(self, unique_id, army, model):
         super().__init__(unique_id, model)
@@ -27,6 +80,15 @@ class WarriorAgent(mesa.Agent):
         self.ENEMY_POSITION_FACTOR = simulation_parameters.ENEMY_POSITION_FACTOR
         self.guarder = self
         self.protected = False
+        # ruch zaplanowany w step, wykonywany w advance (tryb simultaneous_combat)
+        self.staged_move = None
+
+    @property
+    def random(self):
+        # w trybie simultaneous_combat kazdy agent losuje z wlasnego generatora na dany krok
+        if self.model.combat is not None:
+            return self.model.combat.random_for(self)
+        return self.model.random
 
     def step(self):
         """if self.subtype == "general" and self.counter == 1:
@@ -34,10 +96,10 @@ class WarriorAgent(mesa.Agent):
             for soldier in self.soldiers:
                 self.f.write(soldier.name + ", ")
             self.f.write("\n\n")"""  # wypisanie podkomendnych
-        self.f.write("\nRuch " + str(self.counter) + ":\n")
+        self.log(battle_log.TURN, amount=self.counter)
         enemies_in_attack_range = self.scan_for_enemies(self.attack_range)
         if enemies_in_attack_range:
-            enemy = random.choice(enemies_in_attack_range)
+            enemy = self.random.choice(enemies_in_attack_range)
             self.attack(enemy)
         else:
             self.move()
@@ -45,34 +107,39 @@ class WarriorAgent(mesa.Agent):
         self.counter += 1
 
     def die(self):
+        self.model.record_death(self)
         self.type = 'dead'
-        self.f.write("Zginąłem, to koniec")
-        self.f.close()
+        self.log(battle_log.DIE)
         self.model.schedule.remove(self)
 
+    def log(self, event, target=None, other=None, amount=0, value=0):
+        self.model.log.emit(event, self, target, other, amount, value)
+
     def attack(self, enemy):
-        if enemy.receive_damage(self.attack_damage, self.name):
+        if self.model.combat is not None:
+            self.model.combat.attack(self, enemy, self.attack_damage)
+            self.damage_inflicted_recently = self.attack_damage
+            return
+        if enemy.receive_damage(self.attack_damage, self):
             self.has_killed_recently = True
         if not enemy.protected:
-            self.f.write("Haha! Zadałem wrogowi " + enemy.name + " " + str(self.attack_damage) + " punktów obrażeń.\n")
+            self.log(battle_log.ATTACK, enemy, amount=self.attack_damage)
         else:
-            self.f.write("Wróg " + enemy.name + " był broniony! Zadałem jego obrońcy " + enemy.guarder.name + " " + str(
-                self.attack_damage) + " punktów obrażeń.\n")
-        if self.has_killed_recently: self.f.write("Zabiłem go! Hurra!\n")
+            self.log(battle_log.ATTACK_GUARDED, enemy, enemy.guarder, amount=self.attack_damage)
+        if self.has_killed_recently: self.log(battle_log.KILL)
         self.damage_inflicted_recently = self.attack_damage
 
     # returns if the damage inflicted was a killing blow
-    def receive_damage(self, damage, name):
+    def receive_damage(self, damage, attacker):
         if self.protected:
-            a = self.guarder.receive_ally_damage(damage, name)
+            a = self.guarder.receive_ally_damage(damage, attacker)
             if a:
                 return True
             else:
                 return False
         else:
             self.hp -= damage
-            self.f.write("Ała! Otrzymałem " + str(damage) + " punktów obrażeń od " + str(name) + ". Teraz mam " + str(
-                self.hp) + " punktów zdrowia.\n")
+            self.log(battle_log.DAMAGED, attacker, amount=damage, value=self.hp)
             self.damage_received_recently += damage
 
             if self.hp <= 0:
@@ -80,10 +147,9 @@ class WarriorAgent(mesa.Agent):
                 return True
             return False
 
-    def receive_precise_damage(self, damage, name):
+    def receive_precise_damage(self, damage, attacker):
         self.hp -= damage
-        self.f.write("Namierzył mnie " + str(name) + "! Zadał mi " + str(damage) + " punktów obrażeń. Teraz mam " + str(
-            self.hp) + " punktów zdrowia.\n")
+        self.log(battle_log.PRECISE_DAMAGED, attacker, amount=damage, value=self.hp)
         self.damage_received_recently += damage
         self.morale -= 0.05
 
@@ -96,12 +162,27 @@ class WarriorAgent(mesa.Agent):
     # i mnozac go przez szybkosc
     # danego typu agenta (skalarna) parametryzowana w pliku konfiguracyjnym
     def move(self):
-        velocity_vector = self.calculate_velocity_vector()
-        normalised_velocity_vector = velocity_vector / np.linalg.norm(velocity_vector)
-        self.velocity = normalised_velocity_vector * self.movement_speed
-        end_point = self.pos + self.velocity
-        self.model.space.move_agent(self, end_point)
-        self.f.write("Idę na" + str(end_point) + "\n")
+        if self in self.model.velocity_vectors:
+            velocity_vector = self.model.velocity_vectors[self]
+        else:
+            velocity_vector = self.calculate_velocity_vector()
+        normalised_velocity_vector = normalise(velocity_vector)
+        self.move_by(normalised_velocity_vector * self.movement_speed)
+
+    def move_by(self, velocity):
+        end_point = self.pos + velocity
+        if self.model.combat is not None:
+            self.staged_move = (velocity, end_point)
+        else:
+            self.velocity = velocity
+            self.model.space.move_agent(self, end_point)
+        self.log(battle_log.MOVE, amount=end_point[0], value=end_point[1])
+
+    def advance(self):
+        if self.staged_move is not None:
+            self.velocity, end_point = self.staged_move
+            self.staged_move = None
+            self.model.space.move_agent(self, end_point)
 
     def calculate_velocity_vector(self):
         visible_enemies = self.scan_for_enemies(self.ENEMY_SCANNING_RADIUS)
@@ -117,7 +198,9 @@ class WarriorAgent(mesa.Agent):
         return velocity_vector
 
     def scan_for_allies(self, radius):
-        warriors_in_flocking_radius = self.model.space.get_neighbors(self.pos, radius, False)
+        # przestrzen grupuje wojownikow po stronie, po ktorej zostali ustawieni, wiec martwych sojusznikow
+        # trzeba dalej odfiltrowac
+        warriors_in_flocking_radius = self.model.neighbor_cache.get_neighbors(self, radius, group=self.type)
         allies_in_range = []
         for warrior in warriors_in_flocking_radius:
             if warrior.type == self.type:
@@ -125,7 +208,7 @@ class WarriorAgent(mesa.Agent):
         return allies_in_range
 
     def scan_for_enemies(self, given_range):
-        warriors_in_range = self.model.space.get_neighbors(self.pos, given_range, False)
+        warriors_in_range = self.model.neighbor_cache.get_neighbors(self, given_range, exclude_group=self.type)
         enemies_in_range = []
         for warrior in warriors_in_range:
             if warrior.type != self.type and warrior.type != 'dead':
@@ -136,8 +219,9 @@ class WarriorAgent(mesa.Agent):
     def coherence_vector(self, group_in_radius):
         vector = np.zeros(2)
         if group_in_radius:
-            for warrior in group_in_radius:
-                vector += self.model.space.get_heading(self.pos, warrior.pos)
+            positions = np.array([warrior.pos for warrior in group_in_radius])
+            # suma po wierszach, dodawanych po kolei
+            vector += self.model.space.get_headings(self.pos, positions).sum(axis=0)
             vector /= len(group_in_radius)
         return vector
 
@@ -152,9 +236,10 @@ class WarriorAgent(mesa.Agent):
     # wektor przeciwny do polozen agentow w przestrzeni "osobistej" tego agenta
     def separate_vector(self, visible_allies):
         vector = np.zeros(2)
-        for ally in visible_allies:
-            if self.model.space.get_distance(self.pos, ally.pos) < self.SEPARATION_DISTANCE:
-                vector -= self.model.space.get_heading(self.pos, ally.pos)
+        if visible_allies:
+            positions = np.array([ally.pos for ally in visible_allies])
+            close = self.model.space.get_distances(self.pos, positions) < self.SEPARATION_DISTANCE
+            vector -= self.model.space.get_headings(self.pos, positions[close]).sum(axis=0)
         return vector
 
     def calculate_own_morale_modifier(self):
@@ -178,7 +263,7 @@ class WarriorAgent(mesa.Agent):
         self.adjust_attack_damage()
 
     def flee(self):
-        self.f.write("Muszę się ratować!\n")
+        self.log(battle_log.FLEE)
         self.die()
 
     def adjust_attack_damage(self):
@@ -190,7 +275,10 @@ class WarriorAgent(mesa.Agent):
         self.has_killed_recently = False
 
     def get_average_morale_of_allies_in_flocking_radius(self):
-        morale = [ally.get_morale() for ally in self.scan_for_allies(self.FLOCKING_RADIUS)]
+        return self.get_average_morale(self.scan_for_allies(self.FLOCKING_RADIUS))
+
+    def get_average_morale(self, allies):
+        morale = [ally.get_morale() for ally in allies]
         if not morale:
             return 0
         return sum(morale) / len(morale)
@@ -226,8 +314,7 @@ class RedCommonWarrior(RedWarrior):
         super().__init__(unique_id, army, model)
         self.subtype = "warrior"
         self.name = self.type + self.subtype + str(self.unique_id)
-        self.f = open("logi/" + self.name + ".txt", "w+")
-        self.f.write("Powstałem, jestem " + self.name + "\n\n")
+        self.model.log.register(self)
         self.hp = simulation_parameters.BASIC_HP
         self.initial_hp = self.hp
         self.attack_damage = simulation_parameters.BASIC_DAMAGE
@@ -239,8 +326,7 @@ class BlueCommonWarrior(BlueWarrior):
         super().__init__(unique_id, army, model)
         self.subtype = "warrior"
         self.name = self.type + self.subtype + str(self.unique_id)
-        self.f = open("logi/" + self.name + ".txt", "w+")
-        self.f.write("Powstałem, jestem " + self.name + "\n\n")
+        self.model.log.register(self)
         self.hp = simulation_parameters.BASIC_HP
         self.initial_hp = self.hp
         self.attack_damage = simulation_parameters.BASIC_DAMAGE
@@ -252,8 +338,7 @@ class BlueGeneral(BlueWarrior):
         super().__init__(unique_id, army, model)
         self.subtype = "general"
         self.name = self.type + self.subtype + str(self.unique_id)
-        self.f = open("logi/" + self.name + ".txt", "w+")
-        self.f.write("Powstałem, jestem " + self.name + "\n\n")
+        self.model.log.register(self)
         self.soldiers = []
         self.morale = simulation_parameters.BASIC_MORALE
         self.hp = 3 * simulation_parameters.BASIC_HP
@@ -266,7 +351,7 @@ class BlueGeneral(BlueWarrior):
 
     def step(self):
         self.being_healed = False
-        self.f.write("\nRuch " + str(self.counter) + ":\n")
+        self.log(battle_log.TURN, amount=self.counter)
         allies_in_healing_range = self.scan_for_allies(simulation_parameters.HEALING_RANGE)
         allies_in_flocking_range = self.scan_for_allies(self.FLOCKING_RADIUS)
         for ally in allies_in_healing_range:
@@ -275,20 +360,20 @@ class BlueGeneral(BlueWarrior):
                 break
 
         if self.hp < 0.25 * self.initial_hp and self.being_healed == False:
-            self.f.write("Jest źle, muszę poszukać medyka!\n")
+            self.log(battle_log.SEEK_MEDIC)
             healer_visible = False
             for soldier in allies_in_flocking_range:
                 if soldier.subtype == "healer":
                     healer_visible = True
 
             if healer_visible:
-                self.f.write("Idę poszukać medyka!\n")
+                self.log(battle_log.GO_TO_MEDIC)
                 self.move_medic()
             else:
-                self.f.write("Taki los, medyka nie ma, walczę dalej!\n")
+                self.log(battle_log.NO_MEDIC)
                 enemies_in_attack_range = self.scan_for_enemies(self.attack_range)
                 if enemies_in_attack_range:
-                    enemy = random.choice(enemies_in_attack_range)
+                    enemy = self.random.choice(enemies_in_attack_range)
                     self.attack(enemy)
                 else:
                     self.move()
@@ -296,7 +381,7 @@ class BlueGeneral(BlueWarrior):
         else:
             enemies_in_attack_range = self.scan_for_enemies(self.attack_range)
             if enemies_in_attack_range:
-                enemy = random.choice(enemies_in_attack_range)
+                enemy = self.random.choice(enemies_in_attack_range)
                 self.attack(enemy)
             else:
                 self.move()
@@ -312,20 +397,17 @@ class BlueGeneral(BlueWarrior):
 
         velocity_vector = self.separate_vector(allies) * self.SEPARATION_FACTOR + self.coherence_vector(
             allies) * self.COHERENCE_FACTOR + self.coherence_vector(healers) * simulation_parameters.WANT_HEALING
-        normalised_velocity_vector = velocity_vector / np.linalg.norm(velocity_vector)
-        self.velocity = normalised_velocity_vector * self.movement_speed
-        end_point = self.pos + self.velocity
-        self.model.space.move_agent(self, end_point)
-        self.f.write("Idę na" + str(end_point) + "\n")
+        normalised_velocity_vector = normalise(velocity_vector)
+        self.move_by(normalised_velocity_vector * self.movement_speed)
 
     def die(self):
+        self.model.record_death(self)
         self.type = 'dead'
-        self.f.write("Zginąłem, to koniec.\nObniżam morale swoich żołnierzy.")
-        self.f.close()
+        self.log(battle_log.DIE_COMMANDER)
         for soldier in self.soldiers:
             soldier.morale -= 10
             if soldier.type != "dead":
-                soldier.f.write("Nasz generał powalon! Jak teraz mamy wygrać?\n")
+                soldier.log(battle_log.GENERAL_LOST, self)
         self.model.schedule.remove(self)
 
 
@@ -334,8 +416,7 @@ class RedGeneral(RedWarrior):
         super().__init__(unique_id, army, model)
         self.subtype = "general"
         self.name = self.type + self.subtype + str(self.unique_id)
-        self.f = open("logi/" + self.name + ".txt", "w+")
-        self.f.write("Powstałem, jestem " + self.name + "\n\n")
+        self.model.log.register(self)
         self.soldiers = []
         self.morale = simulation_parameters.BASIC_MORALE
         self.hp = 3 * simulation_parameters.BASIC_HP
@@ -348,7 +429,7 @@ class RedGeneral(RedWarrior):
 
     def step(self):
         self.being_healed = False
-        self.f.write("\nRuch " + str(self.counter) + ":\n")
+        self.log(battle_log.TURN, amount=self.counter)
         allies_in_healing_range = self.scan_for_allies(simulation_parameters.HEALING_RANGE)
         allies_in_flocking_range = self.scan_for_allies(self.FLOCKING_RADIUS)
         for ally in allies_in_healing_range:
@@ -357,20 +438,20 @@ class RedGeneral(RedWarrior):
                 break
 
         if self.hp < 0.25 * self.initial_hp and self.being_healed == False:
-            self.f.write("Jest źle, muszę poszukać medyka!\n")
+            self.log(battle_log.SEEK_MEDIC)
             healer_visible = False
             for soldier in allies_in_flocking_range:
                 if soldier.subtype == "healer":
                     healer_visible = True
 
             if healer_visible:
-                self.f.write("Idę poszukać medyka!\n")
+                self.log(battle_log.GO_TO_MEDIC)
                 self.move_medic()
             else:
-                self.f.write("Taki los, medyka nie ma, walczę dalej!\n")
+                self.log(battle_log.NO_MEDIC)
                 enemies_in_attack_range = self.scan_for_enemies(self.attack_range)
                 if enemies_in_attack_range:
-                    enemy = random.choice(enemies_in_attack_range)
+                    enemy = self.random.choice(enemies_in_attack_range)
                     self.attack(enemy)
                 else:
                     self.move()
@@ -378,7 +459,7 @@ class RedGeneral(RedWarrior):
         else:
             enemies_in_attack_range = self.scan_for_enemies(self.attack_range)
             if enemies_in_attack_range:
-                enemy = random.choice(enemies_in_attack_range)
+                enemy = self.random.choice(enemies_in_attack_range)
                 self.attack(enemy)
             else:
                 self.move()
@@ -394,30 +475,28 @@ class RedGeneral(RedWarrior):
 
         velocity_vector = self.separate_vector(allies) * self.SEPARATION_FACTOR + self.coherence_vector(
             allies) * self.COHERENCE_FACTOR + self.coherence_vector(healers) * simulation_parameters.WANT_HEALING
-        normalised_velocity_vector = velocity_vector / np.linalg.norm(velocity_vector)
-        self.velocity = normalised_velocity_vector * self.movement_speed
-        end_point = self.pos + self.velocity
-        self.model.space.move_agent(self, end_point)
-        self.f.write("Idę na" + str(end_point) + "\n")
+        normalised_velocity_vector = normalise(velocity_vector)
+        self.move_by(normalised_velocity_vector * self.movement_speed)
 
     def die(self):
+        self.model.record_death(self)
         self.type = 'dead'
-        self.f.write("Zginąłem, to koniec.\nObniżam morale swoich żołnierzy.")
-        self.f.close()
+        self.log(battle_log.DIE_COMMANDER)
         for soldier in self.soldiers:
             soldier.morale -= 10
             if soldier.type != "dead":
-                soldier.f.write("Nasz generał powalon! Jak teraz mamy wygrać?\n")
+                soldier.log(battle_log.GENERAL_LOST, self)
         self.model.schedule.remove(self)
 
 
 class RedHealer(RedWarrior):
+    follows_enemies = False
+
     def __init__(self, unique_id, army, model):
         super().__init__(unique_id, army, model)
         self.subtype = "healer"
         self.name = self.type + self.subtype + str(self.unique_id)
-        self.f = open("logi/" + self.name + ".txt", "w+")
-        self.f.write("Powstałem, jestem " + self.name + "\n\n")
+        self.model.log.register(self)
         self.hp = 1.2 * simulation_parameters.BASIC_HP
         self.initial_hp = self.hp
         self.attack_damage = 0.3 * simulation_parameters.BASIC_DAMAGE
@@ -440,14 +519,17 @@ class RedHealer(RedWarrior):
         return velocity_vector
 
     def heal(self, ally):
+        if self.model.combat is not None:
+            self.model.combat.heal(self, ally, self.heal_damage)
+            return
         if ally.hp + self.heal_damage < ally.initial_hp:
             ally.hp += self.heal_damage
-            self.f.write("Leczę " + ally.name + " o " + str(self.heal_damage) + ". Teraz ma " + str(ally.hp) + "\n")
-            ally.f.write(self.name + " uleczył mnie do " + str(ally.hp) + " punktów hp.\n")
+            self.log(battle_log.HEAL, ally, amount=self.heal_damage, value=ally.hp)
+            ally.log(battle_log.HEALED, self, value=ally.hp)
         else:
             ally.hp = ally.initial_hp
-            self.f.write("Leczę " + ally.name + " do pełna. Teraz ma " + str(ally.hp) + "\n")
-            ally.f.write(self.name + " uleczył mnie do pełna, mam " + str(ally.hp) + " punktów życia.\n")
+            self.log(battle_log.HEAL_FULL, ally, value=ally.hp)
+            ally.log(battle_log.HEALED_FULL, self, value=ally.hp)
 
     def step(self):
         """if self.subtype == "general" and self.counter == 1:
@@ -455,7 +537,7 @@ class RedHealer(RedWarrior):
             for soldier in self.soldiers:
                 self.f.write(soldier.name + ", ")
             self.f.write("\n\n")"""  # wypisanie podkomendnych
-        self.f.write("\nRuch " + str(self.counter) + ":\n")
+        self.log(battle_log.TURN, amount=self.counter)
         allies_in_healing_range = self.scan_for_allies(simulation_parameters.HEALING_RANGE)
         if allies_in_healing_range:
             for ally in allies_in_healing_range:
@@ -465,7 +547,7 @@ class RedHealer(RedWarrior):
         else:
             enemies_in_attack_range = self.scan_for_enemies(self.attack_range)
             if enemies_in_attack_range:
-                enemy = random.choice(enemies_in_attack_range)
+                enemy = self.random.choice(enemies_in_attack_range)
                 self.attack(enemy)
             else:
                 self.move()
@@ -485,12 +567,13 @@ class RedHealer(RedWarrior):
 
 
 class BlueHealer(BlueWarrior):
+    follows_enemies = False
+
     def __init__(self, unique_id, army, model):
         super().__init__(unique_id, army, model)
         self.subtype = "healer"
         self.name = self.type + self.subtype + str(self.unique_id)
-        self.f = open("logi/" + self.name + ".txt", "w+")
-        self.f.write("Powstałem, jestem " + self.name + "\n\n")
+        self.model.log.register(self)
         self.morale = 10
         self.hp = 1.2 * simulation_parameters.BASIC_HP
         self.initial_hp = self.hp
@@ -513,17 +596,20 @@ class BlueHealer(BlueWarrior):
         return velocity_vector
 
     def heal(self, ally):
+        if self.model.combat is not None:
+            self.model.combat.heal(self, ally, self.heal_damage)
+            return
         if ally.hp + self.heal_damage < ally.initial_hp:
             ally.hp += self.heal_damage
-            self.f.write("Leczę " + ally.name + " o " + str(self.heal_damage) + ". Teraz ma " + str(ally.hp) + "\n")
-            ally.f.write(self.name + " uleczył mnie do " + str(ally.hp) + " punktów hp.\n")
+            self.log(battle_log.HEAL, ally, amount=self.heal_damage, value=ally.hp)
+            ally.log(battle_log.HEALED, self, value=ally.hp)
         else:
             ally.hp = ally.initial_hp
-            self.f.write("Leczę " + ally.name + " do pełna. Teraz ma " + str(ally.hp) + "\n")
-            ally.f.write(self.name + " uleczył mnie do pełna, mam " + str(ally.hp) + " punktów życia.\n")
+            self.log(battle_log.HEAL_FULL, ally, value=ally.hp)
+            ally.log(battle_log.HEALED_FULL, self, value=ally.hp)
 
     def step(self):
-        self.f.write("\nRuch " + str(self.counter) + ":\n")
+        self.log(battle_log.TURN, amount=self.counter)
         allies_in_healing_range = self.scan_for_allies(self.healing_range)
         if allies_in_healing_range:
             for ally in allies_in_healing_range:
@@ -533,7 +619,7 @@ class BlueHealer(BlueWarrior):
         else:
             enemies_in_attack_range = self.scan_for_enemies(self.attack_range)
             if enemies_in_attack_range:
-                enemy = random.choice(enemies_in_attack_range)
+                enemy = self.random.choice(enemies_in_attack_range)
                 self.attack(enemy)
             else:
                 self.move()
@@ -557,8 +643,7 @@ class RedMarksman(RedWarrior):
         super().__init__(unique_id, army, model)
         self.subtype = "marksman"
         self.name = self.type + self.subtype + str(self.unique_id)
-        self.f = open("logi/" + self.name + ".txt", "w+")
-        self.f.write("Powstałem, jestem " + self.name + "\n\n")
+        self.model.log.register(self)
         self.morale = 10
         self.hp = 0.6 * simulation_parameters.BASIC_HP
         self.initial_hp = self.hp
@@ -569,7 +654,7 @@ class RedMarksman(RedWarrior):
         self.movement_speed = 1.3 * simulation_parameters.RED_MOVEMENT_SPEED
 
     def step(self):
-        self.f.write("\nRuch " + str(self.counter) + ":\n")
+        self.log(battle_log.TURN, amount=self.counter)
         enemies_in_attack_range = self.scan_for_enemies(self.attack_range)
         attack_to_carry = True
         if enemies_in_attack_range:
@@ -591,7 +676,7 @@ class RedMarksman(RedWarrior):
                     attack_to_carry = False
                     break
             if attack_to_carry:
-                enemy = random.choice(enemies_in_attack_range)
+                enemy = self.random.choice(enemies_in_attack_range)
                 self.attack(enemy)
         else:
             self.move()
@@ -599,19 +684,21 @@ class RedMarksman(RedWarrior):
         self.counter += 1
 
     def precise_attack(self, enemy):
-        self.f.write("Celuję we wroga " + enemy.name + "...\n")
-        shot = random.randrange(10)
+        self.log(battle_log.AIM, enemy)
+        shot = self.random.randrange(10)
         if shot < self.success_chance:
             self.morale += 0.05
-            self.f.write("Tak, trafiłem go! Zadałem mu " + str(self.attack_damage) + " punktów obrażeń.\n")
+            self.log(battle_log.HIT, enemy, amount=self.attack_damage)
             self.damage_inflicted_recently = self.attack_damage
-            if enemy.receive_precise_damage(self.attack_damage, self.name):
+            if self.model.combat is not None:
+                self.model.combat.attack(self, enemy, self.attack_damage, precise=True)
+            elif enemy.receive_precise_damage(self.attack_damage, self):
                 self.has_killed_recently = True
-                self.f.write("W dodatku go zabiłem!\n")
+                self.log(battle_log.HIT_KILL, enemy)
         else:
             self.morale -= 0.1
             self.damage_inflicted_recently = 0
-            self.f.write("O nie, chybiłem! Co za wstyd!\n")
+            self.log(battle_log.MISS, enemy)
 
 
 class BlueMarksman(BlueWarrior):
@@ -619,8 +706,7 @@ class BlueMarksman(BlueWarrior):
         super().__init__(unique_id, army, model)
         self.subtype = "marksman"
         self.name = self.type + self.subtype + str(self.unique_id)
-        self.f = open("logi/" + self.name + ".txt", "w+")
-        self.f.write("Powstałem, jestem " + self.name + "\n\n")
+        self.model.log.register(self)
         self.morale = 10
         self.hp = 0.6 * simulation_parameters.BASIC_HP
         self.initial_hp = self.hp
@@ -631,7 +717,7 @@ class BlueMarksman(BlueWarrior):
         self.movement_speed = 1.3 * simulation_parameters.BLUE_MOVEMENT_SPEED
 
     def step(self):
-        self.f.write("\nRuch " + str(self.counter) + ":\n")
+        self.log(battle_log.TURN, amount=self.counter)
         enemies_in_attack_range = self.scan_for_enemies(self.attack_range)
         attack_to_carry = True
         if enemies_in_attack_range:
@@ -653,7 +739,7 @@ class BlueMarksman(BlueWarrior):
                     attack_to_carry = False
                     break
             if attack_to_carry:
-                enemy = random.choice(enemies_in_attack_range)
+                enemy = self.random.choice(enemies_in_attack_range)
                 self.attack(enemy)
         else:
             self.move()
@@ -661,19 +747,21 @@ class BlueMarksman(BlueWarrior):
         self.counter += 1
 
     def precise_attack(self, enemy):
-        self.f.write("Celuję we wroga " + enemy.name + "...\n")
-        shot = random.randrange(10)
+        self.log(battle_log.AIM, enemy)
+        shot = self.random.randrange(10)
         if shot < self.success_chance:
             self.morale += 0.05
-            self.f.write("Tak, trafiłem go! Zadałem mu " + str(self.attack_damage) + " punktów obrażeń.\n")
+            self.log(battle_log.HIT, enemy, amount=self.attack_damage)
             self.damage_inflicted_recently = self.attack_damage
-            if enemy.receive_precise_damage(self.attack_damage, self.name):
+            if self.model.combat is not None:
+                self.model.combat.attack(self, enemy, self.attack_damage, precise=True)
+            elif enemy.receive_precise_damage(self.attack_damage, self):
                 self.has_killed_recently = True
-                self.f.write("W dodatku go zabiłem!\n")
+                self.log(battle_log.HIT_KILL, enemy)
         else:
             self.morale -= 0.1
             self.damage_inflicted_recently = 0
-            self.f.write("O nie, chybiłem! Co za wstyd!\n")
+            self.log(battle_log.MISS, enemy)
 
 
 class RedGuard(RedWarrior):
@@ -681,8 +769,7 @@ class RedGuard(RedWarrior):
         super().__init__(unique_id, army, model)
         self.subtype = "guard"
         self.name = self.type + self.subtype + str(self.unique_id)
-        self.f = open("logi/" + self.name + ".txt", "w+")
-        self.f.write("Powstałem, jestem " + self.name + "\n\n")
+        self.model.log.register(self)
         self.morale = 10
         self.hp = 6 * simulation_parameters.BASIC_HP
         self.attack_range = 0.4 * simulation_parameters.BASIC_ATTACK_RANGE
@@ -694,10 +781,12 @@ class RedGuard(RedWarrior):
         self.guarding = False
 
     def step(self):
-        self.guarded_ally.protected = False
-        self.guarded_ally = self
-        self.guarding = False
-        self.f.write("\nRuch " + str(self.counter) + ":\n")
+        # w trybie simultaneous_combat ochrona z poprzedniego kroku konczy sie dopiero w Combat.resolve
+        if self.model.combat is None:
+            self.guarded_ally.protected = False
+            self.guarded_ally = self
+            self.guarding = False
+        self.log(battle_log.TURN, amount=self.counter)
         allies_to_guard = self.scan_for_allies(simulation_parameters.GUARDING_RANGE)
         enemies_close = self.scan_for_enemies(5 * simulation_parameters.BASIC_ATTACK_RANGE)
         for guard in allies_to_guard:
@@ -705,26 +794,26 @@ class RedGuard(RedWarrior):
                 allies_to_guard.remove(guard)
 
         if allies_to_guard and enemies_close:
-            ally = random.choice(allies_to_guard)
-            while ally.protected:
+            ally = self.random.choice(allies_to_guard)
+            while ally.protected and ally.guarder is not self:
                 allies_to_guard.remove(ally)
                 if not allies_to_guard:
-                    self.f.write("Nie ma kogo chronić\n")
+                    self.log(battle_log.NOBODY_TO_GUARD)
                     enemies_in_attack_range = self.scan_for_enemies(self.attack_range)
                     if enemies_in_attack_range:
-                        enemy = random.choice(enemies_in_attack_range)
+                        enemy = self.random.choice(enemies_in_attack_range)
                         self.attack(enemy)
                         return
                     else:
                         self.move()
                         return
-                ally = random.choice(allies_to_guard)
+                ally = self.random.choice(allies_to_guard)
             self.protect(ally)
             self.move()
         else:
             enemies_in_attack_range = self.scan_for_enemies(self.attack_range)
             if enemies_in_attack_range:
-                enemy = random.choice(enemies_in_attack_range)
+                enemy = self.random.choice(enemies_in_attack_range)
                 self.attack(enemy)
             else:
                 self.move()
@@ -732,19 +821,19 @@ class RedGuard(RedWarrior):
         self.counter += 1
 
     def protect(self, ally):
+        if self.model.combat is not None:
+            self.model.combat.protect(self, ally)
+            return
         self.guarding = True
-        self.f.write("W tym ruchu chronię sojusznika " + ally.name + ".\n")
+        self.log(battle_log.PROTECT, ally)
         self.guarded_ally = ally
         ally.guarder = self
         ally.protected = True
         self.guarding = True
 
-    def receive_ally_damage(self, damage, name):
+    def receive_ally_damage(self, damage, attacker):
         self.hp -= damage
-        self.f.write(
-            "Oj! Chroniąc " + self.guarded_ally.name + " otrzymałem " + str(
-                damage) + " punktów obrażeń od " + name + ". Teraz mam " + str(
-                self.hp) + " punktów zdrowia.\n")
+        self.log(battle_log.GUARD_DAMAGED, attacker, self.guarded_ally, amount=damage, value=self.hp)
 
         if self.hp <= 0:
             self.die()
@@ -752,11 +841,11 @@ class RedGuard(RedWarrior):
         return False
 
     def die(self):
+        self.model.record_death(self)
         self.type = 'dead'
-        self.f.write("Zginąłem, to koniec")
+        self.log(battle_log.DIE)
         self.guarding = False
         self.guarded_ally.protected = False
-        self.f.close()
         self.model.schedule.remove(self)
 
 
@@ -765,8 +854,7 @@ class BlueGuard(BlueWarrior):
         super().__init__(unique_id, army, model)
         self.subtype = "guard"
         self.name = self.type + self.subtype + str(self.unique_id)
-        self.f = open("logi/" + self.name + ".txt", "w+")
-        self.f.write("Powstałem, jestem " + self.name + "\n\n")
+        self.model.log.register(self)
         self.morale = 10
         self.hp = 6 * simulation_parameters.BASIC_HP
         self.attack_range = 0.4 * simulation_parameters.BASIC_ATTACK_RANGE
@@ -778,10 +866,12 @@ class BlueGuard(BlueWarrior):
         self.guarding = False
 
     def step(self):
-        self.guarded_ally.protected = False
-        self.guarded_ally = self
-        self.guarding = False
-        self.f.write("\nRuch " + str(self.counter) + ":\n")
+        # w trybie simultaneous_combat ochrona z poprzedniego kroku konczy sie dopiero w Combat.resolve
+        if self.model.combat is None:
+            self.guarded_ally.protected = False
+            self.guarded_ally = self
+            self.guarding = False
+        self.log(battle_log.TURN, amount=self.counter)
         allies_to_guard = self.scan_for_allies(simulation_parameters.GUARDING_RANGE)
         enemies_close = self.scan_for_enemies(5 * simulation_parameters.BASIC_ATTACK_RANGE)
         for guard in allies_to_guard:
@@ -789,26 +879,26 @@ class BlueGuard(BlueWarrior):
                 allies_to_guard.remove(guard)
 
         if allies_to_guard and enemies_close:
-            ally = random.choice(allies_to_guard)
-            while ally.protected:
+            ally = self.random.choice(allies_to_guard)
+            while ally.protected and ally.guarder is not self:
                 allies_to_guard.remove(ally)
                 if not allies_to_guard:
-                    self.f.write("Nie ma kogo chronić\n")
+                    self.log(battle_log.NOBODY_TO_GUARD)
                     enemies_in_attack_range = self.scan_for_enemies(self.attack_range)
                     if enemies_in_attack_range:
-                        enemy = random.choice(enemies_in_attack_range)
+                        enemy = self.random.choice(enemies_in_attack_range)
                         self.attack(enemy)
                         return
                     else:
                         self.move()
                         return
-                ally = random.choice(allies_to_guard)
+                ally = self.random.choice(allies_to_guard)
             self.protect(ally)
             self.move()
         else:
             enemies_in_attack_range = self.scan_for_enemies(self.attack_range)
             if enemies_in_attack_range:
-                enemy = random.choice(enemies_in_attack_range)
+                enemy = self.random.choice(enemies_in_attack_range)
                 self.attack(enemy)
             else:
                 self.move()
@@ -816,18 +906,19 @@ class BlueGuard(BlueWarrior):
         self.counter += 1
 
     def protect(self, ally):
+        if self.model.combat is not None:
+            self.model.combat.protect(self, ally)
+            return
         self.guarding = True
-        self.f.write("W tym ruchu chronię sojusznika " + ally.name + ".\n")
+        self.log(battle_log.PROTECT, ally)
         self.guarded_ally = ally
         ally.guarder = self
         ally.protected = True
         self.guarding = True
 
-    def receive_ally_damage(self, damage, name):
+    def receive_ally_damage(self, damage, attacker):
         self.hp -= damage
-        self.f.write(
-            "Oj! Chroniąc " + self.guarded_ally.name + " otrzymałem " + str(damage) + " punktów obrażeń od " + name + ". Teraz mam " + str(
-                self.hp) + " punktów zdrowia.\n")
+        self.log(battle_log.GUARD_DAMAGED, attacker, self.guarded_ally, amount=damage, value=self.hp)
 
         if self.hp <= 0:
             self.die()
@@ -835,21 +926,22 @@ class BlueGuard(BlueWarrior):
         return False
 
     def die(self):
+        self.model.record_death(self)
         self.type = 'dead'
-        self.f.write("Zginąłem, to koniec")
+        self.log(battle_log.DIE)
         self.guarding = False
         self.guarded_ally.protected = False
-        self.f.close()
         self.model.schedule.remove(self)
 
 class RedFlagger(RedWarrior):
+    follows_enemies = False
+
     def __init__(self, unique_id, army, model):
         super().__init__(unique_id, army, model)
         self.subtype = "flagger"
         self.name = self.type + self.subtype + str(self.unique_id)
-        self.f = open("logi/" + self.name + ".txt", "w+")
-        self.f.write("Powstałem, jestem " + self.name + "\n\n")
-        self.f.write("Moja armia: " + self.army + "\n\n")
+        self.model.log.register(self)
+        self.log(battle_log.ARMY)
         self.morale = 10
         self.soldiers = []
         self.hp = simulation_parameters.BASIC_HP
@@ -877,7 +969,7 @@ class RedFlagger(RedWarrior):
                     for soldier in self.soldiers:
                         self.f.write(soldier.name + ", ")
                     self.f.write("\n\n")"""  # wypisanie podkomendnych
-        self.f.write("\nRuch " + str(self.counter) + ":\n")
+        self.log(battle_log.TURN, amount=self.counter)
         allies_in_courage_range = self.scan_for_allies(2 * simulation_parameters.HEALING_RANGE)
         allies_to_courage = []
         for soldier in allies_in_courage_range:
@@ -887,7 +979,7 @@ class RedFlagger(RedWarrior):
             self.courage(allies_to_courage)
         enemies_in_attack_range = self.scan_for_enemies(self.attack_range)
         if enemies_in_attack_range:
-            enemy = random.choice(enemies_in_attack_range)
+            enemy = self.random.choice(enemies_in_attack_range)
             self.attack(enemy)
         else:
             self.move()
@@ -895,32 +987,36 @@ class RedFlagger(RedWarrior):
         self.counter += 1
 
     def courage(self, allies):
-        self.f.write("Zwiększam morale wszystkich pobliskich sojuszników: ")
+        if self.model.combat is not None:
+            self.model.combat.encourage(self, allies)
+            return
+        self.log(battle_log.COURAGE)
         for soldier in allies:
             soldier.morale += 0.5
-            self.f.write(soldier.name + ", ")
+            self.log(battle_log.COURAGE_ALLY, soldier)
             if soldier.type != "dead":
-                soldier.f.write("Do boju! Moje morale są zwiększone przez chorążego " + self.name + "!\n")
-        self.f.write(".\n")
+                soldier.log(battle_log.ENCOURAGED, self)
+        self.log(battle_log.COURAGE_END)
 
     def die(self):
+        self.model.record_death(self)
         self.type = 'dead'
-        self.f.write("Zginąłem, to koniec.\nObniżam morale swoich żołnierzy.")
-        self.f.close()
+        self.log(battle_log.DIE_COMMANDER)
         for soldier in self.soldiers:
             soldier.morale -= 10
             if soldier.type != "dead":
-                soldier.f.write("O nie! Chorąży nie żyje! Nasza flaga!\n")
+                soldier.log(battle_log.FLAGGER_LOST, self)
         self.model.schedule.remove(self)
 
 class BlueFlagger(BlueWarrior):
+    follows_enemies = False
+
     def __init__(self, unique_id, army, model):
         super().__init__(unique_id, army, model)
         self.subtype = "flagger"
         self.name = self.type + self.subtype + str(self.unique_id)
-        self.f = open("logi/" + self.name + ".txt", "w+")
-        self.f.write("Powstałem, jestem " + self.name + "\n\n")
-        self.f.write("Moja armia: " + self.army + "\n\n")
+        self.model.log.register(self)
+        self.log(battle_log.ARMY)
         self.morale = 10
         self.soldiers = []
         self.hp = simulation_parameters.BASIC_HP
@@ -948,7 +1044,7 @@ class BlueFlagger(BlueWarrior):
                     for soldier in self.soldiers:
                         self.f.write(soldier.name + ", ")
                     self.f.write("\n\n")"""  # wypisanie podkomendnych
-        self.f.write("\nRuch " + str(self.counter) + ":\n")
+        self.log(battle_log.TURN, amount=self.counter)
         allies_in_courage_range = self.scan_for_allies(2 * simulation_parameters.HEALING_RANGE)
         allies_to_courage = []
         for soldier in allies_in_courage_range:
@@ -958,7 +1054,7 @@ class BlueFlagger(BlueWarrior):
             self.courage(allies_to_courage)
         enemies_in_attack_range = self.scan_for_enemies(self.attack_range)
         if enemies_in_attack_range:
-            enemy = random.choice(enemies_in_attack_range)
+            enemy = self.random.choice(enemies_in_attack_range)
             self.attack(enemy)
         else:
             self.move()
@@ -966,20 +1062,23 @@ class BlueFlagger(BlueWarrior):
         self.counter += 1
 
     def courage(self, allies):
-        self.f.write("Zwiększam morale wszystkich pobliskich sojuszników: ")
+        if self.model.combat is not None:
+            self.model.combat.encourage(self, allies)
+            return
+        self.log(battle_log.COURAGE)
         for soldier in allies:
             soldier.morale += 0.5
-            self.f.write(soldier.name + ", ")
+            self.log(battle_log.COURAGE_ALLY, soldier)
             if soldier.type != "dead":
-                soldier.f.write("Do boju! Moje morale są zwiększone przez chorążego " + self.name + "!\n")
-        self.f.write(".\n")
+                soldier.log(battle_log.ENCOURAGED, self)
+        self.log(battle_log.COURAGE_END)
 
     def die(self):
+        self.model.record_death(self)
         self.type = 'dead'
-        self.f.write("Zginąłem, to koniec.\nObniżam morale swoich żołnierzy.")
-        self.f.close()
+        self.log(battle_log.DIE_COMMANDER)
         for soldier in self.soldiers:
             soldier.morale -= 10
             if soldier.type != "dead":
-                soldier.f.write("O nie! Chorąży nie żyje! Nasza flaga!\n")
+                soldier.log(battle_log.FLAGGER_LOST, self)
         self.model.schedule.remove(self)
\ No newline at end of file